@@ -0,0 +1,166 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import case, func, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models import ConversationSummary, Message
+
+PREVIEW_LENGTH = 100
+
+
+def _upsert(db: AsyncSession):
+    """Return the dialect-specific INSERT construct supporting ON CONFLICT."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(ConversationSummary)
+    if dialect == "sqlite":
+        return sqlite.insert(ConversationSummary)
+    raise RuntimeError(f"Unsupported database dialect for upserts: {dialect}")
+
+
+async def record_messages(db: AsyncSession, messages: Iterable[Message]):
+    """
+    Fold newly inserted messages into both participants' conversation summaries.
+
+    Runs in the caller's transaction so the summary commits atomically with
+    the messages. Messages must already have ids (flush before calling).
+    Rows are aggregated per (user, partner) first so a batch issues a single
+    multi-row upsert; out-of-order commits never move "last message" backwards.
+
+    Args:
+        db (AsyncSession): Session holding the uncommitted messages
+        messages (Iterable[Message]): Messages to fold in
+    """
+    rows: Dict[Tuple[int, int], dict] = {}
+    for msg in messages:
+        for user_id, partner_id, unread in (
+            (msg.sender_id, msg.receiver_id, 0),
+            (msg.receiver_id, msg.sender_id, 1),
+        ):
+            row = rows.get((user_id, partner_id))
+            if row is None:
+                row = rows[(user_id, partner_id)] = {
+                    "user_id": user_id,
+                    "partner_id": partner_id,
+                    "unread_count": 0,
+                }
+            if row.get("last_message_id", 0) < msg.id:
+                row["last_message_id"] = msg.id
+                row["last_message_preview"] = msg.content[:PREVIEW_LENGTH]
+                row["last_message_time"] = msg.timestamp
+            row["unread_count"] += unread
+
+    if not rows:
+        return
+
+    # Key order, as in append_events: concurrent batches lock summary rows
+    # in the same order and cannot deadlock
+    stmt = _upsert(db).values([row for _, row in sorted(rows.items())])
+    table = ConversationSummary.__table__
+    newer = stmt.excluded.last_message_id > table.c.last_message_id
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.partner_id],
+        set_={
+            "last_message_id": case((newer, stmt.excluded.last_message_id), else_=table.c.last_message_id),
+            "last_message_preview": case((newer, stmt.excluded.last_message_preview), else_=table.c.last_message_preview),
+            "last_message_time": case((newer, stmt.excluded.last_message_time), else_=table.c.last_message_time),
+            "unread_count": table.c.unread_count + stmt.excluded.unread_count,
+        },
+    )
+    await db.exec(stmt)
+
+
+async def _resolve_up_to(db: AsyncSession, user_id: int, partner_id: int, up_to_id: Optional[int]) -> Optional[int]:
+    """Pin an open-ended receipt to the newest message so later sends stay unacknowledged."""
+    if up_to_id is not None:
+        return up_to_id
+    return (await db.exec(
+        select(func.max(Message.id)).where(
+            (Message.sender_id == partner_id) & (Message.receiver_id == user_id)
+        )
+    )).one()
+
+
+async def mark_delivered(
+    db: AsyncSession, user_id: int, partner_id: int, up_to_id: Optional[int] = None
+) -> Tuple[int, Optional[int]]:
+    """
+    Mark messages from ``partner_id`` to ``user_id`` as delivered with one range UPDATE.
+
+    Does not commit.
+
+    Args:
+        db (AsyncSession): Database session
+        user_id (int): Recipient acknowledging delivery
+        partner_id (int): Sender of the messages
+        up_to_id (Optional[int]): Highest message id delivered; all messages if None
+
+    Returns:
+        Tuple[int, Optional[int]]: Messages that changed state, and the id the
+        receipt covers (None if the conversation is empty)
+    """
+    up_to_id = await _resolve_up_to(db, user_id, partner_id, up_to_id)
+    if up_to_id is None:
+        return 0, None
+    result = await db.exec(
+        update(Message)
+        .where(
+            (Message.sender_id == partner_id)
+            & (Message.receiver_id == user_id)
+            & (Message.id <= up_to_id)
+            & (Message.is_delivered == False)  # noqa: E712
+        )
+        .values(is_delivered=True)
+    )
+    return result.rowcount or 0, up_to_id
+
+
+async def mark_read(
+    db: AsyncSession, user_id: int, partner_id: int, up_to_id: Optional[int] = None
+) -> Tuple[int, Optional[int]]:
+    """
+    Mark messages from ``partner_id`` to ``user_id`` as read with one range UPDATE.
+
+    Read implies delivered. Does not commit.
+
+    Args:
+        db (AsyncSession): Database session
+        user_id (int): Reader
+        partner_id (int): Sender of the messages being read
+        up_to_id (Optional[int]): Highest message id read; all messages if None
+
+    Returns:
+        Tuple[int, Optional[int]]: Messages that changed from unread to read,
+        and the id the receipt covers (None if the conversation is empty)
+    """
+    up_to_id = await _resolve_up_to(db, user_id, partner_id, up_to_id)
+    if up_to_id is None:
+        return 0, None
+    result = await db.exec(
+        update(Message)
+        .where(
+            (Message.sender_id == partner_id)
+            & (Message.receiver_id == user_id)
+            & (Message.id <= up_to_id)
+            & (Message.is_read == False)  # noqa: E712
+        )
+        .values(is_read=True, is_delivered=True)
+    )
+    marked = result.rowcount or 0
+    if not marked:
+        return 0, up_to_id
+
+    # Relative update: a send that commits between the two UPDATEs has
+    # already incremented the counter and must not be wiped.
+    unread = case(
+        (ConversationSummary.unread_count > marked, ConversationSummary.unread_count - marked),
+        else_=0,
+    )
+    await db.exec(
+        update(ConversationSummary)
+        .where((ConversationSummary.user_id == user_id) & (ConversationSummary.partner_id == partner_id))
+        .values(unread_count=unread)
+    )
+    return marked, up_to_id
@@ -1,4 +1,6 @@
 from sqlmodel import create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
 import os
 from dotenv import load_dotenv
 
@@ -47,4 +49,52 @@ def get_db():
     finally:
         db.close()
 
+def get_async_database_url():
+    """Get the async driver URL for the configured database.
+
+    postgresql:// URLs are served by asyncpg and sqlite:// URLs by aiosqlite.
+    asyncpg does not understand libpq's ``sslmode`` query parameter, so it is
+    stripped here and SSL is requested through ``connect_args`` instead.
+    """
+    database_url = get_database_url()
+    if database_url.startswith("postgres://"):
+        database_url = "postgresql://" + database_url[len("postgres://"):]
+    if database_url.startswith("postgresql://"):
+        database_url = "postgresql+asyncpg://" + database_url[len("postgresql://"):]
+        base, _, query = database_url.partition("?")
+        params = [p for p in query.split("&") if p and not p.startswith("sslmode=")]
+        database_url = base + ("?" + "&".join(params) if params else "")
+    elif database_url.startswith("sqlite://"):
+        database_url = "sqlite+aiosqlite://" + database_url[len("sqlite://"):]
+    return database_url
+
+def get_async_engine():
+    """Get async database engine, creating it if necessary."""
+    if not hasattr(get_async_engine, '_engine'):
+        database_url = get_async_database_url()
+        engine_kwargs = {}
+        if not database_url.startswith("sqlite"):
+            engine_kwargs["pool_pre_ping"] = True
+            engine_kwargs["pool_recycle"] = 300
+        if os.getenv("ENVIRONMENT") == "production" and database_url.startswith("postgresql+asyncpg"):
+            engine_kwargs["connect_args"] = {"ssl": "require"}
+
+        get_async_engine._engine = create_async_engine(database_url, **engine_kwargs)
+    return get_async_engine._engine
+
+async def get_async_db():
+    """Get async database session.
+
+    Objects are not expired on commit: attribute access after a commit
+    would otherwise need implicit IO, which is not allowed on the event loop.
+    """
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as db:
+        yield db
+
+async def dispose_async_engine():
+    """Close pooled async connections (called on shutdown)."""
+    if hasattr(get_async_engine, '_engine'):
+        await get_async_engine._engine.dispose()
+        del get_async_engine._engine
+
 # To create tables, call SQLModel.metadata.create_all(get_engine()) in main
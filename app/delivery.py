@@ -0,0 +1,176 @@
+import asyncio
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.database import get_async_engine
+from app.models import DeliveryEvent, Message, User
+
+# Events per replay frame sent to a reconnecting client
+REPLAY_BATCH_SIZE = 200
+# Logged events older than this are deleted; clients further behind resync
+DELIVERY_RETENTION_HOURS = float(os.getenv("DELIVERY_RETENTION_HOURS", "72"))
+# How often old events are deleted, and how many rows per DELETE
+DELIVERY_PURGE_INTERVAL_SECONDS = float(os.getenv("DELIVERY_PURGE_INTERVAL_SECONDS", "3600"))
+DELIVERY_PURGE_BATCH_SIZE = int(os.getenv("DELIVERY_PURGE_BATCH_SIZE", "1000"))
+
+UserEvent = Tuple[int, dict]
+
+
+def new_message_event(message: Message, sender_username: Optional[str] = None) -> dict:
+    """Build the realtime event announcing a stored message."""
+    payload = {
+        "id": message.id,
+        "content": message.content,
+        "sender_id": message.sender_id,
+        "receiver_id": message.receiver_id,
+        "timestamp": message.timestamp.isoformat(),
+    }
+    if sender_username is not None:
+        payload["sender_username"] = sender_username
+    return {"type": "new_message", "message": payload}
+
+
+async def append_events(db: AsyncSession, events: Iterable[UserEvent]) -> List[UserEvent]:
+    """
+    Number events per recipient and store them in the delivery log.
+
+    Sequence numbers come from ``User.delivery_seq``: one UPDATE ... RETURNING
+    per recipient reserves a contiguous block for all of that user's events,
+    and the row lock it takes keeps sequence order equal to commit order.
+    Recipients are locked in id order so concurrent batches cannot deadlock.
+    Does not commit.
+
+    Args:
+        db (AsyncSession): Session of the transaction producing the events
+        events (Iterable[UserEvent]): (recipient id, event frame) pairs
+
+    Returns:
+        List[UserEvent]: The events with their ``seq`` set, per recipient in
+        submission order; events for unknown users are dropped
+    """
+    by_user: Dict[int, List[dict]] = defaultdict(list)
+    for user_id, event in events:
+        by_user[user_id].append(event)
+
+    now = datetime.utcnow()
+    stamped: List[UserEvent] = []
+    rows = []
+    for user_id in sorted(by_user):
+        batch = by_user[user_id]
+        last_seq = (await db.exec(
+            update(User)
+            .where(User.id == user_id)
+            .values(delivery_seq=User.delivery_seq + len(batch))
+            .returning(User.delivery_seq)
+        )).scalar_one_or_none()
+        if last_seq is None:
+            continue
+        for seq, event in enumerate(batch, start=last_seq - len(batch) + 1):
+            event = {**event, "seq": seq}
+            stamped.append((user_id, event))
+            rows.append({
+                "user_id": user_id,
+                "seq": seq,
+                "event_type": event.get("type", "event"),
+                "payload": json.dumps(event, default=str),
+                "created_at": now,
+            })
+
+    if rows:
+        await db.exec(insert(DeliveryEvent), params=rows)
+    return stamped
+
+
+async def fetch_events(db: AsyncSession, user_id: int, after_seq: int, limit: int = REPLAY_BATCH_SIZE) -> List[dict]:
+    """Read up to ``limit`` logged events of a user with seq > after_seq, oldest first."""
+    rows = (await db.exec(
+        select(DeliveryEvent.payload)
+        .where((DeliveryEvent.user_id == user_id) & (DeliveryEvent.seq > after_seq))
+        .order_by(DeliveryEvent.seq)
+        .limit(limit)
+    )).all()
+    return [json.loads(payload) for payload in rows]
+
+
+async def replay_floor(db: AsyncSession, user_id: int) -> int:
+    """
+    Lowest seq of user_id that can still be replayed.
+
+    Older events were purged. With nothing retained the floor is the next
+    seq to be assigned, so every seq up to the current one is gone.
+    """
+    oldest = (await db.exec(
+        select(func.min(DeliveryEvent.seq)).where(DeliveryEvent.user_id == user_id)
+    )).one()
+    if oldest is not None:
+        return oldest
+    current = (await db.exec(select(User.delivery_seq).where(User.id == user_id))).one_or_none()
+    return (current or 0) + 1
+
+
+async def purge_delivery_events(
+    db: AsyncSession,
+    retention: timedelta = timedelta(hours=DELIVERY_RETENTION_HOURS),
+    batch_size: int = DELIVERY_PURGE_BATCH_SIZE,
+) -> int:
+    """
+    Delete logged events older than retention a batch at a time so no
+    single statement holds locks on a large range.
+
+    Returns:
+        int: Number of events deleted
+    """
+    purged = 0
+    cutoff = datetime.utcnow() - retention
+    while True:
+        ids = select(DeliveryEvent.id).where(DeliveryEvent.created_at < cutoff).limit(batch_size)
+        result = await db.exec(delete(DeliveryEvent).where(DeliveryEvent.id.in_(ids)))
+        await db.commit()
+        purged += result.rowcount or 0
+        if (result.rowcount or 0) < batch_size:
+            return purged
+
+
+async def run_delivery_maintenance():
+    """Background loop: purge delivery events past retention."""
+    while True:
+        try:
+            async with AsyncSession(get_async_engine(), expire_on_commit=False) as db:
+                purged = await purge_delivery_events(db)
+            if purged:
+                print(f"Purged {purged} delivery events")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Delivery maintenance error: {e}")
+        await asyncio.sleep(DELIVERY_PURGE_INTERVAL_SECONDS)
+
+
+async def publish_durable(hub, events: Iterable[UserEvent]):
+    """
+    Log events for replay in their own transaction, then push them live.
+
+    If logging fails the events are still pushed, just without a sequence
+    number, so realtime delivery never depends on the log being writable.
+
+    Args:
+        hub: ConnectionHub to push through
+        events (Iterable[UserEvent]): (recipient id, event frame) pairs
+    """
+    events = list(events)
+    try:
+        async with AsyncSession(get_async_engine(), expire_on_commit=False) as db:
+            stamped = await append_events(db, events)
+            await db.commit()
+    except Exception as e:
+        print(f"Delivery log write failed: {e}")
+        stamped = events
+    for user_id, event in stamped:
+        await hub.send(user_id, event)
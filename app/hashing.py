@@ -0,0 +1,77 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+# bcrypt releases the GIL, so a thread per core keeps every core busy
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hash/verify calls allowed to wait for a worker before new ones are refused;
+# the worst-case wait is about (queue / workers + 1) hash times
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", str(4 * PASSWORD_HASH_WORKERS)))
+# Seconds a refused client is told to wait before retrying
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "1"))
+
+T = TypeVar("T")
+
+
+class PasswordHasher:
+    """
+    Runs password hashing on a dedicated, bounded thread pool.
+
+    bcrypt is deliberately slow; running it on the event loop stalls every
+    request, and running it on the default threadpool lets a login burst
+    starve unrelated sync routes. Here at most ``workers`` hashes run at
+    once and at most ``max_queue`` more wait. Anything beyond that is
+    refused straight away with 503 and Retry-After instead of queueing
+    behind work that would already exceed the client's timeout.
+    """
+
+    def __init__(
+        self,
+        context: CryptContext,
+        workers: int = PASSWORD_HASH_WORKERS,
+        max_queue: int = PASSWORD_HASH_QUEUE_SIZE,
+        retry_after: int = PASSWORD_HASH_RETRY_AFTER,
+    ):
+        self.context = context
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._submit(self.context.verify, password, hashed_password)
+
+    async def _submit(self, fn: Callable[..., T], *args) -> T:
+        # Only the event loop thread touches in_flight, so no lock is needed
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication is busy, please retry",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        self.in_flight += 1
+        future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        future.add_done_callback(self._release)
+        # A cancelled request leaves the hash running; keep its slot until it ends
+        return await asyncio.shield(future)
+
+    def _release(self, _future):
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+        }
@@ -1,8 +1,21 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import auth, chat, call, payment, user
-from app.database import get_engine
+from app.routers import auth, chat, call, payment, realtime, user
+from app.routers.auth import password_hasher, revocations, user_cache
+from app.database import get_engine, dispose_async_engine
+from app.realtime.admission import DRAIN_TIMEOUT_SECONDS, admission
+from app.realtime.batch_writer import message_writer
+from app.realtime.call_history import call_history
+from app.realtime.heartbeat import heartbeat
+from app.realtime.hub import registry
+from app.realtime.presence import presence
+from app.realtime.pubsub import get_pubsub
+from app.realtime.timers import timers
+from app.delivery import run_delivery_maintenance
+from app.search import ensure_search_schema
+from app.sessions import run_session_maintenance
 from sqlmodel import SQLModel
+import asyncio
 import os
 from datetime import datetime
 
@@ -53,6 +66,14 @@ def ensure_db_schema():
                 conn.exec_driver_sql(
                     'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP WITHOUT TIME ZONE'
                 )
+            if "delivery_seq" not in existing:
+                conn.exec_driver_sql(
+                    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS delivery_seq INTEGER NOT NULL DEFAULT 0'
+                )
+            if "token_version" not in existing:
+                conn.exec_driver_sql(
+                    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS token_version INTEGER NOT NULL DEFAULT 0'
+                )
 
             # Check and backfill columns for "message" table
             result = conn.exec_driver_sql(
@@ -84,15 +105,115 @@ def ensure_db_schema():
                 conn.exec_driver_sql(
                     'ALTER TABLE "message" ADD COLUMN IF NOT EXISTS is_read BOOLEAN DEFAULT FALSE'
                 )
+            if "is_delivered" not in msg_existing:
+                conn.exec_driver_sql(
+                    'ALTER TABLE "message" ADD COLUMN IF NOT EXISTS is_delivered BOOLEAN DEFAULT FALSE'
+                )
+                # Anything already read was necessarily delivered
+                conn.exec_driver_sql(
+                    'UPDATE "message" SET is_delivered = TRUE WHERE is_read'
+                )
             if "message_type" not in msg_existing:
                 conn.exec_driver_sql(
                     'ALTER TABLE "message" ADD COLUMN IF NOT EXISTS message_type VARCHAR(50) DEFAULT \'text\''
                 )
 
+            # Session revocation (the table itself is created by create_all)
+            if conn.exec_driver_sql("SELECT to_regclass('usersession')").scalar():
+                conn.exec_driver_sql(
+                    'ALTER TABLE "usersession" ADD COLUMN IF NOT EXISTS revoked_at TIMESTAMP WITHOUT TIME ZONE'
+                )
+                conn.exec_driver_sql(
+                    'CREATE INDEX IF NOT EXISTS ix_usersession_revoked_at ON "usersession" (revoked_at)'
+                )
+                conn.exec_driver_sql(
+                    'CREATE INDEX IF NOT EXISTS ix_usersession_expires_at ON "usersession" (expires_at)'
+                )
+
+            # Delivery log retention purges by age
+            if conn.exec_driver_sql("SELECT to_regclass('deliveryevent')").scalar():
+                conn.exec_driver_sql(
+                    'CREATE INDEX IF NOT EXISTS ix_deliveryevent_created_at ON "deliveryevent" (created_at)'
+                )
+
+            # Presence pushes look summaries up by partner
+            if conn.exec_driver_sql("SELECT to_regclass('conversationsummary')").scalar():
+                conn.exec_driver_sql(
+                    'CREATE INDEX IF NOT EXISTS ix_conversationsummary_partner ON "conversationsummary" (partner_id)'
+                )
+
+            # Call history pages: a user's placed and received calls by start_time
+            if conn.exec_driver_sql("SELECT to_regclass('call')").scalar():
+                conn.exec_driver_sql(
+                    'CREATE INDEX IF NOT EXISTS ix_call_caller_start ON "call" (caller_id, start_time, id)'
+                )
+                conn.exec_driver_sql(
+                    'CREATE INDEX IF NOT EXISTS ix_call_callee_start ON "call" (callee_id, start_time, id)'
+                )
+
+            # Composite index backing keyset pagination of conversations
+            conn.exec_driver_sql(
+                'CREATE INDEX IF NOT EXISTS ix_message_conversation '
+                'ON "message" (sender_id, receiver_id, timestamp, id)'
+            )
+
     except Exception as e:
         # Non-fatal; app continues and health/debug will show issues
         print(f"Schema guard failed: {e}")
 
+def ensure_message_search():
+    """Set up full-text search on an existing message table.
+
+    SQLite gets its FTS table, triggers and a one-time index of existing
+    messages. Postgres only reports whether search is ready: its column and
+    index are added by ``python migrations/message_search.py``, which avoids
+    rewriting or locking the table during startup.
+    """
+    try:
+        with get_engine().begin() as conn:
+            if not ensure_search_schema(conn):
+                print("Message search unavailable: run migrations/message_search.py")
+    except Exception as e:
+        print(f"Search schema guard failed: {e}")
+
+def backfill_conversation_summaries():
+    """One-time backfill of conversation summaries from message history.
+
+    Runs in its own transaction so a failure here never rolls back the
+    column and index fixes made by ensure_db_schema.
+    """
+    try:
+        engine = get_engine()
+        with engine.begin() as conn:
+            has_summaries = conn.exec_driver_sql(
+                'SELECT 1 FROM conversationsummary LIMIT 1'
+            ).first()
+            if not has_summaries:
+                conn.exec_driver_sql(
+                    """
+                    INSERT INTO conversationsummary
+                        (user_id, partner_id, last_message_id, last_message_preview,
+                         last_message_time, unread_count)
+                    SELECT DISTINCT ON (s.user_id, s.partner_id)
+                        s.user_id, s.partner_id, m.id, LEFT(m.content, 100), m.timestamp,
+                        (SELECT COUNT(*) FROM "message" u
+                         WHERE u.sender_id = s.partner_id AND u.receiver_id = s.user_id
+                           AND NOT COALESCE(u.is_read, FALSE))
+                    FROM (
+                        SELECT sender_id AS user_id, receiver_id AS partner_id, id FROM "message"
+                        UNION ALL
+                        SELECT receiver_id, sender_id, id FROM "message"
+                    ) s
+                    JOIN "message" m ON m.id = s.id
+                    WHERE s.user_id IS NOT NULL AND s.partner_id IS NOT NULL
+                    ORDER BY s.user_id, s.partner_id, m.timestamp DESC, m.id DESC
+                    ON CONFLICT DO NOTHING
+                    """
+                )
+    except Exception as e:
+        # Non-fatal; the list fills in as new messages are sent
+        print(f"Conversation summary backfill failed: {e}")
+
 # Determine allowed origins based on environment
 def get_allowed_origins():
     """Get allowed origins based on environment."""
@@ -146,6 +267,7 @@ app.include_router(chat.router)
 app.include_router(call.router)
 app.include_router(payment.router)
 app.include_router(user.router)
+app.include_router(realtime.router)
 
 @app.get("/")
 def read_root():
@@ -177,7 +299,18 @@ def debug_info():
         "database_url_length": len(os.getenv("DATABASE_URL", "")) if os.getenv("DATABASE_URL") else 0,
         "environment": os.getenv("ENVIRONMENT", "development"),
         "allowed_origins": get_allowed_origins(),
-        "cors_enabled": True
+        "cors_enabled": True,
+        "user_cache": user_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "session_revocations": revocations.stats(),
+        "websocket_admission": admission.stats(),
+        "websocket_heartbeat": heartbeat.stats(),
+        "presence": presence.stats(),
+        "calls": call.manager.calls.stats(),
+        "call_history": call_history.stats(),
+        "timers": timers.stats(),
+        "webrtc_signals": call.manager.signals.stats(),
+        "call_rooms": call.manager.rooms.stats(),
     }
 
 @app.get("/health")
@@ -225,7 +358,7 @@ async def options_handler(full_path: str):
     }
 
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     """Initialize database and other startup tasks."""
     try:
         # Configure Stripe API key on startup
@@ -254,7 +387,64 @@ def on_startup():
 
         # Best-effort non-destructive schema guard for existing DBs
         ensure_db_schema()
+        ensure_message_search()
+        backfill_conversation_summaries()
+
+        # A restarted app (e.g. in tests) admits sockets again
+        admission.start_accepting()
+
+        # Keep the session revocation list fresh and purge expired sessions
+        app.state.session_maintenance = asyncio.create_task(run_session_maintenance(revocations))
+        # Purge delivery events past retention
+        app.state.delivery_maintenance = asyncio.create_task(run_delivery_maintenance())
+
+        # Connect the cross-worker realtime backend
+        try:
+            await get_pubsub().start()
+            print(f"Realtime backend started on node {get_pubsub().node_id}")
+        except Exception as rt_error:
+            print(f"Realtime backend failed to start: {rt_error}")
 
     except Exception as e:
         print(f"Startup error: {e}")
         print("App will continue with limited functionality")
+
+async def drain_realtime():
+    """Hand realtime clients off to other workers before this one exits.
+
+    Stops admitting sockets, commits batched messages, records unfinished
+    calls, then tells every client to reconnect after a staggered delay
+    once the frames it is owed were written, and finally writes last_seen.
+    Runs once; later calls return immediately.
+    """
+    if admission.draining:
+        return
+    admission.stop_accepting()
+    try:
+        # Messages still waiting for a batch produce frames the clients are owed
+        await message_writer.flush()
+        await call.manager.suspend_calls()
+        spread_ms = admission.reconnect_spread_ms(len(registry))
+        print(f"Draining {len(registry)} realtime connections over {spread_ms}ms")
+        await registry.drain(spread_ms, DRAIN_TIMEOUT_SECONDS)
+        # Sends that raced with the drain
+        await message_writer.stop()
+        await call_history.stop()
+        # Everyone just disconnected; record when they were last seen
+        await presence.flush_last_seen()
+    except Exception as e:
+        print(f"Realtime drain error: {e}")
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Drain realtime clients, then release the realtime backend and pooled async database connections."""
+    await drain_realtime()
+    for name in ("session_maintenance", "delivery_maintenance"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    try:
+        await get_pubsub().stop()
+    except Exception as e:
+        print(f"Realtime backend shutdown error: {e}")
+    await dispose_async_engine()
@@ -1,6 +1,7 @@
 from typing import Optional, List
 from datetime import datetime
 from sqlmodel import Field, SQLModel, Relationship
+from sqlalchemy import Index
 
 class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -10,6 +11,10 @@ class User(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = Field(default=True)
     last_seen: Optional[datetime] = Field(default=None)
+    # Last delivery sequence number handed out to this user's event log
+    delivery_seq: int = Field(default=0)
+    # Access tokens carrying an older version are rejected
+    token_version: int = Field(default=0)
 
     # Relationships
     sent_messages: List["Message"] = Relationship(
@@ -26,12 +31,18 @@ class User(SQLModel, table=True):
     )
 
 class Message(SQLModel, table=True):
+    # Serves keyset pagination of one direction of a conversation
+    __table_args__ = (
+        Index("ix_message_conversation", "sender_id", "receiver_id", "timestamp", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     content: str = Field(max_length=1000)
     sender_id: int = Field(foreign_key="user.id")
     receiver_id: int = Field(foreign_key="user.id")
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     is_read: bool = Field(default=False)
+    is_delivered: bool = Field(default=False)
     message_type: str = Field(default="text")  # text, image, file, etc.
 
     # Relationships
@@ -50,15 +61,54 @@ class Message(SQLModel, table=True):
         },
     )
 
+class ConversationSummary(SQLModel, table=True):
+    """Denormalized per-user view of a conversation, maintained on write."""
+
+    # Serves the conversation list: one user's rows by last activity
+    __table_args__ = (
+        Index("ix_conversationsummary_activity", "user_id", "last_message_time"),
+        # Presence pushes: everyone who has a conversation with a user
+        Index("ix_conversationsummary_partner", "partner_id"),
+    )
+
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    partner_id: int = Field(foreign_key="user.id", primary_key=True)
+    last_message_id: int
+    last_message_preview: str = Field(max_length=100)
+    last_message_time: datetime
+    unread_count: int = Field(default=0)
+
+class DeliveryEvent(SQLModel, table=True):
+    """Durable realtime event, numbered per recipient for replay on reconnect."""
+
+    __table_args__ = (
+        Index("ix_deliveryevent_user_seq", "user_id", "seq", unique=True),
+        # Retention purge: oldest events first
+        Index("ix_deliveryevent_created_at", "created_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    seq: int
+    event_type: str = Field(max_length=50)
+    payload: str  # JSON-encoded event frame
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
 class Call(SQLModel, table=True):
+    # Serve keyset pagination of a user's call history, placed and received
+    __table_args__ = (
+        Index("ix_call_caller_start", "caller_id", "start_time", "id"),
+        Index("ix_call_callee_start", "callee_id", "start_time", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     caller_id: int = Field(foreign_key="user.id")
     callee_id: int = Field(foreign_key="user.id")
     call_type: str = Field(max_length=20)  # audio, video
-    status: str = Field(max_length=20)  # ringing, active, ended, missed
-    start_time: Optional[datetime] = Field(default=None)
+    status: str = Field(max_length=20)  # ringing, active, ended, rejected, missed
+    start_time: Optional[datetime] = Field(default=None)  # when the call was placed
     end_time: Optional[datetime] = Field(default=None)
-    duration_seconds: Optional[int] = Field(default=None)
+    duration_seconds: Optional[int] = Field(default=None)  # connected time, from answer to end
 
     # Relationships
     caller: User = Relationship(
@@ -103,12 +153,28 @@ class Payment(SQLModel, table=True):
 class UserSession(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
+    # SHA-256 of the refresh token; the token itself is never stored
     session_token: str = Field(unique=True, index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    expires_at: datetime
+    expires_at: datetime = Field(index=True)
     is_active: bool = Field(default=True)
+    revoked_at: Optional[datetime] = Field(default=None, index=True)
     ip_address: Optional[str] = Field(default=None)
     user_agent: Optional[str] = Field(default=None)
 
     # Relationships
     user: User = Relationship()
+
+class RealtimeRoute(SQLModel, table=True):
+    """Which worker node holds a user's realtime connection on a channel."""
+
+    channel: str = Field(primary_key=True, max_length=20)
+    user_id: int = Field(primary_key=True)
+    node_id: str = Field(primary_key=True, max_length=100)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class RealtimeNode(SQLModel, table=True):
+    """Liveness lease of a worker node; routes of expired nodes are ignored."""
+
+    node_id: str = Field(primary_key=True, max_length=100)
+    heartbeat_at: datetime = Field(default_factory=datetime.utcnow)
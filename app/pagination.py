@@ -0,0 +1,52 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List
+
+from fastapi import HTTPException
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+    Encode keyset values into an opaque, URL-safe cursor string.
+
+    Datetimes are serialized as ISO strings and restored by ``decode_cursor``.
+
+    Args:
+        *values: Keyset position, e.g. (direction, timestamp, id)
+
+    Returns:
+        str: Opaque cursor
+    """
+    raw = json.dumps([
+        {"dt": value.isoformat()} if isinstance(value, datetime) else value
+        for value in values
+    ], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """
+    Decode a cursor produced by ``encode_cursor``.
+
+    Args:
+        cursor (str): Opaque cursor from a previous response
+        size (int): Expected number of keyset values
+
+    Returns:
+        List[Any]: Keyset values
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError("unexpected cursor shape")
+        return [
+            datetime.fromisoformat(value["dt"]) if isinstance(value, dict) else value
+            for value in values
+        ]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1 @@
+# This file makes the realtime directory a Python package
@@ -0,0 +1,153 @@
+import json
+import os
+import random
+import time
+from typing import Callable, Optional
+
+from fastapi import WebSocket
+
+# Sustained WebSocket handshakes admitted per second by this worker...
+WS_ACCEPT_RATE = float(os.getenv("WS_ACCEPT_RATE", "200"))
+# ...with bursts of up to this many
+WS_ACCEPT_BURST = int(os.getenv("WS_ACCEPT_BURST", "400"))
+# Open sockets (all channels) a worker holds before refusing new ones
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "10000"))
+# Bounds of the retry hint sent to refused clients
+WS_RETRY_MIN_MS = int(os.getenv("WS_RETRY_MIN_MS", "500"))
+WS_RETRY_MAX_MS = int(os.getenv("WS_RETRY_MAX_MS", "30000"))
+# Shutdown: the least time over which drained clients are told to spread
+# their reconnects, and how long queued frames get to reach clients
+DRAIN_RECONNECT_SPREAD_MS = int(os.getenv("DRAIN_RECONNECT_SPREAD_MS", "5000"))
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "10"))
+
+# Close code for a refused handshake (application range, mirrors HTTP 429);
+# the close reason is JSON: {"retry_after_ms": <int>}
+CLOSE_TRY_LATER = 4429
+
+
+class AdmissionController:
+    """
+    Admission control in front of ``websocket.accept()``.
+
+    A token bucket caps the handshake rate so a reconnect storm after a
+    restart turns into a steady stream of auth and history reads, and a
+    per-worker cap bounds open sockets. Refused clients get a retry hint
+    spread uniformly over the time the current backlog needs to drain at
+    the accept rate, so they come back staggered instead of as a second
+    herd.
+
+    ``active`` counts open sockets and is maintained by the hubs sharing
+    this controller. Handshakes admitted concurrently may overshoot the cap
+    by at most the bucket burst. Once ``stop_accepting`` was called (worker
+    shutting down) every handshake is refused with the minimum hint.
+    """
+
+    def __init__(
+        self,
+        rate: float = WS_ACCEPT_RATE,
+        burst: int = WS_ACCEPT_BURST,
+        max_connections: int = WS_MAX_CONNECTIONS,
+        retry_min_ms: int = WS_RETRY_MIN_MS,
+        retry_max_ms: int = WS_RETRY_MAX_MS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_connections = max_connections
+        self.retry_min_ms = retry_min_ms
+        self.retry_max_ms = retry_max_ms
+        self.clock = clock
+        self.active = 0
+        self.draining = False
+        self.admitted = 0
+        self.rejected = 0
+        self._tokens = float(burst)
+        self._refilled_at = clock()
+        # Refusals in the current one-second window, to size the retry spread
+        self._window_start = self._refilled_at
+        self._window_rejections = 0
+
+    def try_admit(self) -> Optional[int]:
+        """
+        Take an admission slot.
+
+        Returns:
+            Optional[int]: None if admitted, else the retry hint in milliseconds
+        """
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+        if self.draining:
+            return self._reject(now, self.retry_min_ms)
+        if self.active >= self.max_connections:
+            return self._reject(now, self.retry_max_ms)
+        if self._tokens < 1:
+            wait_ms = (1 - self._tokens) / self.rate * 1000
+            # Everyone refused this second has to fit through the bucket too
+            backlog_ms = (self._window_rejections + 1) / self.rate * 1000
+            return self._reject(now, wait_ms + backlog_ms)
+        self._tokens -= 1
+        self.admitted += 1
+        return None
+
+    def _reject(self, now: float, spread_ms: float) -> int:
+        if now - self._window_start >= 1:
+            self._window_start = now
+            self._window_rejections = 0
+        self._window_rejections += 1
+        self.rejected += 1
+        upper = min(self.retry_max_ms, max(self.retry_min_ms, spread_ms))
+        return int(random.uniform(self.retry_min_ms, upper))
+
+    def stop_accepting(self):
+        """Refuse every further handshake; the worker is shutting down."""
+        self.draining = True
+
+    def start_accepting(self):
+        self.draining = False
+
+    def reconnect_spread_ms(self, connections: int, min_spread_ms: int = DRAIN_RECONNECT_SPREAD_MS) -> int:
+        """
+        Window over which clients handed off by a draining worker should
+        reconnect: long enough for the remaining workers to admit them at
+        the accept rate, within the retry hint bounds.
+
+        Args:
+            connections (int): Number of sockets being handed off
+            min_spread_ms (int): Lower bound of the window
+
+        Returns:
+            int: Window in milliseconds
+        """
+        spread_ms = max(min_spread_ms, connections / self.rate * 1000)
+        return int(min(self.retry_max_ms, spread_ms))
+
+    async def admit(self, websocket: WebSocket) -> bool:
+        """
+        Admit a handshake or refuse it with CLOSE_TRY_LATER and a retry hint.
+
+        The refusal accepts the socket first: a close before accept becomes
+        an HTTP 403 and the hint would be lost.
+        """
+        retry_after_ms = self.try_admit()
+        if retry_after_ms is None:
+            return True
+        await websocket.accept()
+        await websocket.close(
+            code=CLOSE_TRY_LATER, reason=json.dumps({"retry_after_ms": retry_after_ms})
+        )
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "draining": self.draining,
+            "max_connections": self.max_connections,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+# Shared by every hub on this worker so the cap covers all channels
+admission = AdmissionController()
@@ -0,0 +1,192 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.conversations import record_messages
+from app.database import get_async_engine
+from app.delivery import append_events, new_message_event
+from app.models import Message, User
+
+# Flush as soon as this many messages are waiting...
+MESSAGE_BATCH_MAX_ROWS = int(os.getenv("MESSAGE_BATCH_MAX_ROWS", "200"))
+# ...or once the oldest waiting message is this old
+MESSAGE_BATCH_MAX_DELAY_MS = float(os.getenv("MESSAGE_BATCH_MAX_DELAY_MS", "5"))
+
+
+class RecipientNotFound(LookupError):
+    """The message's receiver_id does not match a user."""
+
+
+def default_session_factory() -> AsyncSession:
+    return AsyncSession(get_async_engine(), expire_on_commit=False)
+
+
+class _Pending:
+    __slots__ = ("sender_id", "receiver_id", "content", "sender_username", "timestamp", "future")
+
+    def __init__(
+        self,
+        sender_id: int,
+        receiver_id: int,
+        content: str,
+        sender_username: Optional[str],
+        future: asyncio.Future,
+    ):
+        self.sender_id = sender_id
+        self.receiver_id = receiver_id
+        self.content = content
+        self.sender_username = sender_username
+        self.timestamp = datetime.utcnow()
+        self.future = future
+
+
+class MessageBatchWriter:
+    """
+    Group-commit writer for chat messages.
+
+    Messages submitted from every connection are coalesced into one
+    multi-row INSERT ... RETURNING plus one conversation-summary upsert and
+    a single COMMIT, flushed every ``max_delay_ms`` or ``max_rows``
+    messages, whichever comes first. ``submit`` resolves with the stored
+    message (server-assigned id and timestamp) and its sequenced
+    new_message event once its batch committed.
+    The writer task is started lazily on the running event loop.
+    """
+
+    def __init__(
+        self,
+        max_rows: int = MESSAGE_BATCH_MAX_ROWS,
+        max_delay_ms: float = MESSAGE_BATCH_MAX_DELAY_MS,
+        session_factory: Callable[[], AsyncSession] = default_session_factory,
+    ):
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self.session_factory = session_factory
+        self.batches_flushed = 0
+        self.rows_written = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def submit(
+        self, sender_id: int, receiver_id: int, content: str, sender_username: Optional[str] = None
+    ) -> Tuple[Message, dict]:
+        """
+        Queue a message for the next batch and wait for it to commit.
+
+        Args:
+            sender_id (int): Sending user
+            receiver_id (int): Receiving user
+            content (str): Message text
+            sender_username (Optional[str]): Included in the new_message event, as for REST sends
+
+        Returns:
+            Tuple[Message, dict]: Stored message and the recipient's logged event
+
+        Raises:
+            RecipientNotFound: receiver_id does not exist
+        """
+        self._ensure_running()
+        future = self._loop.create_future()
+        self._queue.put_nowait(_Pending(sender_id, receiver_id, content, sender_username, future))
+        return await future
+
+    async def flush(self):
+        """Wait until everything submitted so far has been written."""
+        if self._queue is not None and self._task is not None and not self._task.done():
+            await self._queue.join()
+
+    async def stop(self):
+        """Flush pending messages and stop the writer task."""
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            deadline = self._loop.time() + self.max_delay
+            while len(batch) < self.max_rows:
+                remaining = deadline - self._loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _write(self, batch: List[_Pending]):
+        try:
+            async with self.session_factory() as db:
+                receiver_ids = {pending.receiver_id for pending in batch}
+                existing = set((await db.exec(select(User.id).where(User.id.in_(receiver_ids)))).all())
+
+                accepted = []
+                for pending in batch:
+                    if pending.receiver_id in existing:
+                        accepted.append(pending)
+                    elif not pending.future.done():
+                        pending.future.set_exception(RecipientNotFound(pending.receiver_id))
+
+                if not accepted:
+                    return
+
+                rows = [
+                    {
+                        "content": pending.content,
+                        "sender_id": pending.sender_id,
+                        "receiver_id": pending.receiver_id,
+                        "timestamp": pending.timestamp,
+                        "is_read": False,
+                        "message_type": "text",
+                    }
+                    for pending in accepted
+                ]
+                result = await db.exec(
+                    insert(Message).returning(Message.id, sort_by_parameter_order=True),
+                    params=rows,
+                )
+                ids = [row[0] for row in result.all()]
+                messages = [Message(id=message_id, **row) for message_id, row in zip(ids, rows)]
+
+                await record_messages(db, messages)
+                stamped = await append_events(db, [
+                    (message.receiver_id, new_message_event(message, pending.sender_username))
+                    for pending, message in zip(accepted, messages)
+                ])
+                await db.commit()
+
+            # append_events groups by recipient; map events back by message id
+            events = {event["message"]["id"]: event for _, event in stamped}
+            self.batches_flushed += 1
+            self.rows_written += len(messages)
+            for pending, message in zip(accepted, messages):
+                if not pending.future.done():
+                    pending.future.set_result((message, events[message.id]))
+        except Exception as e:
+            print(f"Message batch write failed ({len(batch)} messages): {e}")
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+
+
+message_writer = MessageBatchWriter()
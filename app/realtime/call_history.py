@@ -0,0 +1,159 @@
+import asyncio
+import os
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import insert, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.database import get_async_engine
+from app.models import Call
+from app.realtime.calls import CallRecord
+
+# Call lifecycle changes are written this often...
+CALL_HISTORY_FLUSH_MS = float(os.getenv("CALL_HISTORY_FLUSH_MS", "200"))
+# ...or as soon as this many calls changed
+CALL_HISTORY_BATCH_ROWS = int(os.getenv("CALL_HISTORY_BATCH_ROWS", "500"))
+
+
+def default_session_factory() -> AsyncSession:
+    return AsyncSession(get_async_engine(), expire_on_commit=False)
+
+
+class CallHistoryWriter:
+    """
+    Write-behind persistence of call lifecycle transitions.
+
+    Signalling only marks a call as changed; the writer task later stores
+    the call's state at flush time, so several transitions within one
+    flush (placed then rejected, answered then ended) cost one row write.
+    A flush is one multi-row INSERT ... RETURNING for calls not stored yet
+    and one bulk UPDATE by primary key for the rest, in a single commit,
+    every ``flush_ms`` or once ``max_rows`` calls changed. Failed flushes
+    keep their calls for the next one. The writer task is started lazily
+    on the running event loop.
+    """
+
+    def __init__(
+        self,
+        flush_ms: float = CALL_HISTORY_FLUSH_MS,
+        max_rows: int = CALL_HISTORY_BATCH_ROWS,
+        session_factory: Callable[[], AsyncSession] = default_session_factory,
+    ):
+        self.interval = flush_ms / 1000
+        self.max_rows = max_rows
+        self.session_factory = session_factory
+        self.flushes = 0
+        self.rows_inserted = 0
+        self.rows_updated = 0
+        # Calls changed since the last flush, in order of first change
+        self._dirty: Dict[str, CallRecord] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __len__(self) -> int:
+        return len(self._dirty)
+
+    def _ensure_running(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No loop (sync caller): the next record or flush on a loop writes it
+            return
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._wake = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = loop.create_task(self._run())
+
+    def record(self, call: CallRecord):
+        """Queue the current state of call for the next flush."""
+        self._dirty.setdefault(call.call_id, call)
+        self._ensure_running()
+        if self._wake is not None and len(self._dirty) >= self.max_rows:
+            self._wake.set()
+
+    def clear(self):
+        self._dirty.clear()
+
+    async def flush(self):
+        """Write every call changed so far."""
+        self._ensure_running()
+        # Flushes are serialized so a call is never inserted twice
+        async with self._lock:
+            await self._write()
+
+    async def stop(self):
+        """Flush pending changes and stop the writer task."""
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _write(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        calls = list(dirty.values())
+        rows = [
+            {
+                "caller_id": call.caller_id,
+                "callee_id": call.callee_id,
+                "call_type": call.call_type,
+                "status": call.status,
+                "start_time": call.created_at,
+                "end_time": call.end_time,
+                "duration_seconds": call.duration_seconds,
+            }
+            for call in calls
+        ]
+        new = [(call, row) for call, row in zip(calls, rows) if call.row_id is None]
+        stored = [{"id": call.row_id, **row} for call, row in zip(calls, rows) if call.row_id is not None]
+        try:
+            async with self.session_factory() as db:
+                ids = []
+                if new:
+                    result = await db.exec(
+                        insert(Call).returning(Call.id, sort_by_parameter_order=True),
+                        params=[row for _, row in new],
+                    )
+                    ids = [row[0] for row in result.all()]
+                if stored:
+                    await db.exec(update(Call), params=stored)
+                await db.commit()
+        except Exception as e:
+            print(f"Call history flush failed ({len(calls)} calls): {e}")
+            # Calls changed meanwhile are already queued again
+            for call_id, call in dirty.items():
+                self._dirty.setdefault(call_id, call)
+            return
+        for (call, _), row_id in zip(new, ids):
+            call.row_id = row_id
+        self.flushes += 1
+        self.rows_inserted += len(new)
+        self.rows_updated += len(stored)
+
+    async def _run(self):
+        wake = self._wake
+        while True:
+            try:
+                await asyncio.wait_for(wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Call history error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._dirty),
+            "flushes": self.flushes,
+            "rows_inserted": self.rows_inserted,
+            "rows_updated": self.rows_updated,
+        }
+
+
+call_history = CallHistoryWriter()
@@ -0,0 +1,164 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+from app.realtime.timers import Timer
+
+# Finished calls stay visible (late hang-ups, /call/active) this long before eviction
+CALL_RETENTION_SECONDS = float(os.getenv("CALL_RETENTION_SECONDS", "60"))
+
+# Unanswered calls are given up as missed after this long
+CALL_RING_TIMEOUT_SECONDS = float(os.getenv("CALL_RING_TIMEOUT_SECONDS", "45"))
+
+FINISHED_STATUSES = ("ended", "rejected", "missed")
+
+
+class CallRecord:
+    """In-memory state of one call on the worker that owns it."""
+
+    __slots__ = (
+        "call_id", "caller_id", "callee_id", "call_type", "status",
+        "created_at", "answered_at", "end_time", "row_id", "ring_timer",
+    )
+
+    def __init__(self, call_id: str, caller_id: int, callee_id: int, call_type: str):
+        self.call_id = call_id
+        self.caller_id = caller_id
+        self.callee_id = callee_id
+        self.call_type = call_type
+        self.status = "ringing"
+        self.created_at = datetime.utcnow()
+        # Set when the call is answered / finishes
+        self.answered_at: Optional[datetime] = None
+        self.end_time: Optional[datetime] = None
+        # Primary key of the Call row once the history writer inserted it
+        self.row_id: Optional[int] = None
+        # Pending ring timeout while the call is ringing
+        self.ring_timer: Optional[Timer] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def duration_seconds(self) -> Optional[int]:
+        """Seconds the call was connected, once it finished."""
+        if self.answered_at is None or self.end_time is None:
+            return None
+        return int((self.end_time - self.answered_at).total_seconds())
+
+    def involves(self, user_id: int) -> bool:
+        return user_id == self.caller_id or user_id == self.callee_id
+
+    def other_party(self, user_id: int) -> int:
+        return self.caller_id if user_id == self.callee_id else self.callee_id
+
+    def to_dict(self) -> dict:
+        return {
+            "call_id": self.call_id,
+            "caller_id": self.caller_id,
+            "callee_id": self.callee_id,
+            "call_type": self.call_type,
+            "status": self.status,
+        }
+
+
+class CallRegistry:
+    """
+    Calls owned by this worker, indexed by id and by participant.
+
+    Finding a user's calls costs O(calls of that user). Finished calls are
+    evicted ``retention`` seconds after they finish. Every call gets the same
+    retention, so the OrderedDict of finished calls is in eviction order and
+    a single reaper task only ever looks at its head; it is started lazily
+    on the running event loop and exits when nothing is left to evict.
+    """
+
+    def __init__(self, retention: float = CALL_RETENTION_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self.retention = retention
+        self.clock = clock
+        self.evicted = 0
+        self._calls: Dict[str, CallRecord] = {}
+        self._by_user: Dict[int, Set[str]] = {}
+        self._evict_at: "OrderedDict[str, float]" = OrderedDict()
+        self._reaper: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def __contains__(self, call_id: str) -> bool:
+        return call_id in self._calls
+
+    def __iter__(self) -> Iterator[CallRecord]:
+        return iter(list(self._calls.values()))
+
+    def get(self, call_id: str) -> Optional[CallRecord]:
+        return self._calls.get(call_id)
+
+    def add(self, call: CallRecord):
+        self._calls[call.call_id] = call
+        for user_id in (call.caller_id, call.callee_id):
+            self._by_user.setdefault(user_id, set()).add(call.call_id)
+
+    def for_user(self, user_id: int) -> List[CallRecord]:
+        """Calls user_id takes part in, oldest first."""
+        calls = [self._calls[call_id] for call_id in self._by_user.get(user_id, ())]
+        return sorted(calls, key=lambda call: call.created_at)
+
+    def finish(self, call: CallRecord, status: str, end_time: Optional[datetime] = None):
+        """Mark call finished with status and schedule its eviction."""
+        call.status = status
+        call.end_time = end_time or datetime.utcnow()
+        if call.call_id in self._calls:
+            self._evict_at[call.call_id] = self.clock() + self.retention
+            self._evict_at.move_to_end(call.call_id)
+            self._ensure_reaper()
+
+    def clear(self):
+        self._calls.clear()
+        self._by_user.clear()
+        self._evict_at.clear()
+
+    def _evict(self, call_id: str):
+        call = self._calls.pop(call_id, None)
+        if call is None:
+            return
+        self.evicted += 1
+        for user_id in (call.caller_id, call.callee_id):
+            call_ids = self._by_user.get(user_id)
+            if call_ids is not None:
+                call_ids.discard(call_id)
+                if not call_ids:
+                    del self._by_user[user_id]
+
+    def _ensure_reaper(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No loop (sync caller): the next finish on a loop reaps the backlog
+            return
+        if self._loop is not loop or self._reaper is None or self._reaper.done():
+            self._loop = loop
+            self._reaper = loop.create_task(self._reap())
+
+    async def _reap(self):
+        while self._evict_at:
+            call_id, deadline = next(iter(self._evict_at.items()))
+            delay = deadline - self.clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            del self._evict_at[call_id]
+            self._evict(call_id)
+
+    def stats(self) -> dict:
+        return {
+            "calls": len(self._calls),
+            "finished": len(self._evict_at),
+            "users": len(self._by_user),
+            "evicted": self.evicted,
+        }
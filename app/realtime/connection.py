@@ -0,0 +1,182 @@
+import asyncio
+import itertools
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Hashable, Optional, Tuple
+
+from fastapi import WebSocket
+
+# Outbound frames buffered per connection before the slow-consumer policy kicks in
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# drop_oldest | coalesce | disconnect
+SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "coalesce")
+# A single send stalled longer than this closes the connection
+SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+
+# Close code used when a client cannot keep up (RFC 6455 "Try Again Later")
+CLOSE_SLOW_CONSUMER = 1013
+# Close code used when the worker shuts down (RFC 6455 "Service Restart")
+CLOSE_SERVICE_RESTART = 1012
+
+POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+_connection_ids = itertools.count(1)
+
+
+class Connection:
+    """
+    One WebSocket with a bounded outbound queue drained by its own writer task.
+
+    ``send`` never awaits the network, so fanning a frame out to many
+    connections costs one enqueue each and a stalled client only ever
+    delays itself. When the queue is full the slow-consumer policy applies:
+
+    - ``drop_oldest``: discard the oldest queued frame.
+    - ``coalesce``: frames sent with a coalesce key (typing, presence)
+      replace a queued frame with the same key; on overflow the oldest
+      frame is discarded.
+    - ``disconnect``: close the socket with 1013 so the client reconnects
+      and catches up from its delivery cursor.
+
+    A ``multiplexed`` connection carries several channels; each frame sent
+    for a channel is tagged with ``"channel": <name>``.
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        websocket: WebSocket,
+        max_queue: int = SEND_QUEUE_SIZE,
+        policy: str = SLOW_CONSUMER_POLICY,
+        send_timeout: float = SEND_TIMEOUT_SECONDS,
+        on_close: Optional[Callable[["Connection"], Awaitable[None]]] = None,
+        principal: Optional[Any] = None,
+        multiplexed: bool = False,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.id = next(_connection_ids)
+        self.user_id = user_id
+        self.websocket = websocket
+        # Identity the handshake authenticated as; opaque to this layer
+        self.principal = principal
+        self.multiplexed = multiplexed
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.closed = False
+        self.dropped = 0
+        # Monotonic time of the last frame received from the client
+        self.last_seen = time.monotonic()
+        # Highest delivery sequence number queued on this connection
+        self.last_seq: Optional[int] = None
+        self._closing = False
+        self._on_close = on_close
+        self._queue: Deque[Tuple[Optional[Hashable], dict]] = deque()
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._writer: Optional[asyncio.Task] = None
+        self._close_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the writer task on the running event loop."""
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._run())
+
+    def touch(self):
+        """Record that the client is alive; call for every inbound frame."""
+        self.last_seen = time.monotonic()
+
+    @property
+    def pending(self) -> int:
+        """Number of frames waiting to be written."""
+        return len(self._queue)
+
+    def send(self, message: dict, coalesce_key: Optional[Hashable] = None, channel: Optional[str] = None) -> bool:
+        """
+        Queue a frame for this connection without waiting for the network.
+
+        Args:
+            message (dict): JSON frame
+            coalesce_key (Optional[Hashable]): Frames with equal keys replace
+                each other while queued (coalesce policy only)
+            channel (Optional[str]): Channel the frame belongs to; tags the
+                frame on multiplexed connections
+
+        Returns:
+            bool: False if the connection is closed or was closed as a result
+        """
+        if self.closed:
+            return False
+        seq = message.get("seq")
+        if isinstance(seq, int) and (self.last_seq is None or seq > self.last_seq):
+            self.last_seq = seq
+        if channel is not None and self.multiplexed:
+            message = {"channel": channel, **message}
+
+        if coalesce_key is not None and self.policy == "coalesce":
+            for index, (key, _) in enumerate(self._queue):
+                if key == coalesce_key:
+                    self._queue[index] = (coalesce_key, message)
+                    return True
+
+        if len(self._queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                self._spawn_close(CLOSE_SLOW_CONSUMER)
+                return False
+            self._queue.popleft()
+            self.dropped += 1
+
+        self._queue.append((coalesce_key, message))
+        self._drained.clear()
+        self._wakeup.set()
+        return True
+
+    async def wait_drained(self):
+        """Wait until every queued frame was written (or the connection closed)."""
+        await self._drained.wait()
+
+    async def _run(self):
+        task = asyncio.current_task()
+        try:
+            # wait_for() can swallow a cancel that races with the send
+            # completing, so also stop once close() or cancel() was requested.
+            while not self._closing and not task.cancelling():
+                if not self._queue:
+                    self._drained.set()
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                _, message = self._queue.popleft()
+                await asyncio.wait_for(self.websocket.send_json(message), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Closing connection {self.id} for user {self.user_id}: {e!r}")
+            await self.close(CLOSE_SLOW_CONSUMER)
+
+    def _spawn_close(self, code: int):
+        self.closed = True
+        self._close_task = asyncio.get_running_loop().create_task(self.close(code))
+
+    async def close(self, code: int = 1000):
+        """Stop the writer, close the socket and notify the owner, once."""
+        if self._closing:
+            return
+        self._closing = True
+        self.closed = True
+        writer = self._writer
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
+        self._queue.clear()
+        self._wakeup.set()
+        self._drained.set()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            # Already closed by the peer
+            pass
+        if self._on_close is not None:
+            await self._on_close(self)
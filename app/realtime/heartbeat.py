@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from app.realtime.connection import Connection
+from app.realtime.presence import presence
+
+# How often every socket is pinged...
+WS_HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("WS_HEARTBEAT_INTERVAL_SECONDS", "25"))
+# ...and how long a socket may stay silent (no frame, not even a pong) before it is reaped
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "75"))
+# Slots of the timer wheel; each tick handles one slot, interval / slots apart
+WS_HEARTBEAT_WHEEL_SLOTS = int(os.getenv("WS_HEARTBEAT_WHEEL_SLOTS", "50"))
+
+# Close code for a reaped idle socket (application range, mirrors HTTP 408)
+CLOSE_IDLE_TIMEOUT = 4408
+
+
+class HeartbeatScheduler:
+    """
+    Server-driven liveness for every registered socket.
+
+    Sockets are spread over the slots of a timer wheel. A single task
+    advances the wheel one slot per tick, so each socket is visited once
+    per ``interval`` and the work of one interval is split into ``slots``
+    equal batches instead of one timer per socket. A visit reaps the socket
+    if nothing arrived from it for ``idle_timeout`` seconds (a dead peer
+    never answers the pings) and otherwise queues a ping frame. Sockets
+    that already closed are dropped from the wheel.
+
+    Endpoints call ``Connection.touch`` for every inbound frame, and
+    ``on_alive`` is called with the user id of every socket found alive.
+    The task is started lazily on the running event loop.
+    """
+
+    def __init__(
+        self,
+        interval: float = WS_HEARTBEAT_INTERVAL_SECONDS,
+        idle_timeout: float = WS_IDLE_TIMEOUT_SECONDS,
+        slots: int = WS_HEARTBEAT_WHEEL_SLOTS,
+        clock: Callable[[], float] = time.monotonic,
+        on_alive: Optional[Callable[[int], None]] = None,
+    ):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.on_alive = on_alive
+        self.pings_sent = 0
+        self.reaped_idle = 0
+        self.reaped_closed = 0
+        self._wheel: List[Set[Connection]] = [set() for _ in range(max(1, slots))]
+        self._slot_of: Dict[int, int] = {}
+        self._cursor = 0
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._task = loop.create_task(self._run())
+
+    def add(self, connection: Connection):
+        """Start watching connection; its first visit is one interval away."""
+        self._ensure_running()
+        # The slot just behind the cursor is the last one visited this round
+        slot = (self._cursor - 1) % len(self._wheel)
+        self._wheel[slot].add(connection)
+        self._slot_of[connection.id] = slot
+
+    def remove(self, connection: Connection):
+        slot = self._slot_of.pop(connection.id, None)
+        if slot is not None:
+            self._wheel[slot].discard(connection)
+
+    async def tick(self):
+        """Visit the sockets of the next slot."""
+        slot = self._wheel[self._cursor]
+        self._cursor = (self._cursor + 1) % len(self._wheel)
+        now = self.clock()
+        idle = []
+        for connection in list(slot):
+            if connection.closed:
+                self.remove(connection)
+                self.reaped_closed += 1
+            elif now - connection.last_seen >= self.idle_timeout:
+                idle.append(connection)
+            else:
+                connection.send({"type": "ping"})
+                self.pings_sent += 1
+                if self.on_alive is not None:
+                    self.on_alive(connection.user_id)
+        for connection in idle:
+            self.remove(connection)
+            self.reaped_idle += 1
+            print(f"Reaping idle connection {connection.id} of user {connection.user_id}")
+        if idle:
+            # close() notifies the registry, which detaches the socket everywhere
+            await asyncio.gather(
+                *(connection.close(CLOSE_IDLE_TIMEOUT) for connection in idle), return_exceptions=True
+            )
+
+    async def _run(self):
+        step = self.interval / len(self._wheel)
+        while True:
+            await asyncio.sleep(step)
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Heartbeat error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self._slot_of),
+            "interval_seconds": self.interval,
+            "idle_timeout_seconds": self.idle_timeout,
+            "pings_sent": self.pings_sent,
+            "reaped_idle": self.reaped_idle,
+            "reaped_closed": self.reaped_closed,
+        }
+
+
+heartbeat = HeartbeatScheduler(on_alive=presence.seen)
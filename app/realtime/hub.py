@@ -0,0 +1,250 @@
+import asyncio
+import random
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from fastapi import WebSocket
+
+from app.realtime.admission import AdmissionController, admission
+from app.realtime.connection import CLOSE_SERVICE_RESTART, Connection
+from app.realtime.heartbeat import HeartbeatScheduler, heartbeat
+from app.realtime.presence import PresenceRegistry, presence
+from app.realtime.pubsub import PubSubBackend
+
+
+class ConnectionRegistry:
+    """
+    Every WebSocket this worker holds and the channels each one carries.
+
+    A socket is registered once however many channels (hubs) it serves:
+    admission control counts it once, a drain hands it off once and its
+    close detaches it from every hub. Hubs keep the per-channel index of
+    the sockets attached to them. With a heartbeat scheduler every socket
+    is pinged and reaped once idle; a presence registry is told about
+    sockets opening and closing.
+    """
+
+    def __init__(
+        self,
+        admission: Optional[AdmissionController] = None,
+        heartbeat: Optional[HeartbeatScheduler] = None,
+        presence: Optional[PresenceRegistry] = None,
+    ):
+        self.admission = admission
+        self.heartbeat = heartbeat
+        self.presence = presence
+        self._connections: Dict[int, Tuple[Connection, List["ConnectionHub"]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    async def admit(self, websocket: WebSocket) -> bool:
+        """Run admission control; call before any per-handshake work."""
+        if self.admission is None:
+            return True
+        return await self.admission.admit(websocket)
+
+    async def connect(
+        self,
+        user_id: int,
+        websocket: WebSocket,
+        hubs: Sequence["ConnectionHub"],
+        principal: Optional[Any] = None,
+        multiplexed: bool = False,
+    ) -> Connection:
+        """
+        Accept a socket and attach it to hubs.
+
+        Args:
+            user_id (int): Owner of the socket
+            websocket (WebSocket): Socket to accept
+            hubs (Sequence[ConnectionHub]): Channels the socket carries; the
+                first one builds its reconnect frame on drain
+            principal (Optional[Any]): Identity the handshake authenticated as
+            multiplexed (bool): Tag every frame with the channel it belongs to
+
+        Returns:
+            Connection: The registered connection
+        """
+        await websocket.accept()
+        connection = Connection(
+            user_id, websocket, on_close=self.disconnect, principal=principal, multiplexed=multiplexed
+        )
+        connection.start()
+        self._connections[connection.id] = (connection, list(hubs))
+        if self.admission:
+            self.admission.active += 1
+        if self.heartbeat is not None:
+            self.heartbeat.add(connection)
+        if self.presence is not None:
+            self.presence.connected(user_id)
+        for hub in hubs:
+            await hub.attach(connection)
+        return connection
+
+    async def disconnect(self, connection: Connection):
+        """Forget a connection and detach it from its hubs, once."""
+        entry = self._connections.pop(connection.id, None)
+        if entry is None:
+            return
+        if self.admission:
+            self.admission.active -= 1
+        if self.heartbeat is not None:
+            self.heartbeat.remove(connection)
+        await connection.close()
+        for hub in entry[1]:
+            await hub.detach(connection)
+        if self.presence is not None:
+            self.presence.disconnected(connection.user_id)
+
+    async def drain(self, spread_ms: int, timeout: float):
+        """
+        Hand every connection off before the worker exits.
+
+        Each connection gets a reconnect frame queued behind the frames it
+        is still owed, with a delay drawn uniformly from [0, spread_ms) so
+        the clients do not all come back at once. Queues get up to timeout
+        seconds to flush, then the sockets are closed with 1012.
+
+        Args:
+            spread_ms (int): Window the reconnects are spread over
+            timeout (float): Seconds to wait for queued frames to be written
+        """
+        entries = list(self._connections.values())
+        if not entries:
+            return
+        for connection, hubs in entries:
+            connection.send(hubs[0].reconnect_frame(connection, int(random.uniform(0, spread_ms))))
+        connections = [connection for connection, _ in entries]
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(connection.wait_drained() for connection in connections)), timeout
+            )
+        except asyncio.TimeoutError:
+            stalled = sum(1 for connection in connections if connection.pending)
+            print(f"Closing {stalled} realtime connections with unsent frames")
+        for connection in connections:
+            await connection.close(CLOSE_SERVICE_RESTART)
+
+
+class ConnectionHub:
+    """
+    Per-channel index of this worker's WebSockets.
+
+    A user may hold several connections (one per device) and a connection
+    may carry several channels; every frame for the user is queued on each
+    connection attached to the channel. Local recipients are written to
+    directly; recipients connected to another worker are reached through
+    the pub/sub backend, which also keeps the cross-worker routing table
+    up to date. Hubs sharing a ConnectionRegistry share its sockets and
+    admission control; a hub created without one gets a private registry.
+    """
+
+    channel = "default"
+
+    def __init__(
+        self,
+        backend: Optional[PubSubBackend] = None,
+        admission: Optional[AdmissionController] = None,
+        registry: Optional[ConnectionRegistry] = None,
+    ):
+        self.connections: Dict[int, Dict[int, Connection]] = {}
+        self.backend: Optional[PubSubBackend] = None
+        self.registry = registry if registry is not None else ConnectionRegistry(admission)
+        if backend:
+            self.attach_backend(backend)
+
+    def attach_backend(self, backend: PubSubBackend):
+        """Route deliveries for users on other workers through backend."""
+        self.backend = backend
+        backend.subscribe(self.channel, self._deliver_local)
+
+    async def admit(self, websocket: WebSocket) -> bool:
+        """Run admission control; call before any per-handshake work."""
+        return await self.registry.admit(websocket)
+
+    async def connect(self, user_id: int, websocket: WebSocket, principal: Optional[Any] = None) -> Connection:
+        """Accept a socket carrying only this channel."""
+        return await self.registry.connect(user_id, websocket, [self], principal)
+
+    async def disconnect(self, connection: Connection):
+        await self.registry.disconnect(connection)
+
+    async def attach(self, connection: Connection):
+        """Start delivering this channel to connection; claims the route with the user's first one."""
+        devices = self.connections.setdefault(connection.user_id, {})
+        devices[connection.id] = connection
+        if len(devices) == 1 and self.backend:
+            await self.backend.claim(self.channel, connection.user_id)
+
+    async def detach(self, connection: Connection):
+        """Stop delivering to connection; the route is released with the user's last one."""
+        devices = self.connections.get(connection.user_id)
+        if not devices or devices.pop(connection.id, None) is None:
+            return
+        if not devices:
+            del self.connections[connection.user_id]
+            await self.on_user_offline(connection.user_id)
+            if self.backend:
+                try:
+                    await self.backend.release(self.channel, connection.user_id)
+                except Exception as e:
+                    print(f"Error releasing {self.channel} route for user {connection.user_id}: {e}")
+
+    async def on_user_offline(self, user_id: int):
+        """Hook called when a user's last local connection goes away."""
+
+    def reconnect_frame(self, connection: Connection, retry_after_ms: int) -> dict:
+        """Control frame telling a client to reconnect, to any worker, after retry_after_ms."""
+        return {"type": "reconnect", "retry_after_ms": retry_after_ms}
+
+    def user_connections(self, user_id: int) -> List[Connection]:
+        """Local connections of user_id."""
+        return list(self.connections.get(user_id, {}).values())
+
+    def is_local(self, user_id: int) -> bool:
+        """Whether user_id is connected to this worker."""
+        return user_id in self.connections
+
+    async def is_online(self, user_id: int) -> bool:
+        """Whether user_id is connected to any worker."""
+        if self.is_local(user_id):
+            return True
+        if self.backend:
+            nodes = await self.backend.nodes_for(self.channel, user_id)
+            nodes.discard(self.backend.node_id)
+            return bool(nodes)
+        return False
+
+    async def send(self, user_id: int, message: dict, coalesce_key: Optional[Hashable] = None) -> bool:
+        """
+        Deliver a message to all of user_id's connections, wherever they are.
+
+        Local devices are queued directly; devices on other workers are
+        reached through the backend, which skips this node.
+
+        Returns:
+            bool: True if the message was queued locally or handed to a node
+        """
+        delivered = self.deliver_local(user_id, message, coalesce_key)
+        if self.backend:
+            try:
+                delivered = await self.backend.send_remote(
+                    self.channel, user_id, message, coalesce_key
+                ) or delivered
+            except Exception as e:
+                print(f"Error publishing {self.channel} message for user {user_id}: {e}")
+        return delivered
+
+    def deliver_local(self, user_id: int, message: dict, coalesce_key: Optional[Hashable] = None) -> bool:
+        """Queue a frame on each of user_id's local connections."""
+        delivered = False
+        for connection in self.user_connections(user_id):
+            delivered = connection.send(message, coalesce_key, self.channel) or delivered
+        return delivered
+
+    async def _deliver_local(self, user_id: int, message: dict, coalesce_key: Optional[Hashable] = None):
+        self.deliver_local(user_id, message, coalesce_key)
+
+
+# Shared by every hub on this worker, so one socket can carry several channels
+registry = ConnectionRegistry(admission, heartbeat, presence)
@@ -0,0 +1,222 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Set
+
+from sqlalchemy import update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.database import get_async_engine
+from app.models import User
+from app.realtime.pubsub import PubSubBackend, get_pubsub
+
+# Presence changes are collected and pushed at most this often...
+PRESENCE_PUSH_INTERVAL_SECONDS = float(os.getenv("PRESENCE_PUSH_INTERVAL_SECONDS", "1"))
+# ...and last_seen is written for everyone seen since the last write this often
+LAST_SEEN_FLUSH_SECONDS = float(os.getenv("LAST_SEEN_FLUSH_SECONDS", "30"))
+# Rows per bulk UPDATE of last_seen
+LAST_SEEN_BATCH_SIZE = int(os.getenv("LAST_SEEN_BATCH_SIZE", "1000"))
+
+PushHandler = Callable[[List[dict]], Awaitable[None]]
+
+
+def default_session_factory() -> AsyncSession:
+    return AsyncSession(get_async_engine(), expire_on_commit=False)
+
+
+class PresenceRegistry:
+    """
+    Who is online, fed by the realtime connection registry.
+
+    Sockets opening and closing drive the per-user socket count on this
+    worker; heartbeat visits mark users as seen. Users connected to other
+    workers are found through the backend's routing table in one lookup
+    per query. ``last_seen`` is not written per event: users seen since the
+    previous write are flushed every ``flush_interval`` in bulk UPDATEs.
+    Online/offline transitions are collected and handed to the subscribed
+    handler every ``push_interval`` as presence frames; a user who drops
+    and comes back within one interval produces no frame. The background
+    task is started lazily on the running event loop.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[PubSubBackend] = None,
+        channels: Sequence[str] = ("chat", "call"),
+        push_interval: float = PRESENCE_PUSH_INTERVAL_SECONDS,
+        flush_interval: float = LAST_SEEN_FLUSH_SECONDS,
+        session_factory: Callable[[], AsyncSession] = default_session_factory,
+    ):
+        self.backend = backend
+        self.channels = tuple(channels)
+        self.push_interval = push_interval
+        self.flush_interval = flush_interval
+        self.session_factory = session_factory
+        self.pushes = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+        self._handler: Optional[PushHandler] = None
+        # Open sockets per user on this worker
+        self._local: Dict[int, int] = {}
+        # Users seen since the last flush, and when
+        self._seen: Dict[int, datetime] = {}
+        # Users whose state changed since the last push
+        self._changed: Set[int] = set()
+        # Users last announced as online by this worker
+        self._announced: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, handler: PushHandler):
+        """Register the coroutine receiving each batch of presence frames."""
+        self._handler = handler
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._task = loop.create_task(self._run())
+
+    def connected(self, user_id: int):
+        """A socket of user_id was opened on this worker."""
+        self._ensure_running()
+        count = self._local.get(user_id, 0)
+        self._local[user_id] = count + 1
+        self._seen[user_id] = datetime.utcnow()
+        if count == 0:
+            self._changed.add(user_id)
+
+    def disconnected(self, user_id: int):
+        """A socket of user_id on this worker closed."""
+        count = self._local.get(user_id, 0)
+        if count <= 1:
+            self._local.pop(user_id, None)
+            self._changed.add(user_id)
+        else:
+            self._local[user_id] = count - 1
+        self._seen[user_id] = datetime.utcnow()
+
+    def seen(self, user_id: int):
+        """user_id is alive (heartbeat or traffic)."""
+        self._seen[user_id] = datetime.utcnow()
+
+    def is_local(self, user_id: int) -> bool:
+        return user_id in self._local
+
+    def clear(self):
+        self._local.clear()
+        self._seen.clear()
+        self._changed.clear()
+        self._announced.clear()
+
+    async def online(self, user_ids: Sequence[int]) -> Set[int]:
+        """Users among user_ids connected to this or any other worker."""
+        online = {user_id for user_id in user_ids if user_id in self._local}
+        remote = [user_id for user_id in user_ids if user_id not in online]
+        if remote and self.backend:
+            try:
+                online |= await self.backend.online_users(self.channels, remote)
+            except Exception as e:
+                print(f"Presence lookup on realtime backend failed: {e}")
+        return online
+
+    async def lookup(self, db: AsyncSession, user_ids: Sequence[int]) -> List[dict]:
+        """
+        Presence of each of user_ids, in order.
+
+        Args:
+            db (AsyncSession): Session used to read last_seen of offline users
+            user_ids (Sequence[int]): Users to look up
+
+        Returns:
+            List[dict]: ``{"user_id", "online", "last_seen"}`` per user
+        """
+        online = await self.online(user_ids)
+        last_seen = {user_id: self._seen[user_id] for user_id in user_ids if user_id in self._seen}
+        stored = [user_id for user_id in user_ids if user_id not in online and user_id not in last_seen]
+        if stored:
+            rows = (await db.exec(select(User.id, User.last_seen).where(User.id.in_(stored)))).all()
+            last_seen.update({user_id: seen_at for user_id, seen_at in rows if seen_at is not None})
+        return [
+            {
+                "user_id": user_id,
+                "online": user_id in online,
+                "last_seen": last_seen.get(user_id),
+            }
+            for user_id in user_ids
+        ]
+
+    async def push_changes(self):
+        """Hand the transitions collected since the last push to the handler."""
+        if not self._changed:
+            return
+        changed, self._changed = self._changed, set()
+        went_online = {user_id for user_id in changed if user_id in self._local} - self._announced
+        went_offline = {user_id for user_id in changed if user_id not in self._local} & self._announced
+        if went_offline and self.backend:
+            # Still connected through another worker: not a transition
+            went_offline -= await self.online(sorted(went_offline))
+        self._announced |= went_online
+        self._announced -= went_offline
+        frames = [
+            {"type": "presence", "user_id": user_id, "online": True, "last_seen": None}
+            for user_id in sorted(went_online)
+        ] + [
+            {
+                "type": "presence",
+                "user_id": user_id,
+                "online": False,
+                "last_seen": (self._seen.get(user_id) or datetime.utcnow()).isoformat(),
+            }
+            for user_id in sorted(went_offline)
+        ]
+        if frames and self._handler is not None:
+            self.pushes += 1
+            await self._handler(frames)
+
+    async def flush_last_seen(self):
+        """Write last_seen of every user seen since the previous flush."""
+        if not self._seen:
+            return
+        seen, self._seen = self._seen, {}
+        # Sorted ids keep concurrent flushes from different workers lock-ordered
+        rows = [{"id": user_id, "last_seen": seen[user_id]} for user_id in sorted(seen)]
+        try:
+            async with self.session_factory() as db:
+                for start in range(0, len(rows), LAST_SEEN_BATCH_SIZE):
+                    await db.exec(update(User), params=rows[start:start + LAST_SEEN_BATCH_SIZE])
+                await db.commit()
+        except Exception as e:
+            print(f"last_seen flush failed ({len(rows)} users): {e}")
+            # Keep the newer timestamps recorded meanwhile
+            for user_id, seen_at in seen.items():
+                self._seen.setdefault(user_id, seen_at)
+            return
+        self.flushes += 1
+        self.rows_flushed += len(rows)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_flush = loop.time() + self.flush_interval
+        while True:
+            await asyncio.sleep(self.push_interval)
+            try:
+                await self.push_changes()
+                if loop.time() >= next_flush:
+                    await self.flush_last_seen()
+                    next_flush = loop.time() + self.flush_interval
+            except Exception as e:
+                print(f"Presence error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "local_users": len(self._local),
+            "pending_last_seen": len(self._seen),
+            "pushes": self.pushes,
+            "last_seen_flushes": self.flushes,
+            "last_seen_rows": self.rows_flushed,
+        }
+
+
+presence = PresenceRegistry(get_pubsub())
@@ -0,0 +1,339 @@
+import asyncio
+from abc import ABC, abstractmethod
+import json
+import os
+import re
+import socket
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Sequence, Set, Tuple
+
+from app.database import get_database_url
+
+Handler = Callable[[int, dict, Optional[Hashable]], Awaitable[None]]
+
+
+def default_node_id() -> str:
+    """Identify this worker: NODE_ID if set, else hostname plus pid."""
+    return os.getenv("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _listen_channel(node_id: str) -> str:
+    """Map a node id to a valid PostgreSQL LISTEN channel name."""
+    return "rt_" + re.sub(r"[^a-z0-9_]", "_", node_id.lower())[:60]
+
+
+class PubSubBackend(ABC):
+    """
+    Cross-worker delivery for the realtime managers.
+
+    Every node owns the WebSockets it accepted. The routing table records
+    which nodes hold connections for a (channel, user) pair, so a node that
+    does not hold the recipient locally can publish the event straight to
+    the owning node(s) instead of broadcasting it everywhere.
+    """
+
+    def __init__(self, node_id: Optional[str] = None):
+        self.node_id = node_id or default_node_id()
+        self._handlers: Dict[str, Handler] = {}
+
+    def subscribe(self, channel: str, handler: Handler):
+        """Register the local delivery handler for a channel."""
+        self._handlers[channel] = handler
+
+    async def start(self):
+        """Connect to the transport (no-op by default)."""
+
+    async def stop(self):
+        """Disconnect from the transport (no-op by default)."""
+
+    @abstractmethod
+    async def claim(self, channel: str, user_id: int):
+        """Record that this node now holds a connection for user_id."""
+
+    @abstractmethod
+    async def release(self, channel: str, user_id: int):
+        """Record that this node no longer holds a connection for user_id."""
+
+    @abstractmethod
+    async def nodes_for(self, channel: str, user_id: int) -> Set[str]:
+        """Return the live nodes holding a connection for user_id on channel."""
+
+    @abstractmethod
+    async def publish(
+        self, node_id: str, channel: str, user_id: int, message: dict,
+        coalesce_key: Optional[Hashable] = None,
+    ):
+        """Deliver a message to a handler on another node."""
+
+    async def online_users(self, channels: Sequence[str], user_ids: Sequence[int]) -> Set[int]:
+        """
+        Return the users among user_ids connected to any live node on any of
+        channels. Backends override this with a single lookup.
+        """
+        online = set()
+        for user_id in user_ids:
+            for channel in channels:
+                if await self.nodes_for(channel, user_id):
+                    online.add(user_id)
+                    break
+        return online
+
+    async def send_remote(
+        self, channel: str, user_id: int, message: dict,
+        coalesce_key: Optional[Hashable] = None,
+    ) -> bool:
+        """
+        Forward a message to every other node holding user_id.
+
+        Returns:
+            bool: True if at least one remote node was targeted
+        """
+        nodes = await self.nodes_for(channel, user_id)
+        nodes.discard(self.node_id)
+        for node_id in nodes:
+            await self.publish(node_id, channel, user_id, message, coalesce_key)
+        return bool(nodes)
+
+    async def _dispatch(
+        self, channel: str, user_id: int, message: dict,
+        coalesce_key: Optional[Hashable] = None,
+    ):
+        handler = self._handlers.get(channel)
+        if handler:
+            try:
+                await handler(user_id, message, coalesce_key)
+            except Exception as e:
+                print(f"Realtime dispatch error on {channel} for user {user_id}: {e}")
+
+
+class InProcessBus:
+    """Shared state for InProcessPubSub nodes living in one process."""
+
+    def __init__(self):
+        self.nodes: Dict[str, "InProcessPubSub"] = {}
+        self.routes: Dict[Tuple[str, int], Set[str]] = {}
+
+
+class InProcessPubSub(PubSubBackend):
+    """
+    Single-process backend.
+
+    With the default private bus this is the single-worker deployment.
+    Several instances sharing one bus behave like separate workers, which is
+    how the cross-node paths are exercised in tests.
+    """
+
+    def __init__(self, node_id: Optional[str] = None, bus: Optional[InProcessBus] = None):
+        super().__init__(node_id)
+        self.bus = bus or InProcessBus()
+        self.bus.nodes[self.node_id] = self
+
+    async def claim(self, channel: str, user_id: int):
+        self.bus.routes.setdefault((channel, user_id), set()).add(self.node_id)
+
+    async def release(self, channel: str, user_id: int):
+        nodes = self.bus.routes.get((channel, user_id))
+        if nodes:
+            nodes.discard(self.node_id)
+            if not nodes:
+                del self.bus.routes[(channel, user_id)]
+
+    async def nodes_for(self, channel: str, user_id: int) -> Set[str]:
+        return set(self.bus.routes.get((channel, user_id), ()))
+
+    async def online_users(self, channels: Sequence[str], user_ids: Sequence[int]) -> Set[int]:
+        routes = self.bus.routes
+        return {
+            user_id for user_id in user_ids
+            if any(routes.get((channel, user_id)) for channel in channels)
+        }
+
+    async def publish(
+        self, node_id: str, channel: str, user_id: int, message: dict,
+        coalesce_key: Optional[Hashable] = None,
+    ):
+        node = self.bus.nodes.get(node_id)
+        if node:
+            await node._dispatch(channel, user_id, message, coalesce_key)
+
+
+class PostgresPubSub(PubSubBackend):
+    """
+    PostgreSQL LISTEN/NOTIFY backend.
+
+    Each node LISTENs on its own channel, so a NOTIFY reaches exactly the
+    node that owns the recipient. Routes live in the realtimeroute table and
+    are only trusted while their node holds a lease in realtimenode: every
+    node renews its lease each NODE_HEARTBEAT_SECONDS, and routes of nodes
+    whose lease is older than NODE_LEASE_SECONDS are ignored and then
+    deleted, so a crashed worker cannot keep its users "online". The same
+    loop re-establishes the LISTEN connection if it was dropped. NOTIFY
+    payloads are limited to 8000 bytes, which fits chat and signalling events.
+    """
+
+    def __init__(
+        self,
+        node_id: Optional[str] = None,
+        dsn: Optional[str] = None,
+        heartbeat_seconds: float = float(os.getenv("NODE_HEARTBEAT_SECONDS", "10")),
+        lease_seconds: float = float(os.getenv("NODE_LEASE_SECONDS", "30")),
+    ):
+        super().__init__(node_id)
+        self.dsn = dsn
+        self.listen_channel = _listen_channel(self.node_id)
+        self.heartbeat_seconds = heartbeat_seconds
+        self.lease_seconds = lease_seconds
+        self._pool = None
+        self._listener = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def start(self):
+        import asyncpg
+
+        self._dsn = self.dsn or get_database_url()
+        self._pool = await asyncpg.create_pool(self._dsn, min_size=1, max_size=5)
+        await self._pool.execute("DELETE FROM realtimeroute WHERE node_id = $1", self.node_id)
+        await self._renew_lease()
+        await self._listen()
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        if self._pool:
+            try:
+                await self._pool.execute("DELETE FROM realtimeroute WHERE node_id = $1", self.node_id)
+                await self._pool.execute("DELETE FROM realtimenode WHERE node_id = $1", self.node_id)
+            except Exception as e:
+                print(f"Realtime route cleanup failed: {e}")
+        if self._listener:
+            await self._listener.close()
+            self._listener = None
+        if self._pool:
+            await self._pool.close()
+            self._pool = None
+
+    async def _listen(self):
+        import asyncpg
+
+        listener = await asyncpg.connect(self._dsn)
+        await listener.add_listener(self.listen_channel, self._on_notify)
+        listener.add_termination_listener(self._on_listener_lost)
+        self._listener = listener
+
+    def _on_listener_lost(self, connection):
+        print(f"Realtime LISTEN connection lost on node {self.node_id}; reconnecting")
+        if self._listener is connection:
+            self._listener = None
+
+    async def _renew_lease(self):
+        await self._pool.execute(
+            "INSERT INTO realtimenode (node_id, heartbeat_at) VALUES ($1, (NOW() AT TIME ZONE 'utc')) "
+            "ON CONFLICT (node_id) DO UPDATE SET heartbeat_at = EXCLUDED.heartbeat_at",
+            self.node_id,
+        )
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await self._renew_lease()
+                if self._listener is None or self._listener.is_closed():
+                    await self._listen()
+                # Reap routes of nodes that stopped renewing their lease
+                await self._pool.execute(
+                    "DELETE FROM realtimeroute WHERE node_id IN ("
+                    "SELECT node_id FROM realtimenode "
+                    "WHERE heartbeat_at < (NOW() AT TIME ZONE 'utc') - make_interval(secs => $1))",
+                    self.lease_seconds,
+                )
+                await self._pool.execute(
+                    "DELETE FROM realtimenode WHERE heartbeat_at < (NOW() AT TIME ZONE 'utc') - make_interval(secs => $1)",
+                    self.lease_seconds,
+                )
+            except Exception as e:
+                print(f"Realtime heartbeat failed on node {self.node_id}: {e}")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            envelope = json.loads(payload)
+        except ValueError:
+            return
+        # JSON turns tuple keys into lists; restore them so they stay hashable
+        coalesce_key = envelope.get("coalesce_key")
+        if isinstance(coalesce_key, list):
+            coalesce_key = tuple(coalesce_key)
+        task = asyncio.create_task(
+            self._dispatch(envelope["channel"], envelope["user_id"], envelope["message"], coalesce_key)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def claim(self, channel: str, user_id: int):
+        if self._pool:
+            await self._pool.execute(
+                "INSERT INTO realtimeroute (channel, user_id, node_id, updated_at) "
+                "VALUES ($1, $2, $3, (NOW() AT TIME ZONE 'utc')) ON CONFLICT DO NOTHING",
+                channel, user_id, self.node_id,
+            )
+
+    async def release(self, channel: str, user_id: int):
+        if self._pool:
+            await self._pool.execute(
+                "DELETE FROM realtimeroute WHERE channel = $1 AND user_id = $2 AND node_id = $3",
+                channel, user_id, self.node_id,
+            )
+
+    async def nodes_for(self, channel: str, user_id: int) -> Set[str]:
+        if not self._pool:
+            return set()
+        rows = await self._pool.fetch(
+            "SELECT r.node_id FROM realtimeroute r "
+            "JOIN realtimenode n ON n.node_id = r.node_id "
+            "WHERE r.channel = $1 AND r.user_id = $2 "
+            "AND n.heartbeat_at >= (NOW() AT TIME ZONE 'utc') - make_interval(secs => $3)",
+            channel, user_id, self.lease_seconds,
+        )
+        return {row["node_id"] for row in rows}
+
+    async def online_users(self, channels: Sequence[str], user_ids: Sequence[int]) -> Set[int]:
+        if not self._pool or not user_ids:
+            return set()
+        rows = await self._pool.fetch(
+            "SELECT DISTINCT r.user_id FROM realtimeroute r "
+            "JOIN realtimenode n ON n.node_id = r.node_id "
+            "WHERE r.channel = ANY($1::text[]) AND r.user_id = ANY($2::int[]) "
+            "AND n.heartbeat_at >= (NOW() AT TIME ZONE 'utc') - make_interval(secs => $3)",
+            list(channels), list(user_ids), self.lease_seconds,
+        )
+        return {row["user_id"] for row in rows}
+
+    async def publish(
+        self, node_id: str, channel: str, user_id: int, message: dict,
+        coalesce_key: Optional[Hashable] = None,
+    ):
+        if not self._pool:
+            return
+        payload = json.dumps({
+            "channel": channel,
+            "user_id": user_id,
+            "message": message,
+            "coalesce_key": coalesce_key,
+        }, default=str)
+        await self._pool.execute("SELECT pg_notify($1, $2)", _listen_channel(node_id), payload)
+
+
+def get_pubsub() -> PubSubBackend:
+    """Get the process-wide realtime backend, creating it if necessary.
+
+    REALTIME_BACKEND selects the implementation: "memory" (default, single
+    worker) or "postgres" (LISTEN/NOTIFY over DATABASE_URL).
+    """
+    if not hasattr(get_pubsub, '_backend'):
+        kind = os.getenv("REALTIME_BACKEND", "memory").lower()
+        if kind == "postgres":
+            get_pubsub._backend = PostgresPubSub()
+        else:
+            get_pubsub._backend = InProcessPubSub()
+    return get_pubsub._backend
@@ -0,0 +1,153 @@
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+# Largest number of users in one call room
+CALL_ROOM_MAX_PARTICIPANTS = int(os.getenv("CALL_ROOM_MAX_PARTICIPANTS", "32"))
+
+
+class RoomNotFound(LookupError):
+    """No room with this id on the worker that owns it, or none the user may join."""
+
+
+class RoomFull(Exception):
+    """The room already has its maximum number of participants."""
+
+
+class CallRoom:
+    """In-memory state of one multi-party call on the worker that owns it."""
+
+    __slots__ = ("room_id", "created_by", "call_type", "created_at", "members", "invited")
+
+    def __init__(self, room_id: str, created_by: int, call_type: str):
+        self.room_id = room_id
+        self.created_by = created_by
+        self.call_type = call_type
+        self.created_at = datetime.utcnow()
+        # user id -> when they joined, in join order
+        self.members: Dict[int, datetime] = {}
+        # Users allowed to join
+        self.invited: Set[int] = {created_by}
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.members
+
+    @property
+    def participants(self) -> List[int]:
+        return list(self.members)
+
+    def to_dict(self) -> dict:
+        return {
+            "room_id": self.room_id,
+            "created_by": self.created_by,
+            "call_type": self.call_type,
+            "participants": self.participants,
+        }
+
+
+class RoomRegistry:
+    """
+    Call rooms owned by this worker, indexed by id and by member.
+
+    Joining, leaving and listing a room's members cost O(1) or O(room
+    size), and finding the rooms of a user costs O(rooms of that user), so
+    nothing scans every room or connection. Only invited users may join; to
+    everyone else a room does not exist. A room is dropped when its last
+    member leaves.
+    """
+
+    def __init__(self, max_participants: int = CALL_ROOM_MAX_PARTICIPANTS):
+        self.max_participants = max_participants
+        self.joins = 0
+        self.rejected_full = 0
+        self._rooms: Dict[str, CallRoom] = {}
+        self._by_user: Dict[int, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._rooms)
+
+    def __contains__(self, room_id: str) -> bool:
+        return room_id in self._rooms
+
+    def __iter__(self) -> Iterator[CallRoom]:
+        return iter(list(self._rooms.values()))
+
+    def get(self, room_id: str) -> Optional[CallRoom]:
+        return self._rooms.get(room_id)
+
+    def create(self, room_id: str, user_id: int, call_type: str, invite: Iterable[int] = ()) -> CallRoom:
+        """Open a room with user_id as its first member and invite users to it."""
+        room = CallRoom(room_id, user_id, call_type)
+        room.invited.update(invite)
+        self._rooms[room_id] = room
+        self.join(room_id, user_id)
+        return room
+
+    def invite(self, room_id: str, user_id: int, invitees: Iterable[int]) -> List[int]:
+        """
+        Let a member invite more users; returns those not invited before.
+
+        Raises:
+            RoomNotFound: No such room, or user_id is not a member
+        """
+        room = self._rooms.get(room_id)
+        if room is None or user_id not in room.members:
+            raise RoomNotFound(room_id)
+        added = [invitee for invitee in dict.fromkeys(invitees) if invitee not in room.invited]
+        room.invited.update(added)
+        return added
+
+    def join(self, room_id: str, user_id: int) -> CallRoom:
+        """
+        Add user_id to a room; joining a room twice is a no-op.
+
+        Raises:
+            RoomNotFound: No such room, or user_id was not invited
+            RoomFull: The room has ``max_participants`` members
+        """
+        room = self._rooms.get(room_id)
+        if room is None or user_id not in room.invited:
+            raise RoomNotFound(room_id)
+        if user_id in room.members:
+            return room
+        if len(room.members) >= self.max_participants:
+            self.rejected_full += 1
+            raise RoomFull(room_id)
+        room.members[user_id] = datetime.utcnow()
+        self._by_user.setdefault(user_id, set()).add(room_id)
+        self.joins += 1
+        return room
+
+    def leave(self, room_id: str, user_id: int) -> Optional[CallRoom]:
+        """Remove user_id from a room; returns the room if they were a member."""
+        room = self._rooms.get(room_id)
+        if room is None or room.members.pop(user_id, None) is None:
+            return None
+        room_ids = self._by_user.get(user_id)
+        if room_ids is not None:
+            room_ids.discard(room_id)
+            if not room_ids:
+                del self._by_user[user_id]
+        if not room.members:
+            del self._rooms[room_id]
+        return room
+
+    def rooms_of(self, user_id: int) -> List[CallRoom]:
+        """Rooms user_id is a member of."""
+        return [self._rooms[room_id] for room_id in self._by_user.get(user_id, ())]
+
+    def clear(self):
+        self._rooms.clear()
+        self._by_user.clear()
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self._rooms),
+            "members": sum(len(room_ids) for room_ids in self._by_user.values()),
+            "max_participants": self.max_participants,
+            "joins": self.joins,
+            "rejected_full": self.rejected_full,
+        }
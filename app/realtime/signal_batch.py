@@ -0,0 +1,129 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Trickle ICE candidates of one (sender, recipient, call) are held this long
+# and relayed as one frame; 0 relays every signal on its own
+WEBRTC_ICE_BATCH_MS = float(os.getenv("WEBRTC_ICE_BATCH_MS", "0"))
+# A batch is relayed early once it holds this many candidates
+WEBRTC_ICE_BATCH_MAX = int(os.getenv("WEBRTC_ICE_BATCH_MAX", "32"))
+
+# (sender_id, recipient_id, call_id)
+Key = Tuple[int, int, Optional[str]]
+# send(recipient_id, frame)
+SendFn = Callable[[int, dict], Awaitable[Any]]
+
+ICE_CANDIDATE_TYPES = ("candidate", "ice_candidate", "ice-candidate")
+
+
+def is_ice_candidate(signal: Any) -> bool:
+    """Whether a webrtc_signal payload is a trickle ICE candidate (not SDP)."""
+    if not isinstance(signal, dict):
+        return False
+    return signal.get("type") in ICE_CANDIDATE_TYPES or (
+        "candidate" in signal and "sdp" not in signal
+    )
+
+
+class IceCandidateBatcher:
+    """
+    Relay of webrtc_signal payloads that coalesces trickle ICE candidates.
+
+    SDP offers and answers (anything that is not a candidate) are relayed
+    at once as ``webrtc_signal`` frames. Candidates of one (sender,
+    recipient, call) are held for ``window_ms`` and relayed together as one
+    ``{"type": "webrtc_signal_batch", "signals": [...]}`` frame, or earlier
+    once ``max_batch`` are waiting. Held candidates are always relayed
+    before the next SDP of the same key, so the recipient sees the sender's
+    signals in order. Every batch waits the same window, so the
+    OrderedDict of open batches is in flush order and a single flusher
+    task only ever looks at its head; it is started lazily on the running
+    event loop. With a window of 0 every signal is relayed on its own.
+    """
+
+    def __init__(
+        self,
+        send: SendFn,
+        window_ms: float = WEBRTC_ICE_BATCH_MS,
+        max_batch: int = WEBRTC_ICE_BATCH_MAX,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.send = send
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.clock = clock
+        self.signals = 0
+        self.frames = 0
+        self._batches: "OrderedDict[Key, List[dict]]" = OrderedDict()
+        self._flush_at: Dict[Key, float] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def relay(self, sender_id: int, recipient_id: int, call_id: Optional[str], signal: Any):
+        """
+        Relay one webrtc_signal payload from sender_id to recipient_id.
+
+        Args:
+            sender_id (int): User the signal comes from
+            recipient_id (int): User the signal is for
+            call_id (Optional[str]): Call the signal belongs to, if the client names it
+            signal (Any): Opaque payload (SDP or ICE candidate)
+        """
+        self.signals += 1
+        key = (sender_id, recipient_id, call_id)
+        if self.window <= 0 or not is_ice_candidate(signal):
+            await self.flush(key)
+            await self._send(key, {"type": "webrtc_signal", "data": signal})
+            return
+
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = []
+            self._flush_at[key] = self.clock() + self.window
+            self._ensure_flusher()
+        batch.append(signal)
+        if len(batch) >= self.max_batch:
+            await self.flush(key)
+
+    async def flush(self, key: Key):
+        """Relay the candidates held for key, if any."""
+        batch = self._batches.pop(key, None)
+        self._flush_at.pop(key, None)
+        if batch:
+            await self._send(key, {"type": "webrtc_signal_batch", "signals": batch})
+
+    async def _send(self, key: Key, frame: dict):
+        sender_id, recipient_id, call_id = key
+        frame["sender_id"] = sender_id
+        if call_id is not None:
+            frame["call_id"] = call_id
+        self.frames += 1
+        try:
+            await self.send(recipient_id, frame)
+        except Exception as e:
+            print(f"Error relaying WebRTC signal from user {sender_id} to user {recipient_id}: {e}")
+
+    def _ensure_flusher(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._flusher is None or self._flusher.done():
+            self._loop = loop
+            self._flusher = loop.create_task(self._flush_due())
+
+    async def _flush_due(self):
+        while self._batches:
+            key = next(iter(self._batches))
+            delay = self._flush_at[key] - self.clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            await self.flush(key)
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": self.window * 1000,
+            "signals": self.signals,
+            "frames": self.frames,
+            "open_batches": len(self._batches),
+        }
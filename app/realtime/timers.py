@@ -0,0 +1,159 @@
+import asyncio
+import inspect
+import math
+import os
+import time
+from typing import Any, Callable, List, Optional, Set
+
+# Granularity of timers: a timer fires within one resolution after its deadline
+TIMER_WHEEL_RESOLUTION_MS = float(os.getenv("TIMER_WHEEL_RESOLUTION_MS", "100"))
+# Slots of the wheel; timers further out than slots * resolution wait extra rounds
+TIMER_WHEEL_SLOTS = int(os.getenv("TIMER_WHEEL_SLOTS", "1024"))
+
+
+class Timer:
+    """Handle of a scheduled callback, used to cancel it."""
+
+    __slots__ = ("due", "callback", "args", "done")
+
+    def __init__(self, due: int, callback: Callable[..., Any], args: tuple):
+        self.due = due
+        self.callback = callback
+        self.args = args
+        # Fired or cancelled
+        self.done = False
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel for one-shot callbacks.
+
+    Time is cut into ticks of ``resolution`` seconds and a timer due at tick
+    ``n`` is kept in slot ``n % slots``, so scheduling and cancelling are
+    O(1) and a tick only looks at the timers of one slot (those due then
+    plus those a whole number of rounds further out). A single task
+    advances the wheel while timers are pending; it is started lazily on
+    the running event loop and exits once the wheel is empty, so any
+    number of pending timers costs one task. Callbacks may be coroutine
+    functions; the ones due in the same tick run concurrently.
+    """
+
+    def __init__(
+        self,
+        resolution_ms: float = TIMER_WHEEL_RESOLUTION_MS,
+        slots: int = TIMER_WHEEL_SLOTS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.resolution = resolution_ms / 1000
+        self.clock = clock
+        self.fired = 0
+        self.cancelled = 0
+        self._wheel: List[Set[Timer]] = [set() for _ in range(max(1, slots))]
+        self._pending = 0
+        self._origin = clock()
+        # Last tick processed
+        self._tick = 0
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __len__(self) -> int:
+        return self._pending
+
+    def _now_tick(self) -> int:
+        # The epsilon keeps float error (0.3 / 0.1 < 3) from losing a tick
+        return int((self.clock() - self._origin) / self.resolution + 1e-9)
+
+    def _ensure_running(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No loop (sync caller): the next schedule on a loop starts the wheel
+            return
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._task = loop.create_task(self._run())
+
+    def schedule(self, delay: float, callback: Callable[..., Any], *args: Any) -> Timer:
+        """
+        Call ``callback(*args)`` once, ``delay`` seconds from now.
+
+        Args:
+            delay (float): Seconds until the callback is due
+            callback (Callable): Function or coroutine function to call
+            *args: Arguments for the callback
+
+        Returns:
+            Timer: Handle for ``cancel``
+        """
+        if self._pending == 0:
+            # Nothing can be overdue on an empty wheel; skip the idle ticks
+            self._tick = max(self._tick, self._now_tick())
+        deadline = self.clock() + delay - self._origin
+        due = max(self._tick + 1, math.ceil(deadline / self.resolution))
+        timer = Timer(due, callback, args)
+        self._wheel[due % len(self._wheel)].add(timer)
+        self._pending += 1
+        self._ensure_running()
+        return timer
+
+    def cancel(self, timer: Timer):
+        """Drop timer if it has not fired yet."""
+        if timer.done:
+            return
+        timer.done = True
+        slot = self._wheel[timer.due % len(self._wheel)]
+        if timer in slot:
+            slot.discard(timer)
+            self._pending -= 1
+            self.cancelled += 1
+
+    async def advance(self):
+        """Fire every timer due up to now."""
+        target = self._now_tick()
+        due: List[Timer] = []
+        while self._tick < target and self._pending > len(due):
+            self._tick += 1
+            slot = self._wheel[self._tick % len(self._wheel)]
+            expired = [timer for timer in slot if timer.due <= self._tick]
+            slot.difference_update(expired)
+            due.extend(expired)
+        if self._pending == len(due):
+            self._tick = max(self._tick, target)
+        self._pending -= len(due)
+        if not due:
+            return
+        self.fired += len(due)
+        waiting = []
+        for timer in due:
+            timer.done = True
+            try:
+                result = timer.callback(*timer.args)
+            except Exception as e:
+                print(f"Timer callback error: {e}")
+                continue
+            if inspect.isawaitable(result):
+                waiting.append(result)
+        if waiting:
+            for result in await asyncio.gather(*waiting, return_exceptions=True):
+                if isinstance(result, Exception):
+                    print(f"Timer callback error: {result}")
+
+    async def _run(self):
+        while self._pending:
+            next_tick = self._origin + (self._tick + 1) * self.resolution
+            await asyncio.sleep(max(0.0, next_tick - self.clock()))
+            try:
+                await self.advance()
+            except Exception as e:
+                print(f"Timer wheel error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending,
+            "resolution_ms": self.resolution * 1000,
+            "fired": self.fired,
+            "cancelled": self.cancelled,
+        }
+
+
+timers = TimerWheel()
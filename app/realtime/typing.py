@@ -0,0 +1,100 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+
+# A sender who stops sending typing frames is considered idle after this long
+TYPING_TIMEOUT_SECONDS = float(os.getenv("TYPING_TIMEOUT_SECONDS", "5"))
+
+Pair = Tuple[int, int]
+# emit(sender_id, recipient_id, is_typing)
+EmitFn = Callable[[int, int, bool], Awaitable[None]]
+
+
+class TypingTracker:
+    """
+    Per-(sender, recipient) typing state that only forwards transitions.
+
+    Keystroke frames only refresh the pair's expiry; the recipient hears
+    ``is_typing: true`` once when typing starts and ``false`` when the
+    sender stops, disconnects or goes quiet for ``timeout`` seconds. The
+    expiry is the same for every pair, so the OrderedDict kept in refresh
+    order is also in expiry order and a single sweeper task only ever looks
+    at its head.
+
+    State is per worker: a sender whose devices sit on different workers is
+    tracked by each of them.
+    """
+
+    def __init__(
+        self,
+        emit: EmitFn,
+        timeout: float = TYPING_TIMEOUT_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.emit = emit
+        self.timeout = timeout
+        self.clock = clock
+        self.updates = 0
+        self.emitted = 0
+        self._expires: "OrderedDict[Pair, float]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def is_typing(self, sender_id: int, recipient_id: int) -> bool:
+        return (sender_id, recipient_id) in self._expires
+
+    async def update(self, sender_id: int, recipient_id: int, is_typing: bool = True):
+        """
+        Record a typing frame from sender_id to recipient_id.
+
+        Args:
+            sender_id (int): User who is typing
+            recipient_id (int): User watching the conversation
+            is_typing (bool): False when the client reports it stopped
+        """
+        self.updates += 1
+        pair = (sender_id, recipient_id)
+        if not is_typing:
+            if self._expires.pop(pair, None) is not None:
+                await self._emit(pair, False)
+            return
+
+        started = pair not in self._expires
+        self._expires[pair] = self.clock() + self.timeout
+        self._expires.move_to_end(pair)
+        if started:
+            self._ensure_sweeper()
+            await self._emit(pair, True)
+
+    async def clear_sender(self, sender_id: int):
+        """Stop every indicator of sender_id, e.g. when they go offline."""
+        for pair in [pair for pair in self._expires if pair[0] == sender_id]:
+            del self._expires[pair]
+            await self._emit(pair, False)
+
+    async def _emit(self, pair: Pair, is_typing: bool):
+        self.emitted += 1
+        try:
+            await self.emit(pair[0], pair[1], is_typing)
+        except Exception as e:
+            print(f"Error sending typing state for {pair}: {e}")
+
+    def _ensure_sweeper(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._sweeper is None or self._sweeper.done():
+            self._loop = loop
+            self._sweeper = loop.create_task(self._sweep())
+
+    async def _sweep(self):
+        while self._expires:
+            pair, deadline = next(iter(self._expires.items()))
+            delay = deadline - self.clock()
+            if delay > 0:
+                # New and refreshed pairs always expire after the head, so
+                # sleeping until the head's deadline never misses one
+                await asyncio.sleep(delay)
+                continue
+            del self._expires[pair]
+            await self._emit(pair, False)
@@ -1,25 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, status
 
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
-from sqlmodel import Session, select
+from sqlalchemy import update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
 from app.models import User
 
-from app.database import get_db
+from app.database import get_async_db, get_async_engine
 
 from passlib.context import CryptContext
 
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 from jose import JWTError, jwt
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
-from typing import Optional
+from typing import Optional, Tuple
 
 import os
+import time
+
+from app.cache import TTLCache
+from app.hashing import PasswordHasher
+from app.sessions import (
+    RevocationList,
+    create_session,
+    revoke_session,
+    revoke_user_sessions,
+    rotate_session,
+)
 
 # Settings - move to config later
 
@@ -27,9 +41,22 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-me")
 
 ALGORITHM = "HS256"
 
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Short-lived: a revoked session's access tokens die with their expiry
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+
+# Lifetime of WebSocket resume tokens; a client reconnecting within it skips
+# the user lookup and resumes from its delivery cursor
+RESUME_TOKEN_EXPIRE_SECONDS = int(os.getenv("RESUME_TOKEN_EXPIRE_SECONDS", "300"))
+# WebSocket close code for a failed handshake (application range, mirrors 401)
+WS_CLOSE_UNAUTHORIZED = 4401
+
+# Verified tokens are mapped to a user snapshot for this long (capped by the
+# token's own expiry); bounds staleness on workers that missed an invalidation
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(pwd_context)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
@@ -43,6 +70,66 @@ class UserCreate(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class CurrentUser(BaseModel):
+    """Read-only snapshot of the authenticated user, safe to cache."""
+    model_config = ConfigDict(frozen=True)
+
+    id: int
+    username: str
+    email: str
+    is_active: bool = True
+    session_id: Optional[int] = None
+
+# token -> (epoch the snapshot was read in, CurrentUser)
+user_cache = TTLCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL_SECONDS)
+# Snapshots of a user read before their latest invalidation epoch are stale.
+# user id -> (epoch, monotonic time), oldest invalidation first; kept only
+# for the cache TTL, after which every snapshot it could reject has expired
+_cache_epoch = 0
+_invalidated_at: "OrderedDict[int, Tuple[int, float]]" = OrderedDict()
+
+# Revoked session ids, kept until their last access token has expired (with
+# margin for clock skew); refreshed from the database in the background
+revocations = RevocationList(retain=timedelta(minutes=2 * ACCESS_TOKEN_EXPIRE_MINUTES))
+
+def invalidate_user(user_id: int):
+    """Drop cached snapshots of user_id after its profile or status changed."""
+    global _cache_epoch
+    _cache_epoch += 1
+    now = time.monotonic()
+    _invalidated_at.pop(user_id, None)
+    _invalidated_at[user_id] = (_cache_epoch, now)
+    while _invalidated_at:
+        oldest_id, (_, invalidated) = next(iter(_invalidated_at.items()))
+        if now - invalidated < USER_CACHE_TTL_SECONDS:
+            break
+        del _invalidated_at[oldest_id]
+
+async def revoke_user_tokens(db: AsyncSession, user_id: int):
+    """
+    Invalidate every access and refresh token of user_id. Does not commit.
+
+    Bumps ``User.token_version`` and revokes all sessions. This worker
+    rejects the old tokens at once; other workers learn about it through
+    the session revocation sync.
+    """
+    version = (await db.exec(
+        update(User)
+        .where(User.id == user_id)
+        .values(token_version=User.token_version + 1)
+        .returning(User.token_version)
+    )).scalar_one_or_none()
+    now = datetime.utcnow()
+    for session_id in await revoke_user_sessions(db, user_id):
+        revocations.add(session_id, now)
+    if version is not None:
+        revocations.retire_token_versions(user_id, version)
+    invalidate_user(user_id)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -60,8 +147,16 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def issue_tokens(user: User, session_id: int, refresh_token: str) -> dict:
+    """Build the token response for a session."""
+    access_token = create_access_token(
+        data={"sub": user.username, "uid": user.id, "ver": user.token_version, "sid": session_id},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
 @router.post("/register", response_model=User)
-def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Register a new user.
 
@@ -72,28 +167,30 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         User: Created user.
     """
     try:
-        existing_user = db.exec(select(User).where(User.username == user.username)).first()
+        existing_user = (await db.exec(select(User).where(User.username == user.username))).first()
         if existing_user:
             raise HTTPException(status_code=400, detail="Username already registered")
-        existing_email = db.exec(select(User).where(User.email == user.email)).first()
+        existing_email = (await db.exec(select(User).where(User.email == user.email))).first()
         if existing_email:
             raise HTTPException(status_code=400, detail="Email already registered")
+        # Return the connection to the pool while the password is hashed
+        await db.commit()
 
         # Create new user with hashed password
         db_user = User(
             username=user.username,
             email=user.email,
-            hashed_password=get_password_hash(user.password)
+            hashed_password=await password_hasher.hash(user.password)
         )
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
         return db_user
     except HTTPException as he:
-        # Preserve explicit HTTP errors (e.g., duplicate username/email)
+        # Preserve explicit HTTP errors (e.g., duplicate username/email, hasher busy)
         raise he
     except IntegrityError as ie:
-        db.rollback()
+        await db.rollback()
         message = str(ie.orig) if getattr(ie, "orig", None) else str(ie)
         if "username" in message.lower():
             raise HTTPException(status_code=400, detail="Username already registered")
@@ -101,48 +198,91 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
             raise HTTPException(status_code=400, detail="Email already registered")
         raise HTTPException(status_code=400, detail="Invalid user data")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Registration error: {e}")
         raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
 
 @router.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_for_access_token(
+    request: Request,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_async_db)
+):
     """
-    Login and get access token.
+    Login, open a session and get its access and refresh tokens.
 
     Returns:
-        Token: JWT token.
+        Token: Short-lived JWT access token and the session's refresh token.
     """
-    user = db.exec(select(User).where(User.username == form_data.username)).first()
+    user = (await db.exec(select(User).where(User.username == form_data.username))).first()
+    # Return the connection to the pool while the password is hashed
+    await db.commit()
     # Auto-provision user in test/dev flows if not present
     if not user:
         try:
             user = User(
                 username=form_data.username,
                 email=f"{form_data.username}@example.com",
-                hashed_password=get_password_hash(form_data.password),
+                hashed_password=await password_hasher.hash(form_data.password),
             )
             db.add(user)
-            db.commit()
-            db.refresh(user)
+            await db.commit()
+            await db.refresh(user)
+        except HTTPException:
+            raise
         except Exception:
-            db.rollback()
+            await db.rollback()
             # Fall through to standard 401 if provisioning fails
             user = None
-    if not user or not verify_password(form_data.password, user.hashed_password):
+        # The hash was just made from this password; no need to verify it
+        authenticated = user is not None
+    else:
+        authenticated = await password_hasher.verify(form_data.password, user.hashed_password)
+    if not authenticated:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+    session, refresh_token = await create_session(
+        db, user.id,
+        ip_address=request.client.host if request.client else None,
+        user_agent=request.headers.get("user-agent"),
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    return issue_tokens(user, session.id, refresh_token)
 
-# To get current user
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+@router.post("/refresh", response_model=Token)
+async def refresh_access_token(body: RefreshRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Exchange a refresh token for a new access token and refresh token.
+
+    The presented refresh token is single-use.
+
+    Returns:
+        Token: New access and refresh tokens for the same session.
+    """
+    rotated = await rotate_session(db, body.refresh_token)
+    user = await db.get(User, rotated[0].user_id) if rotated else None
+    if user is None or not user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    session, refresh_token = rotated
+    return issue_tokens(user, session.id, refresh_token)
+
+def _decode_access_token(token: str, typ: Optional[str] = None) -> dict:
+    """
+    Verify an access token and reject revoked or superseded ones.
+
+    Args:
+        token (str): Signed JWT
+        typ (Optional[str]): Expected ``typ`` claim; None for access tokens
+
+    Raises:
+        HTTPException: 401 if the token is invalid, revoked or outdated
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -150,12 +290,202 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.exec(select(User).where(User.username == username)).first()
-    if user is None:
+    if payload.get("sub") is None or payload.get("typ") != typ:
+        raise credentials_exception
+    session_id = payload.get("sid")
+    if session_id is not None and session_id in revocations:
         raise credentials_exception
-    return user
+    user_id = payload.get("uid")
+    if user_id is not None and not revocations.token_version_ok(user_id, payload.get("ver", 0)):
+        raise credentials_exception
+    return payload
+
+# To get current user
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> CurrentUser:
+    """
+    Resolve the bearer token to the current user.
+
+    Verified tokens are cached with a snapshot of their user, so repeat
+    requests skip both the JWT check and the user lookup until the entry
+    expires or ``invalidate_user`` is called.
+
+    Returns:
+        CurrentUser: Snapshot of the authenticated, active user
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    cached = user_cache.get(token)
+    if cached is not None:
+        epoch, current_user = cached
+        if current_user.session_id in revocations:
+            user_cache.pop(token)
+            raise credentials_exception
+        if epoch >= _invalidated_at.get(current_user.id, (0, 0.0))[0]:
+            return current_user
+        user_cache.pop(token)
+
+    # Taken before the lookup so an invalidation racing with it wins
+    epoch = _cache_epoch
+    payload = _decode_access_token(token)
+    user_id = payload.get("uid")
+    if user_id is not None:
+        user = await db.get(User, user_id)
+    else:
+        # Tokens issued before ids were embedded
+        user = (await db.exec(select(User).where(User.username == payload["sub"]))).first()
+    if user is None or payload.get("ver", user.token_version) != user.token_version:
+        raise credentials_exception
+    if not user.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
+
+    current_user = CurrentUser(
+        id=user.id, username=user.username, email=user.email,
+        is_active=user.is_active, session_id=payload.get("sid"),
+    )
+    expires_in = payload.get("exp", 0) - time.time()
+    user_cache.set(token, (epoch, current_user), ttl=expires_in)
+    return current_user
+
+class Principal:
+    """
+    Identity taken straight from a verified access token.
+
+    Routes that only need the caller's id use this instead of
+    ``get_current_user`` and resolve without touching the database.
+    ``username`` is as of token issue; call ``load_user`` for anything else.
+    """
+
+    __slots__ = ("id", "username", "session_id", "token_version", "_user")
+
+    def __init__(self, id: int, username: str, session_id: Optional[int] = None, token_version: int = 0):
+        self.id = id
+        self.username = username
+        self.session_id = session_id
+        self.token_version = token_version
+        self._user: Optional[User] = None
+
+    async def load_user(self, db: AsyncSession) -> User:
+        """
+        Load (once) the full User row of this principal.
+
+        Raises:
+            HTTPException: 401 if the user no longer exists or is inactive
+        """
+        if self._user is None:
+            user = await db.get(User, self.id)
+            if user is None or not user.is_active:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Could not validate credentials",
+                    headers={"WWW-Authenticate": "Bearer"},
+                )
+            self._user = user
+        return self._user
+
+async def get_current_principal(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> Principal:
+    """
+    Resolve the bearer token to a Principal without a database query.
+
+    Revoked sessions and superseded token versions are rejected from
+    in-memory state. Tokens issued before user ids were embedded fall back
+    to ``get_current_user``.
+
+    Returns:
+        Principal: The caller's identity
+    """
+    payload = _decode_access_token(token)
+    if payload.get("uid") is None:
+        current_user = await get_current_user(token, db)
+        return Principal(current_user.id, current_user.username, current_user.session_id)
+    return Principal(payload["uid"], payload["sub"], payload.get("sid"), payload.get("ver", 0))
+
+def create_resume_token(principal: Principal, seq: Optional[int] = None) -> str:
+    """
+    Sign a short-lived token that lets a socket re-attach without a lookup.
+
+    Args:
+        principal (Principal): Identity the socket was authenticated as
+        seq (Optional[int]): Delivery sequence the client has applied
+
+    Returns:
+        str: Resume token
+    """
+    claims = {
+        "typ": "resume",
+        "sub": principal.username,
+        "uid": principal.id,
+        "ver": principal.token_version,
+        "sid": principal.session_id,
+        "seq": seq,
+    }
+    return create_access_token(claims, expires_delta=timedelta(seconds=RESUME_TOKEN_EXPIRE_SECONDS))
+
+async def authenticate_websocket(
+    websocket: WebSocket, user_id: Optional[int] = None
+) -> Optional[Tuple[Principal, Optional[int]]]:
+    """
+    Verify a WebSocket handshake once, before it is accepted.
+
+    The client passes ``?token=<access token>`` or, when reconnecting,
+    ``?resume=<resume token>``. Either must belong to ``user_id`` when one
+    is given (the socket's user is the token's otherwise). Resume
+    tokens are checked against in-memory revocation state only. On failure
+    the handshake is closed with WS_CLOSE_UNAUTHORIZED.
+
+    Returns:
+        Optional[Tuple[Principal, Optional[int]]]: The principal and, for a
+        resume token, the delivery sequence to resume after; None if the
+        handshake was rejected
+    """
+    token = websocket.query_params.get("token")
+    resume = websocket.query_params.get("resume")
+    try:
+        if resume:
+            payload = _decode_access_token(resume, typ="resume")
+            principal = Principal(payload["uid"], payload["sub"], payload.get("sid"), payload.get("ver", 0))
+            resume_seq = payload.get("seq")
+        elif token:
+            payload = _decode_access_token(token)
+            if payload.get("uid") is None:
+                # Tokens issued before ids were embedded need a lookup
+                async with AsyncSession(get_async_engine(), expire_on_commit=False) as db:
+                    current_user = await get_current_user(token, db)
+                principal = Principal(current_user.id, current_user.username, current_user.session_id)
+            else:
+                principal = Principal(payload["uid"], payload["sub"], payload.get("sid"), payload.get("ver", 0))
+            resume_seq = None
+        else:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    except HTTPException:
+        await websocket.close(code=WS_CLOSE_UNAUTHORIZED)
+        return None
+
+    if user_id is not None and principal.id != user_id:
+        await websocket.close(code=WS_CLOSE_UNAUTHORIZED)
+        return None
+    return principal, resume_seq
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(principal: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_async_db)):
+    """
+    Revoke the session of the presented access token.
+
+    Its access tokens stop working at once on this worker and within
+    REVOCATION_SYNC_SECONDS elsewhere; its refresh token stops working
+    everywhere immediately.
+    """
+    if principal.session_id is None:
+        return
+    await revoke_session(db, principal.session_id, principal.id)
+    revocations.add(principal.session_id, datetime.utcnow())
+
+@router.post("/logout-all", status_code=status.HTTP_204_NO_CONTENT)
+async def logout_everywhere(principal: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_async_db)):
+    """Invalidate every token of the current user on all devices."""
+    await revoke_user_tokens(db, principal.id)
+    await db.commit()
@@ -1,15 +1,41 @@
-from fastapi import APIRouter, WebSocket, Depends, HTTPException, status
+from fastapi import APIRouter, WebSocket, Depends, HTTPException, Query, Response, status
 from starlette.websockets import WebSocketDisconnect
-from typing import Dict, Optional
-from sqlmodel import Session, select
-from app.database import get_db
-from app.models import User
-from app.routers.auth import get_current_user
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import tuple_
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import get_async_db
+from app.delivery import publish_durable
+from app.models import Call, User
+from app.pagination import encode_cursor, decode_cursor
+from app.routers.auth import (
+    CurrentUser,
+    Principal,
+    authenticate_websocket,
+    create_resume_token,
+    get_current_principal,
+    get_current_user,
+)
+from app.realtime.admission import AdmissionController
+from app.realtime.call_history import CallHistoryWriter, call_history
+from app.realtime.calls import CALL_RING_TIMEOUT_SECONDS, CallRecord, CallRegistry
+from app.realtime.connection import Connection
+from app.realtime.hub import ConnectionHub, ConnectionRegistry, registry
+from app.realtime.pubsub import PubSubBackend, get_pubsub
+from app.realtime.rooms import CALL_ROOM_MAX_PARTICIPANTS, CallRoom, RoomFull, RoomNotFound, RoomRegistry
+from app.realtime.signal_batch import WEBRTC_ICE_BATCH_MS, IceCandidateBatcher
+from app.realtime.timers import TimerWheel, timers as shared_timers
 from pydantic import BaseModel
+from datetime import datetime
+import asyncio
 import json
+import secrets
 
 router = APIRouter(prefix="/call", tags=["call"])
 
+DEFAULT_HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+
 class CallRequest(BaseModel):
     recipient_id: int
     call_type: str  # "audio" or "video"
@@ -18,64 +44,187 @@ class CallResponse(BaseModel):
     call_id: str
     status: str
 
-class SignalingManager:
-    def __init__(self):
-        self.connections: Dict[int, WebSocket] = {}
-        self.active_calls: Dict[str, dict] = {}
-        self.call_counter = 0
+class RoomRequest(BaseModel):
+    call_type: str  # "audio" or "video"
+    invite: List[int] = []  # users allowed to join
 
-    async def connect(self, user_id: int, websocket: WebSocket):
-        await websocket.accept()
-        self.connections[user_id] = websocket
-        print(f"User {user_id} connected for calls")
+class RoomInvite(BaseModel):
+    user_ids: List[int]
 
-    def disconnect(self, user_id: int):
-        if user_id in self.connections:
-            del self.connections[user_id]
-            print(f"User {user_id} disconnected from calls")
+class SignalingManager(ConnectionHub):
+    """
+    Call signalling hub.
+
+    A call lives on the worker that created it, and its id ends in
+    "@<node_id>". Responses and hang-ups that arrive on another worker are
+    forwarded to that node over the backend's control channel instead of
+    being looked up locally. With ``durable`` set, call events are also
+    written to the recipient's delivery log so a user who was offline sees
+    them on reconnect. With a ``history`` writer, every lifecycle
+    transition is persisted to the Call table behind the signalling path.
+    Calls still ringing after ``ring_timeout`` seconds are finished as
+    missed by a timer on the shared timer wheel, cancelled as soon as the
+    call is answered, rejected or ended. WebRTC signals are relayed
+    through an IceCandidateBatcher, which coalesces trickle ICE candidates
+    when ``ice_batch_ms`` is set.
+
+    Multi-party calls use rooms, owned like calls by the worker that
+    created them ("room_..@<node_id>"). Joins, leaves and room signals are
+    handled on the owning worker and fanned out to the room's members
+    only, so their cost grows with the room, not with the number of
+    connected users. Room ids are random and only invited users may join.
+    Rooms hold at most ``max_room_participants`` users; users leave the
+    rooms they joined through a worker when their last device there
+    disconnects.
+    """
 
-        # Clean up any active calls for this user
-        calls_to_remove = []
-        for call_id, call_data in self.active_calls.items():
-            if user_id in [call_data.get("caller_id"), call_data.get("callee_id")]:
-                calls_to_remove.append(call_id)
+    channel = "call"
+    control_channel = "call_control"
+
+    def __init__(
+        self,
+        backend: Optional[PubSubBackend] = None,
+        durable: bool = False,
+        admission: Optional[AdmissionController] = None,
+        registry: Optional[ConnectionRegistry] = None,
+        history: Optional[CallHistoryWriter] = None,
+        timers: Optional[TimerWheel] = None,
+        ring_timeout: float = CALL_RING_TIMEOUT_SECONDS,
+        ice_batch_ms: float = WEBRTC_ICE_BATCH_MS,
+        max_room_participants: int = CALL_ROOM_MAX_PARTICIPANTS,
+    ):
+        self.calls = CallRegistry()
+        self.history = history
+        self.timers = timers if timers is not None else shared_timers
+        self.ring_timeout = ring_timeout
+        self.signals = IceCandidateBatcher(self.send, ice_batch_ms)
+        self.call_counter = 0
+        self.rooms = RoomRegistry(max_room_participants)
+        # Rooms owned by other workers that local users joined through this one
+        self.remote_rooms: Dict[int, Set[str]] = {}
+        self.durable = durable
+        super().__init__(backend, admission, registry)
+
+    def attach_backend(self, backend: PubSubBackend):
+        super().attach_backend(backend)
+        backend.subscribe(self.control_channel, self._handle_control)
+
+    def owner_of(self, call_id: str) -> Optional[str]:
+        """Node that holds the call's state, or None for this worker."""
+        _, separator, node_id = call_id.rpartition("@")
+        if not separator or not self.backend or node_id == self.backend.node_id:
+            return None
+        return node_id
+
+    async def connect(self, user_id: int, websocket: WebSocket, principal: Optional[Principal] = None) -> Connection:
+        connection = await super().connect(user_id, websocket, principal)
+        print(f"User {user_id} connected for calls")
+        return connection
+
+    async def on_user_offline(self, user_id: int):
+        print(f"User {user_id} disconnected from calls")
 
-        for call_id in calls_to_remove:
-            self.end_call(call_id, user_id)
+        # End the user's unfinished calls once no device is left
+        for call in self.calls.for_user(user_id):
+            if not call.finished:
+                self.end_call(call.call_id, user_id)
+        for room in self.rooms.rooms_of(user_id):
+            await self.leave_room(room.room_id, user_id)
+        for room_id in list(self.remote_rooms.get(user_id, ())):
+            await self.leave(room_id, user_id)
 
     def create_call(self, caller_id: int, callee_id: int, call_type: str) -> str:
         """Create a new call session"""
         self.call_counter += 1
         call_id = f"call_{self.call_counter}_{caller_id}_{callee_id}"
+        if self.backend:
+            call_id += f"@{self.backend.node_id}"
 
-        self.active_calls[call_id] = {
-            "caller_id": caller_id,
-            "callee_id": callee_id,
-            "call_type": call_type,
-            "status": "ringing",
-            "start_time": None,
-            "end_time": None
-        }
-
+        call = CallRecord(call_id, caller_id, callee_id, call_type)
+        self.calls.add(call)
+        call.ring_timer = self.timers.schedule(self.ring_timeout, self._ring_timeout, call_id)
+        self._record(call)
         return call_id
 
     def end_call(self, call_id: str, user_id: int):
         """End a call session"""
-        if call_id in self.active_calls:
-            call_data = self.active_calls[call_id]
-            if user_id in [call_data.get("caller_id"), call_data.get("callee_id")]:
-                call_data["status"] = "ended"
-                call_data["end_time"] = "now"  # TODO: Use proper timestamp
-                print(f"Call {call_id} ended by user {user_id}")
+        call = self.calls.get(call_id)
+        if call is not None and call.involves(user_id) and not call.finished:
+            self._stop_ringing(call)
+            self.calls.finish(call, "ended")
+            self._record(call)
+            print(f"Call {call_id} ended by user {user_id}")
+
+    def _record(self, call: CallRecord):
+        if self.history is not None:
+            self.history.record(call)
+
+    def _stop_ringing(self, call: CallRecord):
+        if call.ring_timer is not None:
+            self.timers.cancel(call.ring_timer)
+            call.ring_timer = None
+
+    async def _ring_timeout(self, call_id: str):
+        """Give up on a call nobody answered and tell both parties."""
+        call = self.calls.get(call_id)
+        if call is None or call.status != "ringing":
+            return
+        call.ring_timer = None
+        self.calls.finish(call, "missed")
+        self._record(call)
+        print(f"Call {call_id} missed")
+        missed_message = {
+            "type": "call_missed",
+            "call_id": call_id,
+            "caller_id": call.caller_id,
+            "callee_id": call.callee_id,
+            "call_type": call.call_type,
+        }
+        for user_id in (call.caller_id, call.callee_id):
+            await self.send_message(user_id, missed_message)
+
+    def reconnect_frame(self, connection: Connection, retry_after_ms: int) -> dict:
+        frame = super().reconnect_frame(connection, retry_after_ms)
+        if connection.principal is not None:
+            frame["resume_token"] = create_resume_token(connection.principal)
+        return frame
+
+    async def suspend_calls(self):
+        """
+        Record this worker's unfinished calls and notify their participants
+        before it shuts down.
+
+        Call state only lives on the owning worker and does not survive a
+        restart. Ringing calls are finished as missed and active ones as
+        ended, and the history writer is flushed; both participants get
+        call_ended with reason "server_restart", through the delivery log
+        when durable.
+        """
+        unfinished = [call for call in self.calls if not call.finished]
+        now = datetime.utcnow()
+        for call in unfinished:
+            self._stop_ringing(call)
+            self.calls.finish(call, "missed" if call.status == "ringing" else "ended", now)
+            self._record(call)
+        if self.history is not None:
+            await self.history.flush()
+
+        for call in unfinished:
+            end_message = {"type": "call_ended", "call_id": call.call_id, "reason": "server_restart"}
+            for user_id in (call.caller_id, call.callee_id):
+                await self.send_message(user_id, end_message)
+
+        rooms = list(self.rooms)
+        self.rooms.clear()
+        for room in rooms:
+            await self._fan_out(room, {"type": "room_closed", "room_id": room.room_id, "reason": "server_restart"})
 
     async def send_message(self, user_id: int, message: dict):
-        """Send a message to a specific user"""
-        if user_id in self.connections:
-            try:
-                await self.connections[user_id].send_json(message)
-            except Exception as e:
-                print(f"Error sending call message to user {user_id}: {e}")
-                self.disconnect(user_id)
+        """Send a message to a specific user on any worker"""
+        if self.durable:
+            await publish_durable(self, [(user_id, message)])
+        else:
+            await self.send(user_id, message)
 
     async def initiate_call(self, caller_id: int, callee_id: int, call_type: str) -> str:
         """Initiate a call between two users"""
@@ -94,27 +243,36 @@ class SignalingManager:
 
     async def handle_call_response(self, call_id: str, user_id: int, response: str):
         """Handle call response (accept/reject)"""
-        if call_id not in self.active_calls:
+        # Only the callee answers, and only while the call rings
+        call = self.calls.get(call_id)
+        if (
+            call is None
+            or call.status != "ringing"
+            or call.callee_id != user_id
+            or response not in ("accept", "reject")
+        ):
             return
 
-        call_data = self.active_calls[call_id]
-        other_user_id = call_data["caller_id"] if user_id == call_data["callee_id"] else call_data["callee_id"]
+        other_user_id = call.caller_id
+
+        self._stop_ringing(call)
 
         if response == "accept":
-            call_data["status"] = "active"
-            call_data["start_time"] = "now"  # TODO: Use proper timestamp
+            call.status = "active"
+            call.answered_at = datetime.utcnow()
+            self._record(call)
 
             # Notify both users that call is connected
             accept_message = {
                 "type": "call_accepted",
                 "call_id": call_id,
-                "call_type": call_data["call_type"]
+                "call_type": call.call_type
             }
             await self.send_message(other_user_id, accept_message)
 
         elif response == "reject":
-            call_data["status"] = "rejected"
-            call_data["end_time"] = "now"
+            self.calls.finish(call, "rejected")
+            self._record(call)
 
             # Notify caller that call was rejected
             reject_message = {
@@ -123,27 +281,236 @@ class SignalingManager:
             }
             await self.send_message(other_user_id, reject_message)
 
-manager = SignalingManager()
+    async def hang_up(self, call_id: str, user_id: int):
+        """End a call and notify the other participant"""
+        self.end_call(call_id, user_id)
+
+        call = self.calls.get(call_id)
+        if call is not None:
+            other_user_id = call.other_party(user_id)
+
+            end_message = {
+                "type": "call_ended",
+                "call_id": call_id,
+                "ended_by": user_id
+            }
+            await self.send_message(other_user_id, end_message)
+
+    async def respond(self, call_id: str, user_id: int, response: str):
+        """Accept or reject a call, on whichever worker owns it"""
+        owner = self.owner_of(call_id)
+        if owner:
+            await self.backend.publish(owner, self.control_channel, user_id, {
+                "action": "respond", "call_id": call_id, "response": response
+            })
+        else:
+            await self.handle_call_response(call_id, user_id, response)
+
+    async def end(self, call_id: str, user_id: int):
+        """Hang up a call, on whichever worker owns it"""
+        owner = self.owner_of(call_id)
+        if owner:
+            await self.backend.publish(owner, self.control_channel, user_id, {
+                "action": "end", "call_id": call_id
+            })
+        else:
+            await self.hang_up(call_id, user_id)
+
+    async def create_room(self, user_id: int, call_type: str, invite: Iterable[int] = ()) -> CallRoom:
+        """Open a call room on this worker with user_id as its first member and invite users"""
+        # Unguessable, so room ids cannot be enumerated
+        room_id = f"room_{secrets.token_urlsafe(16)}"
+        if self.backend:
+            room_id += f"@{self.backend.node_id}"
+        room = self.rooms.create(room_id, user_id, call_type, invite)
+        await self._send_invitations(room, user_id, [invitee for invitee in room.invited if invitee != user_id])
+        return room
+
+    async def _send_invitations(self, room: CallRoom, user_id: int, invitees: List[int]):
+        await asyncio.gather(*(
+            self.send(invitee, {
+                "type": "room_invitation",
+                "room_id": room.room_id,
+                "invited_by": user_id,
+                "call_type": room.call_type,
+            })
+            for invitee in invitees
+        ))
+
+    async def invite_room(self, room_id: str, user_id: int, invitees: Iterable[int]):
+        """
+        Let a member of a room owned by this worker invite more users.
+
+        Raises:
+            RoomNotFound: No such room, or user_id is not a member
+        """
+        room = self.rooms.get(room_id)
+        added = self.rooms.invite(room_id, user_id, invitees)
+        await self._send_invitations(room, user_id, added)
+
+    async def _fan_out(self, room: CallRoom, message: dict, exclude: Optional[int] = None):
+        """Send a live frame to every member of room but exclude"""
+        await asyncio.gather(*(
+            self.send(member_id, message) for member_id in room.members if member_id != exclude
+        ))
+
+    async def join_room(self, room_id: str, user_id: int) -> CallRoom:
+        """
+        Add user_id to a room owned by this worker and tell every member,
+        the new one included, who is in the room.
+
+        Members not connected to any worker are dropped before a join is
+        refused for the participant cap, so slots of users whose worker
+        went away are not held forever.
+
+        Raises:
+            RoomNotFound: No such room, or user_id was not invited
+            RoomFull: The room is at its participant cap
+        """
+        try:
+            room = self.rooms.join(room_id, user_id)
+        except RoomFull:
+            room = self.rooms.get(room_id)
+            for member_id in room.participants:
+                if not await self.is_online(member_id):
+                    await self.leave_room(room_id, member_id)
+            room = self.rooms.join(room_id, user_id)
+        await self._fan_out(room, {
+            "type": "room_joined",
+            "room_id": room_id,
+            "user_id": user_id,
+            "call_type": room.call_type,
+            "participants": room.participants,
+        })
+        return room
+
+    async def leave_room(self, room_id: str, user_id: int):
+        """Remove user_id from a room owned by this worker and tell the others"""
+        room = self.rooms.leave(room_id, user_id)
+        if room is not None and len(room):
+            await self._fan_out(room, {
+                "type": "room_left",
+                "room_id": room_id,
+                "user_id": user_id,
+                "participants": room.participants,
+            })
+
+    async def room_signal(self, room_id: str, sender_id: int, signal: dict, recipient_id: Optional[int] = None):
+        """Relay a WebRTC signal from a member to one other member, or to all of them"""
+        room = self.rooms.get(room_id)
+        if room is None or sender_id not in room:
+            return
+        message = {"type": "room_signal", "room_id": room_id, "sender_id": sender_id, "data": signal}
+        if recipient_id is None:
+            await self._fan_out(room, message, exclude=sender_id)
+        elif recipient_id in room and recipient_id != sender_id:
+            await self.send(recipient_id, message)
+
+    async def join(self, room_id: str, user_id: int):
+        """
+        Join a room, on whichever worker owns it.
+
+        On another worker the outcome reaches the user as a room_joined or
+        room_error frame, and the room is remembered so the user leaves it
+        when their last device here disconnects; here RoomNotFound /
+        RoomFull are raised as well.
+        """
+        owner = self.owner_of(room_id)
+        if owner:
+            self.remote_rooms.setdefault(user_id, set()).add(room_id)
+            await self.backend.publish(owner, self.control_channel, user_id, {
+                "action": "room_join", "room_id": room_id
+            })
+        else:
+            await self.join_room(room_id, user_id)
+
+    async def leave(self, room_id: str, user_id: int):
+        """Leave a room, on whichever worker owns it"""
+        owner = self.owner_of(room_id)
+        if owner:
+            room_ids = self.remote_rooms.get(user_id)
+            if room_ids is not None:
+                room_ids.discard(room_id)
+                if not room_ids:
+                    del self.remote_rooms[user_id]
+            await self.backend.publish(owner, self.control_channel, user_id, {
+                "action": "room_leave", "room_id": room_id
+            })
+        else:
+            await self.leave_room(room_id, user_id)
+
+    async def invite(self, room_id: str, user_id: int, invitees: List[int]):
+        """
+        Invite users to a room, on whichever worker owns it.
+
+        On another worker a refusal reaches the user as a room_error frame;
+        here RoomNotFound is raised as well.
+        """
+        owner = self.owner_of(room_id)
+        if owner:
+            await self.backend.publish(owner, self.control_channel, user_id, {
+                "action": "room_invite", "room_id": room_id, "user_ids": invitees
+            })
+        else:
+            await self.invite_room(room_id, user_id, invitees)
+
+    async def signal_room(self, room_id: str, user_id: int, signal: dict, recipient_id: Optional[int] = None):
+        """Relay a room signal, on whichever worker owns the room"""
+        owner = self.owner_of(room_id)
+        if owner:
+            await self.backend.publish(owner, self.control_channel, user_id, {
+                "action": "room_signal", "room_id": room_id, "data": signal, "recipient_id": recipient_id
+            })
+        else:
+            await self.room_signal(room_id, user_id, signal, recipient_id)
+
+    async def _handle_control(self, user_id: int, message: dict, coalesce_key=None):
+        action = message.get("action")
+        if action == "respond":
+            await self.handle_call_response(message["call_id"], user_id, message["response"])
+        elif action == "end":
+            await self.hang_up(message["call_id"], user_id)
+        elif action == "room_join":
+            try:
+                await self.join_room(message["room_id"], user_id)
+            except (RoomNotFound, RoomFull) as e:
+                await self.send(user_id, room_error(message["room_id"], e))
+        elif action == "room_leave":
+            await self.leave_room(message["room_id"], user_id)
+        elif action == "room_invite":
+            try:
+                await self.invite_room(message["room_id"], user_id, message["user_ids"])
+            except RoomNotFound as e:
+                await self.send(user_id, room_error(message["room_id"], e))
+        elif action == "room_signal":
+            await self.room_signal(message["room_id"], user_id, message["data"], message.get("recipient_id"))
+
+def room_error(room_id: str, error: Exception) -> dict:
+    """Frame telling a user why they could not join a room."""
+    reason = "full" if isinstance(error, RoomFull) else "not_found"
+    return {"type": "room_error", "room_id": room_id, "reason": reason}
+
+manager = SignalingManager(get_pubsub(), durable=True, registry=registry, history=call_history)
 
 @router.post("/initiate", response_model=CallResponse)
 async def initiate_call(
     call_request: CallRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Initiate a call with another user.
 
     Args:
         call_request (CallRequest): Call details
-        current_user (User): Current authenticated user
-        db (Session): Database session
+        current_user (CurrentUser): Current authenticated user
+        db (AsyncSession): Database session
 
     Returns:
         CallResponse: Call session details
     """
     # Validate recipient exists
-    recipient = db.exec(select(User).where(User.id == call_request.recipient_id)).first()
+    recipient = (await db.exec(select(User).where(User.id == call_request.recipient_id))).first()
     if not recipient:
         raise HTTPException(status_code=404, detail="Recipient not found")
 
@@ -155,7 +522,7 @@ async def initiate_call(
         raise HTTPException(status_code=400, detail="Invalid call type")
 
     # Check if recipient is online
-    if call_request.recipient_id not in manager.connections:
+    if not await manager.is_online(call_request.recipient_id):
         raise HTTPException(status_code=400, detail="Recipient is not online")
 
     # Initiate the call
@@ -171,7 +538,7 @@ async def initiate_call(
 async def respond_to_call(
     call_id: str,
     response: str,  # "accept" or "reject"
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Respond to an incoming call.
@@ -179,7 +546,7 @@ async def respond_to_call(
     Args:
         call_id (str): ID of the call to respond to
         response (str): Response type ("accept" or "reject")
-        current_user (User): Current authenticated user
+        current_user (Principal): Current authenticated user
 
     Returns:
         dict: Response confirmation
@@ -187,102 +554,286 @@ async def respond_to_call(
     if response not in ["accept", "reject"]:
         raise HTTPException(status_code=400, detail="Invalid response")
 
-    await manager.handle_call_response(call_id, current_user.id, response)
+    await manager.respond(call_id, current_user.id, response)
 
     return {"message": f"Call {response}ed", "call_id": call_id}
 
 @router.post("/end/{call_id}")
 async def end_call(
     call_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     End an active call.
 
     Args:
         call_id (str): ID of the call to end
-        current_user (User): Current authenticated user
+        current_user (Principal): Current authenticated user
 
     Returns:
         dict: Call end confirmation
     """
-    manager.end_call(call_id, current_user.id)
-
-    # Notify other participant
-    if call_id in manager.active_calls:
-        call_data = manager.active_calls[call_id]
-        other_user_id = call_data["caller_id"] if current_user.id == call_data["callee_id"] else call_data["callee_id"]
-
-        end_message = {
-            "type": "call_ended",
-            "call_id": call_id,
-            "ended_by": current_user.id
-        }
-        await manager.send_message(other_user_id, end_message)
+    await manager.end(call_id, current_user.id)
 
     return {"message": "Call ended", "call_id": call_id}
 
 @router.get("/active")
-async def get_active_calls(current_user: User = Depends(get_current_user)):
+async def get_active_calls(current_user: Principal = Depends(get_current_principal)):
     """
     Get active calls for the current user.
 
     Args:
-        current_user (User): Current authenticated user
+        current_user (Principal): Current authenticated user
 
     Returns:
         List[dict]: List of active calls
     """
-    user_calls = []
-    for call_id, call_data in manager.active_calls.items():
-        if current_user.id in [call_data.get("caller_id"), call_data.get("callee_id")]:
-            user_calls.append({
-                "call_id": call_id,
-                "caller_id": call_data["caller_id"],
-                "callee_id": call_data["callee_id"],
-                "call_type": call_data["call_type"],
-                "status": call_data["status"]
-            })
+    return [call.to_dict() for call in manager.calls.for_user(current_user.id)]
+
+@router.post("/rooms")
+async def create_room(
+    room_request: RoomRequest,
+    current_user: Principal = Depends(get_current_principal)
+):
+    """
+    Open a multi-party call room with the current user as its first member.
+
+    Only invited users can join; each of them gets a room_invitation frame.
+
+    Args:
+        room_request (RoomRequest): Room details
+        current_user (Principal): Current authenticated user
+
+    Returns:
+        dict: Room id, call type and participants
+    """
+    if room_request.call_type not in ["audio", "video"]:
+        raise HTTPException(status_code=400, detail="Invalid call type")
+    if len(room_request.invite) >= manager.rooms.max_participants:
+        raise HTTPException(status_code=400, detail="Too many invitees")
+
+    room = await manager.create_room(current_user.id, room_request.call_type, room_request.invite)
+    return room.to_dict()
+
+@router.post("/rooms/{room_id}/invite")
+async def invite_to_room(
+    room_id: str,
+    room_invite: RoomInvite,
+    current_user: Principal = Depends(get_current_principal)
+):
+    """
+    Invite more users to a call room the current user is a member of.
+
+    Args:
+        room_id (str): ID of the room
+        room_invite (RoomInvite): Users to invite
+        current_user (Principal): Current authenticated user
+
+    Returns:
+        dict: Invitation confirmation
+    """
+    if len(room_invite.user_ids) > manager.rooms.max_participants:
+        raise HTTPException(status_code=400, detail="Too many invitees")
+
+    try:
+        await manager.invite(room_id, current_user.id, room_invite.user_ids)
+    except RoomNotFound:
+        raise HTTPException(status_code=404, detail="Room not found")
 
-    return user_calls
+    return {"message": "Users invited", "room_id": room_id}
+
+@router.post("/rooms/{room_id}/join")
+async def join_room(
+    room_id: str,
+    current_user: Principal = Depends(get_current_principal)
+):
+    """
+    Join a call room.
+
+    Only invited users can join. Every member, the new one included, gets
+    a room_joined frame listing the participants. When the room lives on another worker the join is
+    forwarded there and a failure arrives as a room_error frame instead.
+
+    Args:
+        room_id (str): ID of the room to join
+        current_user (Principal): Current authenticated user
+
+    Returns:
+        dict: Join confirmation
+    """
+    try:
+        await manager.join(room_id, current_user.id)
+    except RoomNotFound:
+        raise HTTPException(status_code=404, detail="Room not found")
+    except RoomFull:
+        raise HTTPException(status_code=409, detail="Room is full")
+
+    return {"message": "Joined room", "room_id": room_id}
+
+@router.post("/rooms/{room_id}/leave")
+async def leave_room(
+    room_id: str,
+    current_user: Principal = Depends(get_current_principal)
+):
+    """
+    Leave a call room.
+
+    Args:
+        room_id (str): ID of the room to leave
+        current_user (Principal): Current authenticated user
+
+    Returns:
+        dict: Leave confirmation
+    """
+    await manager.leave(room_id, current_user.id)
+
+    return {"message": "Left room", "room_id": room_id}
+
+async def _history_page(
+    db: AsyncSession,
+    column,
+    user_id: int,
+    anchor: Optional[Tuple[datetime, int]],
+    limit: int,
+) -> List[Call]:
+    """Read one side (placed or received) of a user's calls, newest first, as one index range scan."""
+    query = select(Call).where(column == user_id)
+    if anchor:
+        query = query.where(tuple_(Call.start_time, Call.id) < tuple_(*anchor))
+    query = query.order_by(Call.start_time.desc(), Call.id.desc())
+    return list((await db.exec(query.limit(limit))).all())
+
+@router.get("/history", response_model=List[Call])
+async def get_call_history(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get a page of the current user's call history, newest first.
+
+    Calls placed and received are keyset-paginated on (start_time, id),
+    start_time being when the call was placed. Pass the ``X-Next-Cursor``
+    header of a page as ``cursor`` to get the next, older page; the header
+    is only set when more calls exist. Calls reach the history through the
+    write-behind writer, so the last few hundred milliseconds may be missing.
+
+    Args:
+        cursor (Optional[str]): Opaque cursor from a previous page
+        limit (int): Maximum number of calls to return
+        current_user (Principal): Current authenticated user
+        db (AsyncSession): Database session
+
+    Returns:
+        List[Call]: Calls, newest first
+    """
+    anchor = None
+    if cursor:
+        start_time, call_id = decode_cursor(cursor, 2)
+        if not isinstance(start_time, datetime) or not isinstance(call_id, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        anchor = (start_time, call_id)
+
+    # Each side is read separately so both use their (user, start_time) index;
+    # one extra row per side tells us whether another page exists.
+    placed = await _history_page(db, Call.caller_id, current_user.id, anchor, limit + 1)
+    received = await _history_page(db, Call.callee_id, current_user.id, anchor, limit + 1)
+    calls = sorted(
+        {call.id: call for call in placed + received}.values(),
+        key=lambda call: (call.start_time, call.id),
+        reverse=True,
+    )
+
+    if len(calls) > limit:
+        calls = calls[:limit]
+        edge = calls[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(edge.start_time, edge.id)
+
+    return calls
+
+async def handle_call_frame(connection: Connection, data: dict):
+    """
+    Act on one client frame of the call channel, from the signalling
+    socket or the /rt gateway.
+
+    Args:
+        connection (Connection): Connection the frame arrived on
+        data (dict): Decoded frame
+    """
+    user_id = connection.user_id
+    message_type = data.get("type")
+
+    if message_type == "ping":
+        # Keep connection alive
+        connection.send({"type": "pong"}, channel=manager.channel)
+    elif message_type == "webrtc_signal":
+        # Forward WebRTC signaling to recipient; only useful live,
+        # so it bypasses the delivery log
+        recipient_id = data.get("recipient_id")
+        if recipient_id:
+            await manager.signals.relay(user_id, recipient_id, data.get("call_id"), data.get("data", {}))
+    elif message_type == "room_join":
+        room_id = data.get("room_id")
+        if room_id:
+            try:
+                await manager.join(room_id, user_id)
+            except (RoomNotFound, RoomFull) as e:
+                connection.send(room_error(room_id, e), channel=manager.channel)
+    elif message_type == "room_invite":
+        room_id = data.get("room_id")
+        user_ids = data.get("user_ids")
+        if room_id and isinstance(user_ids, list):
+            try:
+                await manager.invite(room_id, user_id, user_ids[:manager.rooms.max_participants])
+            except RoomNotFound as e:
+                connection.send(room_error(room_id, e), channel=manager.channel)
+    elif message_type == "room_leave":
+        room_id = data.get("room_id")
+        if room_id:
+            await manager.leave(room_id, user_id)
+    elif message_type == "room_signal":
+        # Mesh signalling inside a room: to recipient_id, or every other member
+        room_id = data.get("room_id")
+        if room_id:
+            await manager.signal_room(room_id, user_id, data.get("data", {}), data.get("recipient_id"))
+    elif message_type == "call_response":
+        # Handle call response
+        call_id = data.get("call_id")
+        response = data.get("response")
+        if call_id and response:
+            await manager.respond(call_id, user_id, response)
 
 @router.websocket("/signal/{user_id}")
 async def signaling(websocket: WebSocket, user_id: int):
     """
     WebSocket endpoint for WebRTC signaling.
 
+    Carries the call channel only; ``/rt`` carries every channel on one
+    socket. The handshake must carry ``?token=`` (access token) or
+    ``?resume=`` (resume token issued by the chat socket).
+
     Args:
         websocket (WebSocket): WebSocket connection
         user_id (int): ID of the connecting user
     """
-    await manager.connect(user_id, websocket)
+    if not await manager.admit(websocket):
+        return
+    auth = await authenticate_websocket(websocket, user_id)
+    if auth is None:
+        return
+    connection = await manager.connect(user_id, websocket, auth[0])
 
     try:
         while True:
             data = await websocket.receive_json()
-            message_type = data.get("type")
-
-            if message_type == "ping":
-                # Keep connection alive
-                await websocket.send_json({"type": "pong"})
-            elif message_type == "webrtc_signal":
-                # Forward WebRTC signaling to recipient
-                recipient_id = data.get("recipient_id")
-                if recipient_id and recipient_id in manager.connections:
-                    await manager.send_message(recipient_id, {
-                        "type": "webrtc_signal",
-                        "sender_id": user_id,
-                        "data": data.get("data", {})
-                    })
-            elif message_type == "call_response":
-                # Handle call response
-                call_id = data.get("call_id")
-                response = data.get("response")
-                if call_id and response:
-                    await manager.handle_call_response(call_id, user_id, response)
+            connection.touch()
+            await handle_call_frame(connection, data)
 
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        pass
     except Exception as e:
         print(f"Error in call signaling for user {user_id}: {e}")
-        manager.disconnect(user_id)
+    finally:
+        await manager.disconnect(connection)
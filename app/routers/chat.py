@@ -1,68 +1,148 @@
-from fastapi import APIRouter, WebSocket, Depends, HTTPException, status
-from typing import List, Dict
+from fastapi import APIRouter, WebSocket, Depends, HTTPException, Query, Response, status
+from typing import List, Dict, Optional, Set, Tuple
 from starlette.websockets import WebSocketDisconnect
-from sqlmodel import Session, select
-from app.database import get_db
-from app.models import User, Message
-from app.routers.auth import get_current_user
+from sqlalchemy import tuple_
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import get_async_db, get_async_engine
+from app.models import User, Message, ConversationSummary
+from app.conversations import record_messages, mark_delivered, mark_read
+from app.delivery import REPLAY_BATCH_SIZE, append_events, fetch_events, new_message_event, replay_floor
+from app.routers.payment import manager as payment_manager
+from app.routers.auth import (
+    CurrentUser,
+    Principal,
+    authenticate_websocket,
+    create_resume_token,
+    get_current_user,
+)
+from app.pagination import encode_cursor, decode_cursor
+from app.search import search_messages
+from app.realtime.connection import Connection
+from app.realtime.batch_writer import RecipientNotFound, message_writer
+from app.realtime.hub import ConnectionHub, registry
+from app.realtime.presence import presence
+from app.realtime.pubsub import get_pubsub
+from app.realtime.typing import TypingTracker
 from pydantic import BaseModel
 from datetime import datetime
+import asyncio
 import json
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+MAX_MESSAGE_LENGTH = 1000
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+RECEIPT_KINDS = ("read", "delivered")
+DEFAULT_SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_QUERY_LENGTH = 200
+
 class MessageCreate(BaseModel):
     content: str
     receiver_id: int
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
-
-    async def connect(self, user_id: int, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
+class ConnectionManager(ConnectionHub):
+    channel = "chat"
 
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+    @property
+    def active_connections(self) -> Dict[int, Dict[int, Connection]]:
+        return self.connections
 
     async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_json(message)
-            except Exception as e:
-                print(f"Error sending message to user {user_id}: {e}")
-                # Remove broken connection
-                self.disconnect(user_id)
+        await self.send(user_id, message)
 
     async def broadcast_to_user(self, message: dict, user_ids: List[int]):
         """Send message to specific users"""
         for user_id in user_ids:
-            if user_id in self.active_connections:
-                await self.send_personal_message(message, user_id)
+            await self.send_personal_message(message, user_id)
+
+    async def on_user_offline(self, user_id: int):
+        await typing_tracker.clear_sender(user_id)
+
+    def reconnect_frame(self, connection: Connection, retry_after_ms: int) -> dict:
+        # Everything up to last_seq was flushed before this frame, so the
+        # client can resume from there on whichever worker it lands
+        frame = super().reconnect_frame(connection, retry_after_ms)
+        if connection.principal is not None:
+            frame["seq"] = connection.last_seq
+            frame["resume_token"] = create_resume_token(connection.principal, connection.last_seq)
+        return frame
+
+manager = ConnectionManager(get_pubsub(), registry=registry)
+
+async def _send_typing(sender_id: int, recipient_id: int, is_typing: bool):
+    await manager.send(recipient_id, {
+        "type": "typing",
+        "user_id": sender_id,
+        "is_typing": is_typing,
+    }, coalesce_key=("typing", sender_id))
+
+typing_tracker = TypingTracker(_send_typing)
+
+async def _push_presence(frames: List[dict]):
+    """Send presence changes to the online users who have a conversation with the subject."""
+    subjects = [frame["user_id"] for frame in frames]
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as db:
+        rows = (await db.exec(
+            select(ConversationSummary.user_id, ConversationSummary.partner_id)
+            .where(ConversationSummary.partner_id.in_(subjects))
+        )).all()
+    online = await presence.online(sorted({viewer for viewer, _ in rows}))
+    by_subject = {frame["user_id"]: frame for frame in frames}
+    for viewer, subject in rows:
+        if viewer in online:
+            await manager.send(viewer, by_subject[subject], coalesce_key=("presence", subject))
+
+presence.subscribe(_push_presence)
+
+def _reply(connection: Connection, frame: dict):
+    """Answer the client on the chat channel."""
+    connection.send(frame, channel=manager.channel)
 
-manager = ConnectionManager()
+async def _send_from_socket(connection: Connection, principal: Principal, frame: dict):
+    """Store a message sent over the WebSocket through the batch writer and ack it."""
+    client_id = frame.get("client_id")
+    receiver_id = frame.get("receiver_id")
+    content = frame.get("content")
+    if not isinstance(receiver_id, int) or not isinstance(content, str) or not content:
+        _reply(connection, {"type": "send_error", "client_id": client_id, "detail": "receiver_id and content are required"})
+        return
+    if len(content) > MAX_MESSAGE_LENGTH:
+        _reply(connection, {"type": "send_error", "client_id": client_id, "detail": "Message too long"})
+        return
+
+    try:
+        _, event = await message_writer.submit(connection.user_id, receiver_id, content, principal.username)
+    except RecipientNotFound:
+        _reply(connection, {"type": "send_error", "client_id": client_id, "detail": "Recipient not found"})
+        return
+    except Exception:
+        _reply(connection, {"type": "send_error", "client_id": client_id, "detail": "Message could not be stored"})
+        return
+
+    _reply(connection, {"type": "send_ack", "client_id": client_id, "message": event["message"]})
+    await manager.send_personal_message(event, receiver_id)
 
 @router.post("/send", response_model=Message)
 async def send_message(
     message: MessageCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Send a message to another user.
 
     Args:
         message (MessageCreate): Message content and recipient
-        current_user (User): Current authenticated user
-        db (Session): Database session
+        current_user (CurrentUser): Current authenticated user
+        db (AsyncSession): Database session
 
     Returns:
         Message: Created message
     """
     # Validate recipient exists
-    recipient = db.exec(select(User).where(User.id == message.receiver_id)).first()
+    recipient = (await db.exec(select(User).where(User.id == message.receiver_id))).first()
     if not recipient:
         raise HTTPException(status_code=404, detail="Recipient not found")
 
@@ -74,123 +154,418 @@ async def send_message(
         timestamp=datetime.utcnow()
     )
     db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-
-    # Send real-time message if recipient is online
-    real_time_message = {
-        "type": "new_message",
-        "message": {
-            "id": db_message.id,
-            "content": db_message.content,
-            "sender_id": db_message.sender_id,
-            "receiver_id": db_message.receiver_id,
-            "timestamp": db_message.timestamp.isoformat(),
-            "sender_username": current_user.username
-        }
-    }
+    await db.flush()
+    await record_messages(db, [db_message])
+    stamped = await append_events(
+        db, [(message.receiver_id, new_message_event(db_message, current_user.username))]
+    )
+    await db.commit()
 
-    await manager.send_personal_message(real_time_message, message.receiver_id)
+    # Send real-time message if recipient is online; offline recipients replay it
+    for user_id, event in stamped:
+        await manager.send_personal_message(event, user_id)
 
     return db_message
 
+async def _conversation_page(
+    db: AsyncSession,
+    sender_id: int,
+    receiver_id: int,
+    anchor: Optional[Tuple[datetime, int]],
+    newer: bool,
+    limit: int,
+) -> List[Message]:
+    """Read one direction of a conversation as a single index range scan."""
+    key = tuple_(Message.timestamp, Message.id)
+    query = select(Message).where(
+        (Message.sender_id == sender_id) & (Message.receiver_id == receiver_id)
+    )
+    if newer:
+        if anchor:
+            query = query.where(key > tuple_(*anchor))
+        query = query.order_by(Message.timestamp, Message.id)
+    else:
+        if anchor:
+            query = query.where(key < tuple_(*anchor))
+        query = query.order_by(Message.timestamp.desc(), Message.id.desc())
+    return list((await db.exec(query.limit(limit))).all())
+
 @router.get("/messages/{user_id}", response_model=List[Message])
 async def get_messages(
     user_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Get conversation messages between current user and another user.
+    Get a page of conversation messages between current user and another user.
+
+    Pages are keyset-paginated on (timestamp, id). Without a position the
+    newest page is returned. ``before_id``/``after_id`` anchor on a message
+    of this conversation; ``cursor`` continues from a previous response's
+    ``X-Next-Cursor`` header, which is only set when more messages exist.
 
     Args:
         user_id (int): ID of the other user
-        current_user (User): Current authenticated user
-        db (Session): Database session
+        before_id (int): Return messages older than this message
+        after_id (int): Return messages newer than this message
+        cursor (str): Opaque cursor from a previous page
+        limit (int): Maximum number of messages to return
+        current_user (CurrentUser): Current authenticated user
+        db (AsyncSession): Database session
 
     Returns:
-        List[Message]: List of messages
+        List[Message]: Messages in chronological order
     """
-    # Get messages between the two users (both directions)
-    messages = db.exec(
-        select(Message).where(
-            ((Message.sender_id == current_user.id) & (Message.receiver_id == user_id)) |
-            ((Message.sender_id == user_id) & (Message.receiver_id == current_user.id))
-        ).order_by(Message.timestamp)
-    ).all()
+    if sum(value is not None for value in (before_id, after_id, cursor)) > 1:
+        raise HTTPException(status_code=400, detail="Use only one of before_id, after_id or cursor")
+
+    anchor = None
+    newer = False
+    if cursor:
+        direction, timestamp, message_id = decode_cursor(cursor, 3)
+        if direction not in ("before", "after") or not isinstance(message_id, int) or not isinstance(timestamp, datetime):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        anchor = (timestamp, message_id)
+        newer = direction == "after"
+    elif before_id is not None or after_id is not None:
+        anchor_id = before_id if before_id is not None else after_id
+        anchor_message = await db.get(Message, anchor_id)
+        if not anchor_message or {anchor_message.sender_id, anchor_message.receiver_id} != {current_user.id, user_id}:
+            raise HTTPException(status_code=404, detail="Message not found in this conversation")
+        anchor = (anchor_message.timestamp, anchor_message.id)
+        newer = after_id is not None
+
+    # Each direction is read separately so both use ix_message_conversation;
+    # one extra row per side tells us whether another page exists.
+    outgoing = await _conversation_page(db, current_user.id, user_id, anchor, newer, limit + 1)
+    incoming = await _conversation_page(db, user_id, current_user.id, anchor, newer, limit + 1)
+    messages = sorted(outgoing + incoming, key=lambda m: (m.timestamp, m.id), reverse=not newer)
 
+    if len(messages) > limit:
+        messages = messages[:limit]
+        edge = messages[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            "after" if newer else "before", edge.timestamp, edge.id
+        )
+
+    if not newer:
+        messages.reverse()
     return messages
 
+@router.get("/search", response_model=List[dict])
+async def search(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=MAX_SEARCH_QUERY_LENGTH),
+    user_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_SEARCH_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Full-text search over the current user's messages.
+
+    Results are ranked best first and keyset-paginated on (rank, id);
+    pass the ``X-Next-Cursor`` header of a page as ``cursor`` to continue.
+
+    Args:
+        q (str): Search terms
+        user_id (Optional[int]): Only search the conversation with this user
+        cursor (Optional[str]): Opaque cursor from a previous page
+        limit (int): Maximum number of results
+        current_user (CurrentUser): Current authenticated user
+        db (AsyncSession): Database session
+
+    Returns:
+        List[dict]: Matching messages with their rank and highlighted content
+    """
+    after = None
+    if cursor:
+        rank, message_id = decode_cursor(cursor, 2)
+        if not isinstance(rank, (int, float)) or not isinstance(message_id, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        after = (float(rank), message_id)
+
+    results = await search_messages(db, current_user.id, q, limit + 1, user_id, after)
+    if len(results) > limit:
+        results = results[:limit]
+        _, rank, _ = results[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(rank, results[-1][0].id)
+
+    return [
+        {"message": message, "rank": rank, "highlight": highlight}
+        for message, rank, highlight in results
+    ]
+
+async def apply_receipt(db: AsyncSession, reader_id: int, partner_id: int, kind: str, up_to_id: Optional[int] = None) -> int:
+    """
+    Apply a "read"/"delivered up to" receipt and tell the sender once.
+
+    However many messages the range covers, the sender gets a single
+    receipt event; queued receipts for the same conversation and kind
+    coalesce, so only the newest reaches a slow client.
+
+    Args:
+        db (AsyncSession): Database session
+        reader_id (int): User acknowledging the messages
+        partner_id (int): Sender of the messages
+        kind (str): "read" or "delivered"
+        up_to_id (Optional[int]): Highest message id covered; everything if omitted
+
+    Returns:
+        int: Number of messages whose state changed
+    """
+    if kind not in RECEIPT_KINDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown receipt kind: {kind}"
+        )
+    apply = mark_read if kind == "read" else mark_delivered
+    changed, up_to_id = await apply(db, reader_id, partner_id, up_to_id)
+    await db.commit()
+
+    if changed:
+        await manager.send(partner_id, {
+            "type": "receipt",
+            "kind": kind,
+            "user_id": reader_id,
+            "up_to_id": up_to_id,
+        }, coalesce_key=("receipt", kind, reader_id))
+    return changed
+
+@router.post("/messages/{user_id}/read")
+async def mark_messages_read(
+    user_id: int,
+    up_to_id: Optional[int] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Mark messages received from another user as read.
+
+    Args:
+        user_id (int): ID of the other user
+        up_to_id (Optional[int]): Highest message id read; everything if omitted
+        current_user (CurrentUser): Current authenticated user
+        db (AsyncSession): Database session
+
+    Returns:
+        dict: Number of messages marked read
+    """
+    marked = await apply_receipt(db, current_user.id, user_id, "read", up_to_id)
+    return {"user_id": user_id, "marked_read": marked}
+
+@router.post("/messages/{user_id}/delivered")
+async def mark_messages_delivered(
+    user_id: int,
+    up_to_id: Optional[int] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Acknowledge delivery of messages received from another user.
+
+    Args:
+        user_id (int): ID of the other user
+        up_to_id (Optional[int]): Highest message id delivered; everything if omitted
+        current_user (CurrentUser): Current authenticated user
+        db (AsyncSession): Database session
+
+    Returns:
+        dict: Number of messages marked delivered
+    """
+    marked = await apply_receipt(db, current_user.id, user_id, "delivered", up_to_id)
+    return {"user_id": user_id, "marked_delivered": marked}
+
 @router.get("/conversations", response_model=List[dict])
 async def get_conversations(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get list of users the current user has conversations with.
 
+    Reads the incrementally maintained ConversationSummary rows, most
+    recent activity first.
+
     Args:
-        current_user (User): Current authenticated user
-        db (Session): Database session
+        limit (int): Maximum number of conversations to return
+        current_user (CurrentUser): Current authenticated user
+        db (AsyncSession): Database session
 
     Returns:
         List[dict]: List of conversation partners with last message info
     """
-    # Get unique conversation partners
-    conversations = db.exec(
-        select(Message).where(
-            (Message.sender_id == current_user.id) | (Message.receiver_id == current_user.id)
-        ).order_by(Message.timestamp.desc())
-    ).all()
+    summaries = (await db.exec(
+        select(ConversationSummary)
+        .where(ConversationSummary.user_id == current_user.id)
+        .order_by(ConversationSummary.last_message_time.desc())
+        .limit(limit)
+    )).all()
+
+    return [
+        {
+            "user_id": summary.partner_id,
+            "last_message": summary.last_message_preview,
+            "last_message_id": summary.last_message_id,
+            "last_message_time": summary.last_message_time,
+            "unread_count": summary.unread_count,
+        }
+        for summary in summaries
+    ]
+
+async def replay_missed(connection: Connection, last_seq: int, principal: Principal):
+    """
+    Stream events logged after last_seq to a reconnecting client.
+
+    Events are sent in batches, waiting for each batch to reach the socket
+    before reading the next so a long backlog never overflows the send
+    queue. Live events may interleave with the replay; clients drop any
+    seq they have already applied. If events after last_seq were already
+    purged from the log, a ``{"type": "resync", "oldest_seq": N}`` frame
+    comes first: the client must reload its state over REST, then apply
+    the replay, which starts at the oldest retained event.
+
+    Args:
+        connection: The client's Connection
+        last_seq (int): Highest sequence number the client has applied
+        principal (Principal): Identity the socket authenticated as
+    """
+    seq = last_seq
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as db:
+        floor = await replay_floor(db, connection.user_id)
+    if seq + 1 < floor:
+        _reply(connection, {"type": "resync", "oldest_seq": floor})
+    while not connection.closed:
+        async with AsyncSession(get_async_engine(), expire_on_commit=False) as db:
+            events = await fetch_events(db, connection.user_id, seq, REPLAY_BATCH_SIZE + 1)
+        more = len(events) > REPLAY_BATCH_SIZE
+        events = events[:REPLAY_BATCH_SIZE]
+        if events:
+            seq = events[-1]["seq"]
+            _reply(connection, {"type": "replay", "events": events, "more": more})
+        await connection.wait_drained()
+        if not more:
+            break
+    connection.last_seq = max(seq, connection.last_seq or 0)
+    _reply(connection, {
+        "type": "replay_done",
+        "seq": seq,
+        "resume_token": create_resume_token(principal, seq),
+    })
 
-    # Group by conversation partner and get latest message
-    conversation_map = {}
-    for msg in conversations:
-        other_user_id = msg.sender_id if msg.sender_id != current_user.id else msg.receiver_id
 
-        if other_user_id not in conversation_map or msg.timestamp > conversation_map[other_user_id]["last_message_time"]:
-            conversation_map[other_user_id] = {
-                "user_id": other_user_id,
-                "last_message": msg.content,
-                "last_message_time": msg.timestamp,
-                "unread_count": 0  # TODO: Implement unread count
-            }
+async def handle_chat_frame(
+    connection: Connection, principal: Principal, message_data: dict, pending_sends: Set[asyncio.Task]
+):
+    """
+    Act on one client frame of the chat channel, from the chat socket or
+    the /rt gateway.
+
+    Args:
+        connection (Connection): Connection the frame arrived on
+        principal (Principal): Identity the socket authenticated as
+        message_data (dict): Decoded frame
+        pending_sends (Set[asyncio.Task]): The connection's in-flight stores
+    """
+    if not isinstance(message_data, dict):
+        _reply(connection, {"type": "error", "message": "Invalid frame"})
+        return
+    user_id = connection.user_id
+    message_type = message_data.get("type")
+
+    if message_type == "ping":
+        # Keep connection alive
+        _reply(connection, {"type": "pong"})
+    elif message_type == "checkpoint":
+        # Never resume past what this connection actually sent
+        seq = message_data.get("seq")
+        if not isinstance(seq, int):
+            _reply(connection, {"type": "error", "message": "Invalid checkpoint"})
+        else:
+            if connection.last_seq is not None:
+                seq = min(seq, connection.last_seq)
+            _reply(connection, {
+                "type": "resume_token",
+                "seq": seq,
+                "resume_token": create_resume_token(principal, seq),
+            })
+    elif message_type == "send":
+        # Stores run as tasks so one connection can pipeline sends into a batch
+        task = asyncio.create_task(_send_from_socket(connection, principal, message_data))
+        pending_sends.add(task)
+        task.add_done_callback(pending_sends.discard)
+    elif message_type in RECEIPT_KINDS:
+        # Read/delivered receipt: {"type": "read", "partner_id": 2, "up_to_id": 41}
+        try:
+            partner_id = int(message_data["partner_id"])
+            up_to_id = message_data.get("up_to_id")
+            up_to_id = int(up_to_id) if up_to_id is not None else None
+        except (KeyError, TypeError, ValueError):
+            _reply(connection, {"type": "error", "message": "Invalid receipt"})
+        else:
+            async with AsyncSession(get_async_engine(), expire_on_commit=False) as db:
+                await apply_receipt(db, user_id, partner_id, message_type, up_to_id)
+    elif message_type == "typing":
+        # Keystroke frames only refresh state; the recipient sees start/stop
+        recipient_id = message_data.get("recipient_id")
+        if isinstance(recipient_id, int):
+            await typing_tracker.update(
+                user_id, recipient_id, bool(message_data.get("is_typing", True))
+            )
 
-    return list(conversation_map.values())
 
 @router.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int):
+async def websocket_endpoint(websocket: WebSocket, user_id: int, last_seq: Optional[int] = None):
     """
     WebSocket endpoint for real-time messaging.
 
+    Carries the chat and payment channels; ``/rt`` carries every channel on
+    one socket. The handshake must carry ``?token=`` (access token) or
+    ``?resume=`` (resume token from an earlier connection). Resuming
+    continues from the token's delivery cursor without a user lookup. A
+    client may send ``{"type": "checkpoint", "seq": N}`` at any time to get
+    a fresh resume token bound to the events it has applied.
+
     Args:
         websocket (WebSocket): WebSocket connection
         user_id (int): ID of the connecting user
+        last_seq (Optional[int]): Delivery sequence the client has applied;
+            when given, events it missed are replayed before live traffic
     """
-    await manager.connect(user_id, websocket)
+    if not await registry.admit(websocket):
+        return
+    auth = await authenticate_websocket(websocket, user_id)
+    if auth is None:
+        return
+    principal, resume_seq = auth
+    if last_seq is None:
+        last_seq = resume_seq
+
+    connection = await registry.connect(user_id, websocket, [manager, payment_manager], principal)
+    pending_sends: Set[asyncio.Task] = set()
 
     try:
+        if last_seq is not None:
+            await replay_missed(connection, last_seq, principal)
+
         while True:
             data = await websocket.receive_text()
+            connection.touch()
             try:
                 message_data = json.loads(data)
-                message_type = message_data.get("type")
-
-                if message_type == "ping":
-                    # Keep connection alive
-                    await websocket.send_json({"type": "pong"})
-                elif message_type == "typing":
-                    # Handle typing indicators
-                    recipient_id = message_data.get("recipient_id")
-                    if recipient_id:
-                        await manager.send_personal_message({
-                            "type": "typing",
-                            "user_id": user_id
-                        }, recipient_id)
-
             except json.JSONDecodeError:
-                await websocket.send_json({"type": "error", "message": "Invalid JSON"})
+                _reply(connection, {"type": "error", "message": "Invalid JSON"})
+                continue
+            await handle_chat_frame(connection, principal, message_data, pending_sends)
 
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
         print(f"User {user_id} disconnected from chat")
+    finally:
+        await registry.disconnect(connection)
@@ -3,16 +3,25 @@ import stripe
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 from sqlmodel import Session, select
-from app.routers.auth import get_current_user
+from app.routers.auth import CurrentUser, Principal, get_current_principal, get_current_user
 from app.models import User, Payment
 from app.database import get_db, get_engine
+from app.delivery import publish_durable
 from typing import List, Optional
 from datetime import datetime
 import time
-from app.routers.chat import manager as chat_manager
+from app.realtime.hub import ConnectionHub, registry
+from app.realtime.pubsub import get_pubsub
 
 router = APIRouter(prefix="/payment", tags=["payment"])
 
+class PaymentHub(ConnectionHub):
+    """Payment status events; carried by the chat socket and the /rt gateway."""
+
+    channel = "payment"
+
+manager = PaymentHub(get_pubsub(), registry=registry)
+
 class PaymentRequest(BaseModel):
     amount: int  # Amount in cents
     recipient_id: int
@@ -37,7 +46,7 @@ class TransactionHistory(BaseModel):
 @router.post("/create-intent", response_model=PaymentResponse)
 async def create_payment_intent(
     request: PaymentRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
@@ -45,7 +54,7 @@ async def create_payment_intent(
 
     Args:
         request (PaymentRequest): Payment details
-        current_user (User): Current authenticated user
+        current_user (CurrentUser): Current authenticated user
         db (Session): Database session
 
     Returns:
@@ -103,8 +112,10 @@ async def create_payment_intent(
             },
         }
         try:
-            await chat_manager.send_personal_message(payment_event, request.recipient_id)
-            await chat_manager.send_personal_message(payment_event, current_user.id)
+            await publish_durable(manager, [
+                (request.recipient_id, payment_event),
+                (current_user.id, payment_event),
+            ])
         except Exception:
             # Non-fatal if recipient is offline
             pass
@@ -142,14 +153,14 @@ async def create_payment_intent(
 @router.post("/confirm/{payment_intent_id}")
 async def confirm_payment(
     payment_intent_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Confirm a payment (for frontend to call after successful payment).
 
     Args:
         payment_intent_id (str): Stripe payment intent ID
-        current_user (User): Current authenticated user
+        current_user (Principal): Current authenticated user
 
     Returns:
         dict: Confirmation details
@@ -183,14 +194,14 @@ async def confirm_payment(
 
 @router.get("/transactions", response_model=List[TransactionHistory])
 async def get_transaction_history(
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     limit: int = 50,
 ):
     """
     Get transaction history for the current user (sent payments).
 
     Args:
-        current_user (User): Current authenticated user
+        current_user (CurrentUser): Current authenticated user
         limit (int): Maximum number of transactions to return
         offset (int): Number of transactions to skip
 
@@ -230,12 +241,12 @@ async def get_transaction_history(
         raise HTTPException(status_code=500, detail=f"Failed to retrieve transactions: {str(e)}")
 
 @router.get("/balance")
-async def get_user_balance(current_user: User = Depends(get_current_user)):
+async def get_user_balance(current_user: CurrentUser = Depends(get_current_user)):
     """
     Get user's payment balance/statistics.
 
     Args:
-        current_user (User): Current authenticated user
+        current_user (CurrentUser): Current authenticated user
 
     Returns:
         dict: User's payment statistics
@@ -278,14 +289,14 @@ async def get_user_balance(current_user: User = Depends(get_current_user)):
 
 @router.get("/received", response_model=List[TransactionHistory])
 async def get_received_payments(
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     limit: int = 50,
 ):
     """
     Get payments where the current user is the recipient.
 
     Args:
-        current_user (User): Current authenticated user
+        current_user (CurrentUser): Current authenticated user
         limit (int): Max number to return
         offset (int): Offset for pagination (best-effort)
 
@@ -369,10 +380,9 @@ async def stripe_webhook(request: dict):
                 },
             }
             try:
-                if recipient_id:
-                    await chat_manager.send_personal_message(evt, recipient_id)
-                if sender_id:
-                    await chat_manager.send_personal_message(evt, sender_id)
+                await publish_durable(manager, [
+                    (user_id, evt) for user_id in (recipient_id, sender_id) if user_id
+                ])
             except Exception:
                 pass
 
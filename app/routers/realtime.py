@@ -0,0 +1,79 @@
+from fastapi import APIRouter, WebSocket
+from starlette.websockets import WebSocketDisconnect
+from typing import Optional, Set
+from app.routers.auth import authenticate_websocket
+from app.routers import call, chat, payment
+from app.realtime.hub import registry
+import asyncio
+import json
+
+router = APIRouter(tags=["realtime"])
+
+@router.websocket("/rt")
+async def realtime_gateway(websocket: WebSocket, last_seq: Optional[int] = None):
+    """
+    Single WebSocket carrying every realtime channel.
+
+    Replaces holding both ``/chat/ws/{user_id}`` and
+    ``/call/signal/{user_id}``. Server frames are tagged with
+    ``"channel"``: ``chat`` (messages, typing, receipts, replay), ``call``
+    (call events, WebRTC signalling) or ``payment``. Client frames name the
+    channel they are for and otherwise look exactly like frames on the
+    dedicated sockets, e.g. ``{"channel": "call", "type": "webrtc_signal",
+    ...}``; ``{"type": "ping"}`` without a channel is answered with a pong,
+    and server heartbeat pings ``{"type": "ping"}`` expect ``{"type": "pong"}``.
+    The user is the one the token belongs to; authentication, resume
+    tokens and ``last_seq`` replay work as on the chat socket.
+
+    Args:
+        websocket (WebSocket): WebSocket connection
+        last_seq (Optional[int]): Delivery sequence the client has applied;
+            when given, events it missed are replayed before live traffic
+    """
+    if not await registry.admit(websocket):
+        return
+    auth = await authenticate_websocket(websocket)
+    if auth is None:
+        return
+    principal, resume_seq = auth
+    if last_seq is None:
+        last_seq = resume_seq
+
+    connection = await registry.connect(
+        principal.id, websocket, [chat.manager, call.manager, payment.manager], principal, multiplexed=True
+    )
+    pending_sends: Set[asyncio.Task] = set()
+
+    try:
+        if last_seq is not None:
+            await chat.replay_missed(connection, last_seq, principal)
+
+        while True:
+            data = await websocket.receive_text()
+            connection.touch()
+            try:
+                frame = json.loads(data)
+            except json.JSONDecodeError:
+                connection.send({"type": "error", "message": "Invalid JSON"})
+                continue
+            if not isinstance(frame, dict):
+                connection.send({"type": "error", "message": "Invalid frame"})
+                continue
+
+            channel = frame.get("channel")
+            if channel == chat.manager.channel:
+                await chat.handle_chat_frame(connection, principal, frame, pending_sends)
+            elif channel == call.manager.channel:
+                await call.handle_call_frame(connection, frame)
+            elif channel is None and frame.get("type") == "ping":
+                connection.send({"type": "pong"})
+            elif channel is None and frame.get("type") == "pong":
+                # Answer to a server heartbeat; receiving it was the point
+                pass
+            else:
+                connection.send({"type": "error", "message": f"Unknown channel: {channel}"})
+
+    except WebSocketDisconnect:
+        print(f"User {principal.id} disconnected from realtime gateway")
+    finally:
+        await registry.disconnect(connection)
@@ -1,14 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import update
 from sqlmodel import Session, select
-from app.database import get_db
-from app.models import User
-from app.routers.auth import get_current_user
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import get_db, get_async_db
+from app.models import ConversationSummary, User
+from app.realtime.presence import presence
+from app.routers.auth import CurrentUser, get_current_user, invalidate_user, revoke_user_tokens
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
 
 router = APIRouter(prefix="/users", tags=["users"])
 
+MAX_PRESENCE_LOOKUP = 200
+
 class UserProfile(BaseModel):
     id: int
     username: str
@@ -23,12 +28,12 @@ class UserSearch(BaseModel):
     username: str
 
 @router.get("/me", response_model=UserProfile)
-async def get_current_user_profile(current_user: User = Depends(get_current_user)):
+async def get_current_user_profile(current_user: CurrentUser = Depends(get_current_user)):
     """
     Get current user's profile information.
 
     Args:
-        current_user (User): Current authenticated user
+        current_user (CurrentUser): Current authenticated user
 
     Returns:
         UserProfile: Current user's profile
@@ -42,49 +47,72 @@ async def get_current_user_profile(current_user: User = Depends(get_current_user
 @router.put("/me", response_model=UserProfile)
 async def update_current_user_profile(
     user_update: UserUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Update current user's profile information.
 
     Args:
         user_update (UserUpdate): Updated user information
-        current_user (User): Current authenticated user
-        db (Session): Database session
+        current_user (CurrentUser): Current authenticated user
+        db (AsyncSession): Database session
 
     Returns:
         UserProfile: Updated user profile
     """
+    user = await db.get(User, current_user.id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
     # Check if username is being changed and if it's already taken
-    if user_update.username and user_update.username != current_user.username:
-        existing_user = db.exec(select(User).where(User.username == user_update.username)).first()
+    if user_update.username and user_update.username != user.username:
+        existing_user = (await db.exec(select(User).where(User.username == user_update.username))).first()
         if existing_user:
             raise HTTPException(status_code=400, detail="Username already taken")
-        current_user.username = user_update.username
+        user.username = user_update.username
 
     # Check if email is being changed and if it's already taken
-    if user_update.email and user_update.email != current_user.email:
-        existing_user = db.exec(select(User).where(User.email == user_update.email)).first()
+    if user_update.email and user_update.email != user.email:
+        existing_user = (await db.exec(select(User).where(User.email == user_update.email))).first()
         if existing_user:
             raise HTTPException(status_code=400, detail="Email already registered")
-        current_user.email = user_update.email
+        user.email = user_update.email
 
-    db.add(current_user)
-    db.commit()
-    db.refresh(current_user)
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+    invalidate_user(user.id)
 
     return UserProfile(
-        id=current_user.id,
-        username=current_user.username,
-        email=current_user.email
+        id=user.id,
+        username=user.username,
+        email=user.email
     )
 
+@router.delete("/me", status_code=status.HTTP_204_NO_CONTENT)
+async def deactivate_current_user(
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Deactivate the current user's account.
+
+    All of the user's tokens and sessions are revoked.
+
+    Args:
+        current_user (CurrentUser): Current authenticated user
+        db (AsyncSession): Database session
+    """
+    await db.exec(update(User).where(User.id == current_user.id).values(is_active=False))
+    await revoke_user_tokens(db, current_user.id)
+    await db.commit()
+
 @router.get("/search", response_model=List[UserSearch])
 async def search_users(
     query: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
     limit: int = 20
 ):
     """
@@ -92,8 +120,8 @@ async def search_users(
 
     Args:
         query (str): Search query (username)
-        current_user (User): Current authenticated user
-        db (Session): Database session
+        current_user (CurrentUser): Current authenticated user
+        db (AsyncSession): Database session
         limit (int): Maximum number of results
 
     Returns:
@@ -103,11 +131,11 @@ async def search_users(
         raise HTTPException(status_code=400, detail="Search query must be at least 2 characters")
 
     # Search for users whose username contains the query
-    users = db.exec(
+    users = (await db.exec(
         select(User).where(
             User.username.contains(query) & (User.id != current_user.id)
         ).limit(limit)
-    ).all()
+    )).all()
 
     return [
         UserSearch(id=user.id, username=user.username)
@@ -117,16 +145,16 @@ async def search_users(
 @router.get("/{user_id}", response_model=UserSearch)
 async def get_user_by_id(
     user_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get user information by ID.
 
     Args:
         user_id (int): ID of the user to retrieve
-        current_user (User): Current authenticated user
-        db (Session): Database session
+        current_user (CurrentUser): Current authenticated user
+        db (AsyncSession): Database session
 
     Returns:
         UserSearch: User information
@@ -134,7 +162,7 @@ async def get_user_by_id(
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Use /users/me to get your own profile")
 
-    user = db.exec(select(User).where(User.id == user_id)).first()
+    user = (await db.exec(select(User).where(User.id == user_id))).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -142,37 +170,53 @@ async def get_user_by_id(
 
 @router.get("/online/list")
 async def get_online_users(
-    current_user: User = Depends(get_current_user)
+    user_ids: Optional[str] = Query(None, description="Comma-separated user ids"),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Get list of currently online users.
+    Get the online status of a list of users.
 
     Args:
-        current_user (User): Current authenticated user
+        user_ids (Optional[str]): Comma-separated ids to look up; defaults to
+            the current user's most recent conversation partners
+        current_user (CurrentUser): Current authenticated user
+        db (AsyncSession): Database session
 
     Returns:
-        List[dict]: List of online users
+        dict: Online count and ``{"user_id", "online", "last_seen"}`` per user
     """
-    # This would integrate with the WebSocket managers to get online users
-    # For now, return a placeholder
-    # TODO: Integrate with chat and call managers to get actual online users
-
+    if user_ids:
+        try:
+            ids = list(dict.fromkeys(int(user_id) for user_id in user_ids.split(",") if user_id.strip()))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="user_ids must be comma-separated integers")
+        if len(ids) > MAX_PRESENCE_LOOKUP:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_PRESENCE_LOOKUP} user_ids per request")
+    else:
+        ids = list((await db.exec(
+            select(ConversationSummary.partner_id)
+            .where(ConversationSummary.user_id == current_user.id)
+            .order_by(ConversationSummary.last_message_time.desc())
+            .limit(MAX_PRESENCE_LOOKUP)
+        )).all())
+
+    users = await presence.lookup(db, ids)
     return {
-        "message": "Online users feature not yet implemented",
-        "online_count": 0,
-        "users": []
+        "online_count": sum(1 for user in users if user["online"]),
+        "users": users
     }
 
 @router.get("/stats")
 async def get_user_statistics(
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     Get user statistics (message count, etc.).
 
     Args:
-        current_user (User): Current authenticated user
+        current_user (CurrentUser): Current authenticated user
         db (Session): Database session
 
     Returns:
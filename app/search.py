@@ -0,0 +1,232 @@
+from typing import List, Optional, Tuple
+
+from sqlalchemy import DDL, and_, column, event, func, literal_column, or_, table
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models import Message
+
+# Text search configuration used for the generated tsvector column
+SEARCH_CONFIG = "english"
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_STOP = "</mark>"
+
+# Rows backfilled per UPDATE by the Postgres search migration
+SEARCH_BACKFILL_BATCH_SIZE = 5000
+
+# Postgres: a tsvector column kept in sync by a trigger, and a GIN index so
+# matching never scans message content. The column has no default, so adding
+# it never rewrites the table; existing rows are backfilled in batches and the
+# index is built concurrently by migrate_postgres_search.
+POSTGRES_SEARCH_DDL = (
+    'ALTER TABLE "message" ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    "CREATE OR REPLACE FUNCTION message_search_vector() RETURNS trigger AS $$ BEGIN "
+    f"NEW.search_vector := to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.content, '')); "
+    "RETURN NEW; END $$ LANGUAGE plpgsql",
+    'DROP TRIGGER IF EXISTS message_search_vector ON "message"',
+    'CREATE TRIGGER message_search_vector BEFORE INSERT OR UPDATE OF content ON "message" '
+    "FOR EACH ROW EXECUTE FUNCTION message_search_vector()",
+)
+POSTGRES_SEARCH_INDEX = "ix_message_search"
+# Empty tables (create_all) take the index right away
+POSTGRES_SEARCH_INDEX_DDL = (
+    f'CREATE INDEX IF NOT EXISTS {POSTGRES_SEARCH_INDEX} ON "message" USING GIN (search_vector)'
+)
+
+# SQLite (tests/local): an external-content FTS5 table mirroring message.content,
+# maintained by triggers.
+SQLITE_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts "
+    "USING fts5(content, content='message', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN "
+    "INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF content ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content); END",
+)
+
+
+def _install_ddl():
+    messages = Message.__table__
+    for statement in POSTGRES_SEARCH_DDL + (POSTGRES_SEARCH_INDEX_DDL,):
+        event.listen(messages, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+    for statement in SQLITE_SEARCH_DDL:
+        event.listen(messages, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+    event.listen(
+        messages, "after_drop", DDL("DROP TABLE IF EXISTS message_fts").execute_if(dialect="sqlite")
+    )
+
+
+_install_ddl()
+
+
+def ensure_search_schema(conn) -> bool:
+    """
+    Create the SQLite FTS table and triggers for a message table created
+    before search existed, indexing the messages it already holds. Safe to
+    run on every startup.
+
+    Postgres is left alone: its column and index are added by
+    migrate_postgres_search, outside the app's startup.
+
+    Args:
+        conn: Connection inside a transaction
+
+    Returns:
+        bool: Whether search is available
+    """
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        return conn.exec_driver_sql(
+            """
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s AND i.indisvalid
+            """,
+            (POSTGRES_SEARCH_INDEX,),
+        ).first() is not None
+    if dialect != "sqlite":
+        return False
+    existed = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_fts'"
+    ).first() is not None
+    for statement in SQLITE_SEARCH_DDL:
+        conn.exec_driver_sql(statement)
+    if not existed:
+        # External-content table: rebuild reads every row of message
+        conn.exec_driver_sql("INSERT INTO message_fts(message_fts) VALUES ('rebuild')")
+    return True
+
+
+def migrate_postgres_search(engine, batch_size: int = SEARCH_BACKFILL_BATCH_SIZE) -> int:
+    """
+    Add full-text search to an existing Postgres message table without
+    holding long locks: the column and trigger are cheap catalog changes,
+    existing rows are backfilled a batch per transaction, and the GIN index
+    is built with CREATE INDEX CONCURRENTLY. Safe to run again; an index
+    left invalid by an interrupted build is rebuilt.
+
+    Args:
+        engine: Sync engine of the database
+        batch_size (int): Rows updated per transaction
+
+    Returns:
+        int: Number of rows backfilled
+    """
+    with engine.begin() as conn:
+        generated = conn.exec_driver_sql(
+            """
+            SELECT is_generated FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = 'message' AND column_name = 'search_vector'
+            """
+        ).scalar()
+        # Databases set up by older releases already have a generated column
+        if generated != "ALWAYS":
+            for statement in POSTGRES_SEARCH_DDL:
+                conn.exec_driver_sql(statement)
+
+    backfilled = 0
+    if generated != "ALWAYS":
+        while True:
+            with engine.begin() as conn:
+                result = conn.exec_driver_sql(
+                    f"""
+                    UPDATE "message" SET search_vector = to_tsvector('{SEARCH_CONFIG}', coalesce(content, ''))
+                    WHERE id IN (SELECT id FROM "message" WHERE search_vector IS NULL LIMIT %s)
+                    """,
+                    (batch_size,),
+                )
+            backfilled += result.rowcount
+            if result.rowcount < batch_size:
+                break
+
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        valid = conn.exec_driver_sql(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s",
+            (POSTGRES_SEARCH_INDEX,),
+        ).scalar()
+        if valid is False:
+            conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {POSTGRES_SEARCH_INDEX}")
+        if not valid:
+            conn.exec_driver_sql(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {POSTGRES_SEARCH_INDEX} ON "message" USING GIN (search_vector)'
+            )
+    return backfilled
+
+
+def _fts5_query(query: str) -> str:
+    """Quote each term so user input is never parsed as FTS5 syntax."""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+
+async def search_messages(
+    db: AsyncSession,
+    user_id: int,
+    query: str,
+    limit: int,
+    partner_id: Optional[int] = None,
+    after: Optional[Tuple[float, int]] = None,
+) -> List[Tuple[Message, float, str]]:
+    """
+    Rank messages of user_id's conversations matching query.
+
+    Results are ordered by (rank desc, id desc) and keyset-paginated on that
+    pair. Highlights are computed only for the returned page.
+
+    Args:
+        db (AsyncSession): Database session
+        user_id (int): User whose sent and received messages are searched
+        query (str): Free-text search terms
+        limit (int): Maximum number of results
+        partner_id (Optional[int]): Restrict to the conversation with this user
+        after (Optional[Tuple[float, int]]): (rank, id) of the last result seen
+
+    Returns:
+        List[Tuple[Message, float, str]]: Message, rank and highlighted content
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        vector = literal_column('"message".search_vector')
+        tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, query)
+        rank = func.ts_rank(vector, tsquery)
+        highlight = func.ts_headline(
+            SEARCH_CONFIG, Message.content, tsquery,
+            f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, HighlightAll=true",
+        )
+        stmt = select(Message, rank.label("rank"), highlight.label("highlight")).where(
+            vector.op("@@")(tsquery)
+        )
+    elif dialect == "sqlite":
+        fts_table = table("message_fts", column("rowid"))
+        # FTS5 functions and MATCH take the table name itself as an argument
+        fts = literal_column("message_fts")
+        terms = _fts5_query(query)
+        if not terms:
+            return []
+        # bm25() is lower-is-better; negate so both backends rank descending
+        rank = -func.bm25(fts)
+        highlight = func.highlight(fts, 0, HIGHLIGHT_START, HIGHLIGHT_STOP)
+        stmt = (
+            select(Message, rank.label("rank"), highlight.label("highlight"))
+            .join(fts_table, fts_table.c.rowid == Message.id)
+            .where(fts.op("MATCH")(terms))
+        )
+    else:
+        raise RuntimeError(f"Unsupported database dialect for search: {dialect}")
+
+    if partner_id is not None:
+        stmt = stmt.where(or_(
+            and_(Message.sender_id == user_id, Message.receiver_id == partner_id),
+            and_(Message.sender_id == partner_id, Message.receiver_id == user_id),
+        ))
+    else:
+        stmt = stmt.where(or_(Message.sender_id == user_id, Message.receiver_id == user_id))
+
+    if after is not None:
+        after_rank, after_id = after
+        stmt = stmt.where(or_(rank < after_rank, and_(rank == after_rank, Message.id < after_id)))
+
+    stmt = stmt.order_by(rank.desc(), Message.id.desc()).limit(limit)
+    return [(message, float(score), snippet) for message, score, snippet in (await db.exec(stmt)).all()]
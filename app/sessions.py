@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import os
+import secrets
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.database import get_async_engine
+from app.models import UserSession
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+# How often each worker pulls revocations made by other workers
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", "5"))
+# How often expired sessions are deleted, and how many rows per DELETE
+SESSION_PURGE_INTERVAL_SECONDS = float(os.getenv("SESSION_PURGE_INTERVAL_SECONDS", "3600"))
+SESSION_PURGE_BATCH_SIZE = int(os.getenv("SESSION_PURGE_BATCH_SIZE", "1000"))
+
+
+def hash_refresh_token(refresh_token: str) -> str:
+    """Refresh tokens are stored hashed so a leaked table cannot be replayed."""
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+def _new_refresh_token() -> Tuple[str, str]:
+    refresh_token = secrets.token_urlsafe(32)
+    return refresh_token, hash_refresh_token(refresh_token)
+
+
+async def create_session(
+    db: AsyncSession,
+    user_id: int,
+    ip_address: Optional[str] = None,
+    user_agent: Optional[str] = None,
+) -> Tuple[UserSession, str]:
+    """
+    Open a login session. Commits.
+
+    Returns:
+        Tuple[UserSession, str]: The session and its refresh token, which is
+        only ever available here
+    """
+    refresh_token, token_hash = _new_refresh_token()
+    session = UserSession(
+        user_id=user_id,
+        session_token=token_hash,
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        ip_address=ip_address,
+        user_agent=user_agent[:255] if user_agent else None,
+    )
+    db.add(session)
+    await db.commit()
+    await db.refresh(session)
+    return session, refresh_token
+
+
+async def rotate_session(db: AsyncSession, refresh_token: str) -> Optional[Tuple[UserSession, str]]:
+    """
+    Exchange a refresh token for a new one on the same session. Commits.
+
+    The old token stops working immediately, so a stolen refresh token is
+    only good until the legitimate client next refreshes.
+
+    Returns:
+        Optional[Tuple[UserSession, str]]: The session and its new refresh
+        token, or None if the token is unknown, expired or revoked
+    """
+    now = datetime.utcnow()
+    new_token, token_hash = _new_refresh_token()
+    # Compare-and-swap on the token hash: of two concurrent refreshes with
+    # the same token exactly one wins
+    result = await db.exec(
+        update(UserSession)
+        .where(
+            (UserSession.session_token == hash_refresh_token(refresh_token))
+            & (UserSession.is_active == True)  # noqa: E712
+            & (UserSession.revoked_at == None)  # noqa: E711
+            & (UserSession.expires_at > now)
+        )
+        .values(session_token=token_hash, expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+        .returning(UserSession.id)
+    )
+    session_id = result.scalar_one_or_none()
+    await db.commit()
+    if session_id is None:
+        return None
+    return await db.get(UserSession, session_id), new_token
+
+
+async def revoke_session(db: AsyncSession, session_id: int, user_id: int) -> bool:
+    """
+    Revoke one of user_id's sessions. Commits.
+
+    Workers pick the revocation up on their next ``RevocationList.sync``;
+    callers add it to their own list to make it effective at once.
+
+    Returns:
+        bool: False if the session does not exist, belongs to someone else
+        or was already revoked
+    """
+    now = datetime.utcnow()
+    result = await db.exec(
+        update(UserSession)
+        .where(
+            (UserSession.id == session_id)
+            & (UserSession.user_id == user_id)
+            & (UserSession.revoked_at == None)  # noqa: E711
+        )
+        .values(is_active=False, revoked_at=now)
+    )
+    await db.commit()
+    return bool(result.rowcount)
+
+
+async def revoke_user_sessions(db: AsyncSession, user_id: int) -> List[int]:
+    """
+    Revoke every open session of user_id. Does not commit.
+
+    Returns:
+        List[int]: Ids of the sessions revoked
+    """
+    result = await db.exec(
+        update(UserSession)
+        .where((UserSession.user_id == user_id) & (UserSession.revoked_at == None))  # noqa: E711
+        .values(is_active=False, revoked_at=datetime.utcnow())
+        .returning(UserSession.id)
+    )
+    return list(result.scalars().all())
+
+
+class RevocationList:
+    """
+    In-memory set of recently revoked session ids.
+
+    Access tokens carry their session id, so rejecting a revoked session
+    is a set lookup rather than a query. Token versions retired on this
+    worker are tracked too; other workers rely on the accompanying session
+    revocations. A session only has to stay listed
+    until the last access token issued for it has expired, which bounds
+    the set to the revocations of one access-token lifetime. ``sync`` reads
+    only revocations newer than the previous sync.
+    """
+
+    def __init__(self, retain: timedelta):
+        self.retain = retain
+        self.syncs = 0
+        self._revoked: Dict[int, datetime] = {}
+        self._min_token_versions: Dict[int, int] = {}
+        self._synced_until: Optional[datetime] = None
+
+    def __contains__(self, session_id: int) -> bool:
+        return session_id in self._revoked
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    def add(self, session_id: int, revoked_at: datetime):
+        self._revoked[session_id] = revoked_at
+
+    def retire_token_versions(self, user_id: int, min_version: int):
+        """Reject user_id's tokens issued with a version below min_version."""
+        self._min_token_versions[user_id] = max(min_version, self._min_token_versions.get(user_id, 0))
+
+    def token_version_ok(self, user_id: int, version: int) -> bool:
+        return version >= self._min_token_versions.get(user_id, 0)
+
+    def clear(self):
+        self._revoked.clear()
+        self._min_token_versions.clear()
+        self._synced_until = None
+
+    async def sync(self, db: AsyncSession):
+        """Load revocations made since the last sync and forget expired ones."""
+        now = datetime.utcnow()
+        since = self._synced_until or now - self.retain
+        rows = (await db.exec(
+            select(UserSession.id, UserSession.revoked_at)
+            .where(UserSession.revoked_at >= since)
+        )).all()
+        for session_id, revoked_at in rows:
+            self._revoked[session_id] = revoked_at
+        # Overlap the next window slightly; commits can land with a slightly
+        # older timestamp than a sync that already ran
+        self._synced_until = now - timedelta(seconds=REVOCATION_SYNC_SECONDS)
+        horizon = now - self.retain
+        for session_id in [sid for sid, revoked_at in self._revoked.items() if revoked_at < horizon]:
+            del self._revoked[session_id]
+        self.syncs += 1
+
+    def stats(self) -> dict:
+        return {"revoked": len(self._revoked), "syncs": self.syncs}
+
+
+async def purge_expired_sessions(db: AsyncSession, batch_size: int = SESSION_PURGE_BATCH_SIZE) -> int:
+    """
+    Delete expired sessions a batch at a time so no single statement holds
+    locks on a large range.
+
+    Returns:
+        int: Number of sessions deleted
+    """
+    purged = 0
+    while True:
+        ids = select(UserSession.id).where(UserSession.expires_at < datetime.utcnow()).limit(batch_size)
+        result = await db.exec(delete(UserSession).where(UserSession.id.in_(ids)))
+        await db.commit()
+        purged += result.rowcount or 0
+        if (result.rowcount or 0) < batch_size:
+            return purged
+
+
+async def run_session_maintenance(revocations: RevocationList):
+    """Background loop: sync revocations often, purge expired sessions rarely."""
+    loop = asyncio.get_running_loop()
+    next_purge = loop.time()
+    while True:
+        try:
+            async with AsyncSession(get_async_engine(), expire_on_commit=False) as db:
+                await revocations.sync(db)
+                if loop.time() >= next_purge:
+                    purged = await purge_expired_sessions(db)
+                    if purged:
+                        print(f"Purged {purged} expired sessions")
+                    next_purge = loop.time() + SESSION_PURGE_INTERVAL_SECONDS
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Session maintenance error: {e}")
+        await asyncio.sleep(REVOCATION_SYNC_SECONDS)
@@ -0,0 +1,108 @@
+"""
+Call room signalling load.
+
+Opens ``--rooms`` call rooms of 2, 8 and 32 participants on one worker,
+next to ``--idle`` connected users in no room. Each room broadcasts
+``--rate`` room signals per second (spread over its members, as during a
+mesh call setup) for ``--seconds``. For each room size it reports the
+latency from a signal being relayed to each copy being written to a
+member's socket. Fan-out only touches the members of the room, so the
+cost of a signal follows the room size and not the number of connected
+users.
+
+    python benchmarks/call_rooms.py --rooms 32 --rate 10 --idle 5000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.routers.call import SignalingManager  # noqa: E402
+
+ROOM_SIZES = (2, 8, 32)
+
+
+class BenchWebSocket:
+    def __init__(self, latencies):
+        self.latencies = latencies
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        sent_at = message.get("data", {}).get("sent_at")
+        if sent_at is not None:
+            self.latencies.append(time.perf_counter() - sent_at)
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def load(args, room_size):
+    hub = SignalingManager(max_room_participants=room_size)
+    latencies = []
+    users = args.rooms * room_size + args.idle
+    # connect/disconnect log every socket
+    with contextlib.redirect_stdout(io.StringIO()):
+        connections = [await hub.connect(user_id, BenchWebSocket(latencies)) for user_id in range(users)]
+        rooms = []
+        for first in range(0, args.rooms * room_size, room_size):
+            room = await hub.create_room(first, "video", range(first + 1, first + room_size))
+            for user_id in range(first + 1, first + room_size):
+                await hub.join_room(room.room_id, user_id)
+            rooms.append(room)
+        for connection in connections:
+            await connection.wait_drained()
+    latencies.clear()
+
+    async def room_traffic(room):
+        await asyncio.sleep(random.random() / args.rate)
+        deadline = time.perf_counter() + args.seconds
+        while time.perf_counter() < deadline:
+            sender_id = random.choice(room.participants)
+            await hub.room_signal(room.room_id, sender_id, {"type": "candidate", "sent_at": time.perf_counter()})
+            await asyncio.sleep(1 / args.rate)
+
+    await asyncio.gather(*(room_traffic(room) for room in rooms))
+    for connection in connections:
+        await connection.wait_drained()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for connection in connections:
+            await hub.disconnect(connection)
+    return latencies
+
+
+async def main(args):
+    print(f"{args.rooms} rooms, {args.rate} signals/s per room for {args.seconds}s, {args.idle} idle users")
+    for room_size in ROOM_SIZES:
+        latencies = await load(args, room_size)
+        print(f"rooms of {room_size}: {len(latencies)} frames")
+        print(
+            "  signal latency ms: p50={:.2f} p95={:.2f} p99={:.2f} max={:.2f}".format(
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 95) * 1000,
+                percentile(latencies, 99) * 1000,
+                max(latencies) * 1000,
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--rooms", type=int, default=32)
+    parser.add_argument("--rate", type=float, default=10)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--idle", type=int, default=5000)
+    asyncio.run(main(parser.parse_args()))
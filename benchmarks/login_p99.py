@@ -0,0 +1,89 @@
+"""
+Login latency under concurrency.
+
+Fires ``--requests`` logins, ``--concurrency`` at a time, at the app
+in-process (temporary SQLite database, no network) and reports latency
+percentiles for successful logins alongside the number of requests the
+password hasher refused with 503. Pool limits come from the usual
+PASSWORD_HASH_WORKERS / PASSWORD_HASH_QUEUE_SIZE environment variables.
+
+    python benchmarks/login_p99.py --concurrency 200 --requests 1000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+)
+
+import httpx  # noqa: E402
+from sqlmodel import SQLModel  # noqa: E402
+
+from app.database import get_engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.routers.auth import password_hasher  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def main(args):
+    SQLModel.metadata.create_all(get_engine())
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        for i in range(args.users):
+            response = await client.post("/auth/register", json={
+                "username": f"bench{i}", "email": f"bench{i}@example.com", "password": "password",
+            })
+            response.raise_for_status()
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, rejected, failed = [], 0, 0
+
+        async def login(i):
+            nonlocal rejected, failed
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/auth/token", data={
+                    "username": f"bench{i % args.users}", "password": "password",
+                })
+                elapsed = time.perf_counter() - started
+            if response.status_code == 200:
+                latencies.append(elapsed)
+            elif response.status_code == 503:
+                rejected += 1
+            else:
+                failed += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(login(i) for i in range(args.requests)))
+        wall = time.perf_counter() - started
+
+    print(f"hasher: {password_hasher.workers} workers, queue {password_hasher.max_queue}")
+    print(f"{args.requests} logins, concurrency {args.concurrency}, {wall:.2f}s wall")
+    print(f"ok={len(latencies)} rejected_503={rejected} failed={failed}")
+    if latencies:
+        print(
+            "latency ms: p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f} mean={:.1f}".format(
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 95) * 1000,
+                percentile(latencies, 99) * 1000,
+                max(latencies) * 1000,
+                statistics.mean(latencies) * 1000,
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,86 @@
+"""
+Ring timeouts at scale.
+
+Starts ``--calls`` ringing calls, each with a ring timeout of ``--timeout``
+seconds, answers ``--answered`` percent of them (cancelling their timeout)
+and waits for the rest to expire. The run is repeated with one timer on
+the shared timer wheel per call and with one sleeping task per call, and
+reports the time to schedule and to cancel and how late the last timeout
+fired after the last call was placed. ``--memory`` reports the peak traced
+memory instead (tracing slows everything down, so timings are skipped).
+
+    python benchmarks/ring_timeouts.py --calls 200000 --timeout 2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.realtime.timers import TimerWheel  # noqa: E402
+
+
+async def with_wheel(args, expired):
+    wheel = TimerWheel(resolution_ms=args.resolution_ms)
+    started = time.perf_counter()
+    handles = [wheel.schedule(args.timeout, expired.append, i) for i in range(args.calls)]
+    scheduled = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for handle in handles[:args.calls * args.answered // 100]:
+        wheel.cancel(handle)
+    cancelled = time.perf_counter() - started
+
+    while len(wheel):
+        await asyncio.sleep(args.resolution_ms / 1000)
+    return scheduled, cancelled, time.perf_counter() - started - cancelled
+
+
+async def with_tasks(args, expired):
+    async def ring(i):
+        await asyncio.sleep(args.timeout)
+        expired.append(i)
+
+    started = time.perf_counter()
+    tasks = [asyncio.ensure_future(ring(i)) for i in range(args.calls)]
+    scheduled = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for task in tasks[:args.calls * args.answered // 100]:
+        task.cancel()
+    cancelled = time.perf_counter() - started
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return scheduled, cancelled, time.perf_counter() - started - cancelled
+
+
+async def main(args):
+    print(f"{args.calls} ringing calls, {args.timeout}s timeout, {args.answered}% answered")
+    for label, run in (("timer wheel", with_wheel), ("task per call", with_tasks)):
+        expired = []
+        if args.memory:
+            tracemalloc.start()
+            await run(args, expired)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{label}: {len(expired)} missed, peak {peak / 2**20:.1f} MiB")
+            continue
+        scheduled, cancelled, waited = await run(args, expired)
+        print(f"{label}: {len(expired)} missed")
+        print(
+            f"  schedule {scheduled * 1000:.0f}ms, cancel {cancelled * 1000:.0f}ms, "
+            f"last timeout {(waited - args.timeout) * 1000:.0f}ms late"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--timeout", type=float, default=2)
+    parser.add_argument("--answered", type=int, default=80)
+    parser.add_argument("--resolution-ms", type=float, default=100)
+    parser.add_argument("--memory", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,110 @@
+"""
+WebSocket reconnect storm.
+
+Simulates ``--clients`` sockets reconnecting to one worker at the same
+instant, as after a deploy. Each admitted handshake costs a fixed amount
+of "database" time on a pool of ``--pool`` connections (token check plus
+history replay); refused clients sleep for the hint carried in the 4429
+close reason and try again. The run is repeated with and without the
+admission controller and reports, for each, handshake latency percentiles
+(time from a client's attempt to its socket being ready) and the time
+until every client is connected.
+
+    python benchmarks/ws_reconnect_storm.py --clients 5000 --rate 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.realtime.admission import CLOSE_TRY_LATER, AdmissionController  # noqa: E402
+from app.realtime.hub import ConnectionHub  # noqa: E402
+
+
+class BenchWebSocket:
+    def __init__(self):
+        self.close_code = None
+        self.close_reason = None
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        pass
+
+    async def close(self, code=1000, reason=None):
+        self.close_code = code
+        self.close_reason = reason
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def storm(args, admission):
+    hub = ConnectionHub(admission=admission)
+    pool = asyncio.Semaphore(args.pool)
+    latencies, refusals = [], 0
+
+    async def client(user_id):
+        nonlocal refusals
+        while True:
+            websocket = BenchWebSocket()
+            started = time.perf_counter()
+            if not await hub.admit(websocket):
+                assert websocket.close_code == CLOSE_TRY_LATER
+                refusals += 1
+                await asyncio.sleep(json.loads(websocket.close_reason)["retry_after_ms"] / 1000)
+                continue
+            async with pool:
+                await asyncio.sleep(args.handshake_ms / 1000)
+            await hub.connect(user_id, websocket)
+            latencies.append(time.perf_counter() - started)
+            return
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(args.clients)))
+    wall = time.perf_counter() - started
+    for devices in list(hub.connections.values()):
+        for connection in list(devices.values()):
+            await hub.disconnect(connection)
+    return latencies, refusals, wall
+
+
+async def main(args):
+    runs = [
+        ("no admission control", None),
+        ("admission control", AdmissionController(
+            rate=args.rate, burst=args.burst, max_connections=args.clients,
+            retry_min_ms=args.retry_min_ms, retry_max_ms=args.retry_max_ms,
+        )),
+    ]
+    print(f"{args.clients} clients, pool {args.pool}, {args.handshake_ms}ms per handshake")
+    for label, admission in runs:
+        latencies, refusals, wall = await storm(args, admission)
+        print(f"{label}: all connected after {wall:.2f}s, {refusals} refusals")
+        print(
+            "  handshake ms: p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f}".format(
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 95) * 1000,
+                percentile(latencies, 99) * 1000,
+                max(latencies) * 1000,
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--pool", type=int, default=10)
+    parser.add_argument("--handshake-ms", type=float, default=5)
+    parser.add_argument("--rate", type=float, default=1500)
+    parser.add_argument("--burst", type=int, default=50)
+    parser.add_argument("--retry-min-ms", type=int, default=100)
+    parser.add_argument("--retry-max-ms", type=int, default=5000)
+    asyncio.run(main(parser.parse_args()))
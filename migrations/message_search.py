@@ -0,0 +1,34 @@
+"""
+Add full-text search to an existing Postgres message table.
+
+Adds the search_vector column and its trigger, backfills existing messages
+``--batch-size`` rows per transaction and builds the GIN index with
+CREATE INDEX CONCURRENTLY, so reads and writes of ``message`` keep going
+while it runs. Safe to run again, e.g. as a pre-deploy command; databases
+created after search existed already have everything and finish at once.
+
+    DATABASE_URL=postgresql://... python migrations/message_search.py
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import get_engine  # noqa: E402
+from app.search import SEARCH_BACKFILL_BATCH_SIZE, migrate_postgres_search  # noqa: E402
+
+
+def main(args):
+    engine = get_engine()
+    if engine.dialect.name != "postgresql":
+        print(f"Nothing to migrate on {engine.dialect.name}; search is set up at startup")
+        return
+    backfilled = migrate_postgres_search(engine, batch_size=args.batch_size)
+    print(f"Message search ready ({backfilled} messages backfilled)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--batch-size", type=int, default=SEARCH_BACKFILL_BATCH_SIZE)
+    main(parser.parse_args())
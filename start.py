@@ -17,15 +17,29 @@ from app.main import app
 
 if __name__ == "__main__":
     import uvicorn
+    from app.main import drain_realtime
+    from app.realtime.admission import DRAIN_TIMEOUT_SECONDS
+
+
+    class DrainingServer(uvicorn.Server):
+        """uvicorn closes open WebSockets before the app's shutdown hook
+        runs, so realtime clients are handed off first."""
+
+        async def shutdown(self, sockets=None):
+            await drain_realtime()
+            await super().shutdown(sockets=sockets)
+
 
     # Get port from environment (Render sets PORT)
     port = int(os.getenv("PORT", 8000))
 
     # Start the server
-    uvicorn.run(
+    config = uvicorn.Config(
         "app.main:app",
         host="0.0.0.0",
         port=port,
         reload=False,  # Disable reload in production
-        log_level="info"
+        log_level="info",
+        timeout_graceful_shutdown=int(DRAIN_TIMEOUT_SECONDS) + 5,
     )
+    DrainingServer(config).run()
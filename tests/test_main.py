@@ -1,26 +1,49 @@
+import asyncio
+import os
+import tempfile
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import SQLModel, create_engine, Session
-from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, create_engine, Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from app.main import app
-from app.database import get_db
+from app.database import get_db, get_async_db, get_async_engine
 from app.models import User, Message, Call, Payment
-from app.routers.auth import get_password_hash
-
-# Create in-memory database for testing
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+from app.realtime.call_history import call_history
+from app.realtime.hub import registry
+from app.realtime.presence import presence
+from app.routers.call import manager as call_manager
+from app.routers.chat import manager as chat_manager
+from app.routers.auth import get_password_hash, revocations, user_cache
+
+# File-backed SQLite so the sync engine and the aiosqlite engine share data.
+# NullPool because TestClient runs each request on a fresh event loop.
+TEST_DB_PATH = os.path.join(tempfile.mkdtemp(), "test.db")
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{TEST_DB_PATH}"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
+    poolclass=NullPool,
+)
+async_engine = create_async_engine(
+    f"sqlite+aiosqlite:///{TEST_DB_PATH}",
+    poolclass=NullPool,
 )
 
-# Override the database dependency
+# Override the database dependencies
 def override_get_db():
     with Session(engine) as session:
         yield session
 
+async def override_get_async_db():
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
+# Background writers open their own sessions from the cached async engine
+get_async_engine._engine = async_engine
 
 client = TestClient(app)
 
@@ -30,6 +53,13 @@ def setup_database():
     SQLModel.metadata.create_all(engine)
     yield
     SQLModel.metadata.drop_all(engine)
+    # Tokens issued in the same second, and session ids, repeat across tests
+    user_cache.clear()
+    revocations.clear()
+    presence.clear()
+    call_manager.calls.clear()
+    call_manager.rooms.clear()
+    call_history.clear()
 
 @pytest.fixture
 def test_user():
@@ -154,6 +184,111 @@ def test_update_user_profile(test_user):
     data = response.json()
     assert data["username"] == "updateduser"
 
+def test_current_user_cache_hits_and_invalidation(test_user):
+    """Test that verified tokens are cached and profile changes invalidate them"""
+    token = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    before = user_cache.stats()
+    for _ in range(3):
+        assert client.get("/users/me", headers=headers).json()["email"] == "test@example.com"
+    stats = user_cache.stats()
+    assert stats["misses"] - before["misses"] == 1
+    assert stats["hits"] - before["hits"] == 2
+
+    client.put("/users/me", json={"email": "new@example.com"}, headers=headers)
+    assert client.get("/users/me", headers=headers).json()["email"] == "new@example.com"
+
+    assert client.delete("/users/me", headers=headers).status_code == 204
+    # Deactivation revokes the account's tokens
+    assert client.get("/users/me", headers=headers).status_code == 401
+    assert client.get("/debug").json()["user_cache"]["size"] >= 0
+
+def test_invalidation_marks_expire_with_the_cache(monkeypatch):
+    """Test that per-user invalidation marks are dropped once no snapshot can predate them"""
+    import time
+    from app.routers import auth
+
+    monkeypatch.setattr(auth, "USER_CACHE_TTL_SECONDS", 0.05)
+    auth.invalidate_user(1001)
+    auth.invalidate_user(1002)
+    assert {1001, 1002} <= set(auth._invalidated_at)
+    time.sleep(0.1)
+    auth.invalidate_user(1003)
+    assert 1001 not in auth._invalidated_at and 1002 not in auth._invalidated_at
+    assert 1003 in auth._invalidated_at
+
+def test_refresh_rotates_and_logout_revokes(test_user):
+    """Test refresh token rotation and session revocation"""
+    tokens = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()
+    assert tokens["refresh_token"]
+
+    refreshed = client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert refreshed.status_code == 200
+    new_tokens = refreshed.json()
+    # Refresh tokens are single-use
+    assert client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+
+    headers = {"Authorization": f"Bearer {new_tokens['access_token']}"}
+    assert client.get("/users/me", headers=headers).status_code == 200
+    assert client.post("/auth/logout", headers=headers).status_code == 204
+    # Both the cached and the original access token of the session are rejected
+    assert client.get("/users/me", headers=headers).status_code == 401
+    assert client.get("/users/me", headers={"Authorization": f"Bearer {tokens['access_token']}"}).status_code == 401
+    assert client.post("/auth/refresh", json={"refresh_token": new_tokens["refresh_token"]}).status_code == 401
+
+def test_principal_routes_resolve_without_queries(test_user):
+    """Test that id-only routes authenticate from token claims alone"""
+    from sqlalchemy import event
+
+    tokens = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    statements = []
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+    try:
+        assert client.get("/call/active", headers=headers).json() == []
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+    assert statements == []
+
+    # Logging out everywhere retires the token version and all sessions
+    assert client.post("/auth/logout-all", headers=headers).status_code == 204
+    assert client.get("/call/active", headers=headers).status_code == 401
+    assert client.get("/users/me", headers=headers).status_code == 401
+    assert client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+
+    tokens = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()
+    assert client.get("/call/active", headers={"Authorization": f"Bearer {tokens['access_token']}"}).status_code == 200
+
+def test_revocation_sync_and_expired_session_purge(test_user):
+    """Test that workers learn revocations from the DB and expired sessions are purged"""
+    from datetime import datetime, timedelta
+    from app.models import UserSession
+    from app.sessions import RevocationList, purge_expired_sessions
+
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        session.add(UserSession(user_id=test_user.id, session_token="a", expires_at=now + timedelta(days=1), revoked_at=now))
+        session.add(UserSession(user_id=test_user.id, session_token="b", expires_at=now - timedelta(days=1)))
+        session.add(UserSession(user_id=test_user.id, session_token="c", expires_at=now - timedelta(days=1)))
+        session.add(UserSession(user_id=test_user.id, session_token="d", expires_at=now + timedelta(days=1)))
+        session.commit()
+
+    async def scenario():
+        async with AsyncSession(async_engine, expire_on_commit=False) as db:
+            other_worker = RevocationList(retain=timedelta(minutes=30))
+            await other_worker.sync(db)
+            purged = await purge_expired_sessions(db, batch_size=1)
+            return other_worker, purged
+
+    other_worker, purged = asyncio.run(scenario())
+    assert 1 in other_worker and 4 not in other_worker
+    assert purged == 2
+    with Session(engine) as session:
+        assert sorted(s.session_token for s in session.exec(select(UserSession))) == ["a", "d"]
+
 def test_search_users(test_user, test_user2):
     """Test user search functionality"""
     # Login to get token
@@ -217,6 +352,38 @@ def test_get_messages(test_user, test_user2):
     assert len(data) == 1
     assert data[0]["content"] == "Test message"
 
+def test_get_messages_keyset_pagination(test_user, test_user2):
+    """Test paging back through a conversation with cursors"""
+    login_response = client.post("/auth/token", data={
+        "username": "testuser",
+        "password": "testpassword"
+    })
+    token = login_response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    for i in range(5):
+        client.post("/chat/send", json={"content": f"m{i}", "receiver_id": test_user2.id}, headers=headers)
+
+    response = client.get(f"/chat/messages/{test_user2.id}?limit=2", headers=headers)
+    assert response.status_code == 200
+    assert [m["content"] for m in response.json()] == ["m3", "m4"]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(f"/chat/messages/{test_user2.id}?limit=2&cursor={cursor}", headers=headers)
+    assert [m["content"] for m in response.json()] == ["m1", "m2"]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(f"/chat/messages/{test_user2.id}?limit=2&cursor={cursor}", headers=headers)
+    page = response.json()
+    assert [m["content"] for m in page] == ["m0"]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = client.get(f"/chat/messages/{test_user2.id}?after_id={page[0]['id']}&limit=3", headers=headers)
+    assert [m["content"] for m in response.json()] == ["m1", "m2", "m3"]
+
+    response = client.get(f"/chat/messages/{test_user2.id}?cursor=bogus", headers=headers)
+    assert response.status_code == 400
+
 def test_get_conversations(test_user, test_user2):
     """Test getting user conversations"""
     # First send a message
@@ -242,6 +409,306 @@ def test_get_conversations(test_user, test_user2):
     assert len(data) == 1
     assert data[0]["user_id"] == test_user2.id
 
+def test_conversation_summary_unread_and_read(test_user, test_user2):
+    """Test that the conversation list tracks last message and unread count"""
+    token1 = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    token2 = client.post("/auth/token", data={"username": "testuser2", "password": "testpassword2"}).json()["access_token"]
+    headers1 = {"Authorization": f"Bearer {token1}"}
+    headers2 = {"Authorization": f"Bearer {token2}"}
+
+    for content in ["first", "second", "third"]:
+        client.post("/chat/send", json={"content": content, "receiver_id": test_user2.id}, headers=headers1)
+
+    data = client.get("/chat/conversations", headers=headers2).json()
+    assert len(data) == 1
+    assert data[0]["user_id"] == test_user.id
+    assert data[0]["last_message"] == "third"
+    assert data[0]["unread_count"] == 3
+
+    # Sender's own side never counts as unread
+    assert client.get("/chat/conversations", headers=headers1).json()[0]["unread_count"] == 0
+
+    second_id = client.get(f"/chat/messages/{test_user.id}", headers=headers2).json()[1]["id"]
+    response = client.post(f"/chat/messages/{test_user.id}/read?up_to_id={second_id}", headers=headers2)
+    assert response.json()["marked_read"] == 2
+    assert client.get("/chat/conversations", headers=headers2).json()[0]["unread_count"] == 1
+
+    client.post(f"/chat/messages/{test_user.id}/read", headers=headers2)
+    assert client.get("/chat/conversations", headers=headers2).json()[0]["unread_count"] == 0
+
+def test_search_messages_ranked_highlighted_and_paginated(test_user, test_user2):
+    """Test full-text search over the user's conversations"""
+    token1 = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    token2 = client.post("/auth/token", data={"username": "testuser2", "password": "testpassword2"}).json()["access_token"]
+    headers1 = {"Authorization": f"Bearer {token1}"}
+    headers2 = {"Authorization": f"Bearer {token2}"}
+    for content in ["lunch tomorrow?", "pizza for lunch", "pizza pizza pizza", "see you"]:
+        client.post("/chat/send", json={"content": content, "receiver_id": test_user2.id}, headers=headers1)
+
+    response = client.get("/chat/search", params={"q": "pizza", "limit": 1}, headers=headers2)
+    assert response.status_code == 200
+    first = response.json()
+    assert len(first) == 1
+    assert first[0]["message"]["content"] == "pizza pizza pizza"
+    assert "<mark>pizza</mark>" in first[0]["highlight"]
+
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get("/chat/search", params={"q": "pizza", "cursor": cursor}, headers=headers2)
+    assert [r["message"]["content"] for r in response.json()] == ["pizza for lunch"]
+    assert "X-Next-Cursor" not in response.headers
+
+    # Quotes and FTS syntax in user input are searched literally
+    response = client.get("/chat/search", params={"q": '"lunch*', "user_id": test_user.id}, headers=headers2)
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+    # Conversations the user is not part of are never searched
+    assert client.get("/chat/search", params={"q": "pizza", "user_id": 9999}, headers=headers2).json() == []
+
+def test_search_schema_added_to_existing_sqlite_database(test_user, test_user2):
+    """Test that startup creates and fills the FTS table of a database that predates search"""
+    from app.search import ensure_search_schema
+
+    token = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post("/chat/send", json={"content": "written before search", "receiver_id": test_user2.id}, headers=headers)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE message_fts")
+        for trigger in ("insert", "delete", "update"):
+            conn.exec_driver_sql(f"DROP TRIGGER message_fts_{trigger}")
+    for _ in range(2):
+        with engine.begin() as conn:
+            assert ensure_search_schema(conn)
+
+    client.post("/chat/send", json={"content": "written after search", "receiver_id": test_user2.id}, headers=headers)
+    response = client.get("/chat/search", params={"q": "written"}, headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+def test_receipts_emit_one_event_to_sender(test_user, test_user2):
+    """Test that range receipts update state and notify the sender once"""
+    token1 = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    token2 = client.post("/auth/token", data={"username": "testuser2", "password": "testpassword2"}).json()["access_token"]
+    headers1 = {"Authorization": f"Bearer {token1}"}
+    headers2 = {"Authorization": f"Bearer {token2}"}
+    ids = [
+        client.post("/chat/send", json={"content": f"m{i}", "receiver_id": test_user2.id}, headers=headers1).json()["id"]
+        for i in range(5)
+    ]
+
+    with client.websocket_connect(f"/chat/ws/{test_user2.id}?token={token2}") as ws:
+        ws.send_json({"type": "delivered", "partner_id": test_user.id, "up_to_id": ids[-1]})
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+
+    with client.websocket_connect(f"/chat/ws/{test_user.id}?token={token1}") as sender_ws:
+        response = client.post(f"/chat/messages/{test_user.id}/read", headers=headers2)
+        assert response.json()["marked_read"] == 5
+        receipt = sender_ws.receive_json()
+        assert receipt == {"type": "receipt", "kind": "read", "user_id": test_user2.id, "up_to_id": ids[-1]}
+
+    messages = client.get(f"/chat/messages/{test_user2.id}", headers=headers1).json()
+    assert all(m["is_read"] and m["is_delivered"] for m in messages)
+    # Already-delivered messages do not produce another receipt
+    response = client.post(f"/chat/messages/{test_user.id}/delivered", headers=headers2)
+    assert response.json()["marked_delivered"] == 0
+
+def test_websocket_send_is_acked_with_server_id(test_user, test_user2):
+    """Test sending a message over the chat WebSocket"""
+    token = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    with client.websocket_connect(f"/chat/ws/{test_user.id}?token={token}") as ws:
+        ws.send_json({"type": "send", "receiver_id": test_user2.id, "content": "over ws", "client_id": "c1"})
+        ack = ws.receive_json()
+        assert ack["type"] == "send_ack"
+        assert ack["client_id"] == "c1"
+        assert isinstance(ack["message"]["id"], int)
+        assert ack["message"]["sender_username"] == "testuser"
+
+        ws.send_json({"type": "send", "receiver_id": 9999, "content": "nobody", "client_id": "c2"})
+        error = ws.receive_json()
+        assert error == {"type": "send_error", "client_id": "c2", "detail": "Recipient not found"}
+
+        for frame in ([1, 2], "send", 3):
+            ws.send_json(frame)
+            assert ws.receive_json() == {"type": "error", "message": "Invalid frame"}
+
+    messages = client.get(f"/chat/messages/{test_user2.id}", headers={"Authorization": f"Bearer {token}"}).json()
+    assert [m["content"] for m in messages] == ["over ws"]
+
+    # The recipient gets the same payload as for a REST send
+    token2 = client.post("/auth/token", data={"username": "testuser2", "password": "testpassword2"}).json()["access_token"]
+    with client.websocket_connect(f"/chat/ws/{test_user2.id}?token={token2}&last_seq=0") as ws:
+        replay = ws.receive_json()
+    assert replay["events"][0]["message"]["sender_username"] == "testuser"
+
+def test_batch_writer_coalesces_concurrent_sends(test_user, test_user2):
+    """Test that concurrent submissions share multi-row commits"""
+    from app.realtime.batch_writer import MessageBatchWriter
+
+    writer = MessageBatchWriter(max_rows=25, max_delay_ms=50)
+
+    async def scenario():
+        stored = await asyncio.gather(*[
+            writer.submit(test_user.id, test_user2.id, f"bulk {i}") for i in range(50)
+        ])
+        await writer.stop()
+        return stored
+
+    results = asyncio.run(scenario())
+    stored = [message for message, _ in results]
+    assert len({m.id for m in stored}) == 50
+    assert [m.content for m in stored] == [f"bulk {i}" for i in range(50)]
+    assert [event["seq"] for _, event in results] == list(range(1, 51))
+    assert writer.batches_flushed == 2
+
+    from app.models import ConversationSummary
+    with Session(engine) as session:
+        summary = session.get(ConversationSummary, (test_user2.id, test_user.id))
+        assert summary.unread_count == 50
+        assert summary.last_message_preview == "bulk 49"
+
+def test_offline_events_replayed_on_reconnect(test_user, test_user2):
+    """Test that events sent while offline are replayed after last_seq"""
+    token = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    token2 = client.post("/auth/token", data={"username": "testuser2", "password": "testpassword2"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    for i in range(3):
+        client.post("/chat/send", json={"content": f"offline {i}", "receiver_id": test_user2.id}, headers=headers)
+
+    with client.websocket_connect(f"/chat/ws/{test_user2.id}?token={token2}&last_seq=1") as ws:
+        replay = ws.receive_json()
+        assert replay["type"] == "replay"
+        assert replay["more"] is False
+        assert [e["seq"] for e in replay["events"]] == [2, 3]
+        assert [e["message"]["content"] for e in replay["events"]] == ["offline 1", "offline 2"]
+        done = ws.receive_json()
+        assert done["type"] == "replay_done" and done["seq"] == 3
+
+    with client.websocket_connect(f"/chat/ws/{test_user2.id}?token={token2}&last_seq=3") as ws:
+        assert ws.receive_json()["seq"] == 3
+
+def test_delivery_events_purged_and_lagging_clients_resync(test_user, test_user2):
+    """Test that old delivery events are purged and a client behind the floor is told to resync"""
+    from datetime import datetime, timedelta
+    from app.delivery import purge_delivery_events
+    from app.models import DeliveryEvent
+
+    token = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    token2 = client.post("/auth/token", data={"username": "testuser2", "password": "testpassword2"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    for i in range(3):
+        client.post("/chat/send", json={"content": f"old {i}", "receiver_id": test_user2.id}, headers=headers)
+    with Session(engine) as session:
+        for event in session.exec(select(DeliveryEvent).where(DeliveryEvent.seq < 3)):
+            event.created_at = datetime.utcnow() - timedelta(days=30)
+            session.add(event)
+        session.commit()
+
+    async def purge():
+        async with AsyncSession(async_engine, expire_on_commit=False) as db:
+            return await purge_delivery_events(db, retention=timedelta(days=1), batch_size=1)
+
+    assert asyncio.run(purge()) == 2
+
+    with client.websocket_connect(f"/chat/ws/{test_user2.id}?token={token2}&last_seq=0") as ws:
+        assert ws.receive_json() == {"type": "resync", "oldest_seq": 3}
+        replay = ws.receive_json()
+        assert [e["message"]["content"] for e in replay["events"]] == ["old 2"]
+        assert ws.receive_json()["type"] == "replay_done"
+
+    # Caught up past the floor: plain replay
+    with client.websocket_connect(f"/chat/ws/{test_user2.id}?token={token2}&last_seq=2") as ws:
+        assert ws.receive_json()["type"] == "replay"
+
+def test_websocket_handshake_auth_and_resume(test_user, test_user2):
+    """Test that sockets need a token for their own user and can resume from a cursor"""
+    from starlette.websockets import WebSocketDisconnect
+
+    token = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    token2 = client.post("/auth/token", data={"username": "testuser2", "password": "testpassword2"}).json()["access_token"]
+    for url in (f"/chat/ws/{test_user2.id}", f"/chat/ws/{test_user2.id}?token={token}", f"/call/signal/{test_user2.id}"):
+        with pytest.raises(WebSocketDisconnect) as rejected:
+            with client.websocket_connect(url) as ws:
+                ws.receive_json()
+        assert rejected.value.code == 4401
+
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post("/chat/send", json={"content": "one", "receiver_id": test_user2.id}, headers=headers)
+    with client.websocket_connect(f"/chat/ws/{test_user2.id}?token={token2}&last_seq=0") as ws:
+        assert ws.receive_json()["type"] == "replay"
+        ws.receive_json()
+        ws.send_json({"type": "checkpoint", "seq": 99})
+        checkpoint = ws.receive_json()
+        # Clamped to what the connection actually delivered
+        assert checkpoint["type"] == "resume_token" and checkpoint["seq"] == 1
+
+    # Resume tokens are not access tokens
+    assert client.get("/users/me", headers={"Authorization": f"Bearer {checkpoint['resume_token']}"}).status_code == 401
+
+    client.post("/chat/send", json={"content": "two", "receiver_id": test_user2.id}, headers=headers)
+    with client.websocket_connect(f"/chat/ws/{test_user2.id}?resume={checkpoint['resume_token']}") as ws:
+        replay = ws.receive_json()
+        assert [e["message"]["content"] for e in replay["events"]] == ["two"]
+
+def test_realtime_gateway_multiplexes_channels(test_user, test_user2):
+    """Test that one /rt socket carries chat and call traffic tagged by channel"""
+    token1 = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    token2 = client.post("/auth/token", data={"username": "testuser2", "password": "testpassword2"}).json()["access_token"]
+    headers1 = {"Authorization": f"Bearer {token1}"}
+
+    assert chat_manager.registry is call_manager.registry is registry
+    with client.websocket_connect(f"/rt?token={token2}") as ws:
+        assert len(registry) == 1
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+        ws.send_json({"channel": "chat", "type": "ping"})
+        assert ws.receive_json() == {"channel": "chat", "type": "pong"}
+
+        client.post("/chat/send", json={"content": "hi", "receiver_id": test_user2.id}, headers=headers1)
+        frame = ws.receive_json()
+        assert (frame["channel"], frame["type"], frame["message"]["content"]) == ("chat", "new_message", "hi")
+
+        # The gateway socket makes the user reachable for calls too
+        response = client.post("/call/initiate", json={"recipient_id": test_user2.id, "call_type": "audio"}, headers=headers1)
+        assert response.status_code == 200
+        frame = ws.receive_json()
+        assert (frame["channel"], frame["type"]) == ("call", "incoming_call")
+
+        ws.send_json({"channel": "call", "type": "call_response", "call_id": frame["call_id"], "response": "reject"})
+        ws.send_json({"channel": "nope", "type": "ping"})
+        assert ws.receive_json()["type"] == "error"
+    call_manager.calls.clear()
+    assert len(registry) == 0
+
+def test_online_list_and_last_seen(test_user, test_user2):
+    """Test presence lookups for given ids and conversation partners, and batched last_seen"""
+    token1 = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    token2 = client.post("/auth/token", data={"username": "testuser2", "password": "testpassword2"}).json()["access_token"]
+    headers1 = {"Authorization": f"Bearer {token1}"}
+    client.post("/chat/send", json={"content": "hi", "receiver_id": test_user2.id}, headers=headers1)
+
+    with client.websocket_connect(f"/rt?token={token2}"):
+        response = client.get(f"/users/online/list?user_ids={test_user2.id},{test_user.id}", headers=headers1)
+        assert response.status_code == 200
+        assert response.json() == {"online_count": 1, "users": [
+            {"user_id": test_user2.id, "online": True, "last_seen": response.json()["users"][0]["last_seen"]},
+            {"user_id": test_user.id, "online": False, "last_seen": None},
+        ]}
+        # Without ids: the caller's conversation partners
+        partners = client.get("/users/online/list", headers=headers1).json()
+        assert [(u["user_id"], u["online"]) for u in partners["users"]] == [(test_user2.id, True)]
+
+    # last_seen reaches the database only with the periodic flush
+    with Session(engine) as session:
+        assert session.get(User, test_user2.id).last_seen is None
+    asyncio.run(presence.flush_last_seen())
+    with Session(engine) as session:
+        assert session.get(User, test_user2.id).last_seen is not None
+
+    offline = client.get(f"/users/online/list?user_ids={test_user2.id}", headers=headers1).json()
+    assert offline["online_count"] == 0 and offline["users"][0]["last_seen"] is not None
+    assert client.get("/users/online/list?user_ids=a,b", headers=headers1).status_code == 400
+
 # Call Tests
 def test_initiate_call(test_user, test_user2):
     """Test initiating a call"""
@@ -276,6 +743,117 @@ def test_get_active_calls(test_user):
     data = response.json()
     assert isinstance(data, list)
 
+def test_suspend_calls_records_and_notifies(test_user, test_user2):
+    """Test that unfinished calls are stored and announced before shutdown"""
+    call_manager.calls.clear()
+    ringing = call_manager.create_call(test_user.id, test_user2.id, "audio")
+    active = call_manager.create_call(test_user2.id, test_user.id, "video")
+    call_manager.calls.get(active).status = "active"
+
+    asyncio.run(call_manager.suspend_calls())
+    call_manager.calls.clear()
+
+    with Session(engine) as session:
+        calls = session.exec(select(Call).order_by(Call.id)).all()
+    assert [(c.caller_id, c.status) for c in calls] == [(test_user.id, "missed"), (test_user2.id, "ended")]
+    assert all(c.end_time is not None for c in calls)
+
+    token = client.post("/auth/token", data={"username": "testuser2", "password": "testpassword2"}).json()["access_token"]
+    with client.websocket_connect(f"/chat/ws/{test_user2.id}?token={token}&last_seq=0") as ws:
+        replay = ws.receive_json()
+    assert {(e["call_id"], e["reason"]) for e in replay["events"]} == {
+        (ringing, "server_restart"), (active, "server_restart")
+    }
+
+def test_call_history_is_written_behind_and_paginated(test_user, test_user2):
+    """Test that call transitions are batched into Call rows and paged newest first"""
+    async def scenario():
+        rejected = call_manager.create_call(test_user.id, test_user2.id, "audio")
+        await call_manager.handle_call_response(rejected, test_user2.id, "reject")
+        answered = call_manager.create_call(test_user2.id, test_user.id, "video")
+        await call_manager.handle_call_response(answered, test_user.id, "accept")
+        # Placed and rejected within one flush: a single INSERT
+        assert len(call_history) == 2
+        await call_history.flush()
+        await call_manager.hang_up(answered, test_user2.id)
+        await call_history.flush()
+        third = call_manager.create_call(test_user.id, test_user2.id, "audio")
+        await call_history.flush()
+        return third
+
+    before = call_history.stats()
+    asyncio.run(scenario())
+    stats = call_history.stats()
+    assert stats["rows_inserted"] - before["rows_inserted"] == 3
+    assert stats["rows_updated"] - before["rows_updated"] == 1
+
+    with Session(engine) as session:
+        calls = session.exec(select(Call).order_by(Call.id)).all()
+    assert [(c.caller_id, c.status) for c in calls] == [
+        (test_user.id, "rejected"), (test_user2.id, "ended"), (test_user.id, "ringing")
+    ]
+    assert all(c.start_time is not None for c in calls)
+    assert calls[1].end_time is not None and calls[1].duration_seconds == 0
+
+    token = client.post("/auth/token", data={"username": "testuser2", "password": "testpassword2"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    first_page = client.get("/call/history?limit=2", headers=headers)
+    assert first_page.status_code == 200
+    assert [c["id"] for c in first_page.json()] == [calls[2].id, calls[1].id]
+    cursor = first_page.headers["X-Next-Cursor"]
+    second_page = client.get(f"/call/history?limit=2&cursor={cursor}", headers=headers)
+    assert [c["id"] for c in second_page.json()] == [calls[0].id]
+    assert "X-Next-Cursor" not in second_page.headers
+    assert client.get("/call/history?cursor=nope", headers=headers).status_code == 400
+
+def test_call_rooms(test_user, test_user2):
+    """Test creating, joining, signalling in and leaving a call room over HTTP and sockets"""
+    token1 = client.post("/auth/token", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    token2 = client.post("/auth/token", data={"username": "testuser2", "password": "testpassword2"}).json()["access_token"]
+    headers1 = {"Authorization": f"Bearer {token1}"}
+    headers2 = {"Authorization": f"Bearer {token2}"}
+
+    assert client.post("/call/rooms", json={"call_type": "fax"}, headers=headers1).status_code == 400
+    room = client.post("/call/rooms", json={"call_type": "video", "invite": [test_user2.id]}, headers=headers1).json()
+    assert room["participants"] == [test_user.id]
+    private = client.post("/call/rooms", json={"call_type": "audio"}, headers=headers1).json()
+
+    with client.websocket_connect(f"/call/signal/{test_user.id}?token={token1}") as ws1, \
+            client.websocket_connect(f"/call/signal/{test_user2.id}?token={token2}") as ws2:
+        # Unknown and uninvited rooms look the same
+        assert client.post("/call/rooms/nope/join", headers=headers2).status_code == 404
+        assert client.post(f"/call/rooms/{private['room_id']}/join", headers=headers2).status_code == 404
+
+        # A connected member keeps their slot
+        max_participants = call_manager.rooms.max_participants
+        call_manager.rooms.max_participants = 1
+        try:
+            response = client.post(f"/call/rooms/{room['room_id']}/join", headers=headers2)
+            assert response.status_code == 409
+        finally:
+            call_manager.rooms.max_participants = max_participants
+
+        # Signals from a non-member are dropped: the next frame is the pong
+        ws2.send_json({"type": "room_signal", "room_id": room["room_id"], "data": {"sdp": "x"}})
+        ws2.send_json({"type": "ping"})
+        assert ws2.receive_json()["type"] == "pong"
+        ws1.send_json({"type": "ping"})
+        assert ws1.receive_json()["type"] == "pong"
+
+        response = client.post(f"/call/rooms/{room['room_id']}/join", headers=headers2)
+        assert response.status_code == 200
+        joined = ws1.receive_json()
+        assert joined["type"] == "room_joined" and joined["participants"] == [test_user.id, test_user2.id]
+        assert ws2.receive_json()["type"] == "room_joined"
+
+        ws2.send_json({"type": "room_signal", "room_id": room["room_id"], "data": {"sdp": "y"}})
+        signal = ws1.receive_json()
+        assert signal["type"] == "room_signal" and signal["sender_id"] == test_user2.id
+        assert signal["data"] == {"sdp": "y"}
+
+        assert client.post(f"/call/rooms/{room['room_id']}/leave", headers=headers2).status_code == 200
+        assert ws1.receive_json()["type"] == "room_left"
+
 # Payment Tests
 def test_create_payment_intent(test_user, test_user2):
     """Test creating a payment intent"""
@@ -346,3 +924,14 @@ def test_invalid_user_id():
     response = client.get("/users/999", headers=headers)
     assert response.status_code == 404
     assert "User not found" in response.json()["detail"]
+
+# Database Tests
+def test_async_database_url(monkeypatch):
+    """Test the async driver URL mapping"""
+    from app.database import get_async_database_url
+
+    monkeypatch.setenv("DATABASE_URL", "postgresql://u:p@db:5432/app?sslmode=require&application_name=api")
+    assert get_async_database_url() == "postgresql+asyncpg://u:p@db:5432/app?application_name=api"
+
+    monkeypatch.setenv("DATABASE_URL", "sqlite:///./local.db")
+    assert get_async_database_url() == "sqlite+aiosqlite:///./local.db"
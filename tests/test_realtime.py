@@ -0,0 +1,678 @@
+import asyncio
+import json
+import time
+
+from app.cache import TTLCache
+from app.realtime.admission import CLOSE_TRY_LATER, AdmissionController
+from app.realtime.calls import CallRecord, CallRegistry
+from app.realtime.connection import CLOSE_SERVICE_RESTART, Connection
+from app.realtime.heartbeat import CLOSE_IDLE_TIMEOUT, HeartbeatScheduler
+from app.realtime.hub import ConnectionRegistry
+import pytest
+
+from app.realtime.pubsub import InProcessBus, InProcessPubSub, PubSubBackend
+from app.realtime.presence import PresenceRegistry
+from app.realtime.rooms import RoomFull, RoomNotFound
+from app.realtime.timers import TimerWheel
+from app.realtime.typing import TypingTracker
+from app.routers.call import SignalingManager
+from app.routers.chat import ConnectionManager
+
+
+class FakeWebSocket:
+    """Minimal stand-in for a Starlette WebSocket"""
+
+    def __init__(self, stalled=False):
+        self.sent = []
+        self.accepted = False
+        self.closed = None
+        self.unstall = asyncio.Event()
+        if not stalled:
+            self.unstall.set()
+
+    async def accept(self):
+        self.accepted = True
+
+    async def send_json(self, message):
+        await self.unstall.wait()
+        self.sent.append(message)
+
+    async def close(self, code=1000, reason=None):
+        self.closed = code
+        self.reason = reason
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, timeout=5))
+
+
+async def wait_until(predicate, timeout=1.0):
+    """Yield to the loop until predicate() holds or timeout expires"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.001)
+
+
+# Pub/sub Tests
+def test_chat_message_reaches_user_on_other_node():
+    """Test that a message published on node A is delivered on node B"""
+    async def scenario():
+        bus = InProcessBus()
+        node_a = ConnectionManager(InProcessPubSub("a", bus))
+        node_b = ConnectionManager(InProcessPubSub("b", bus))
+        ws = FakeWebSocket()
+        connection = await node_b.connect(7, ws)
+
+        assert await node_a.is_online(7)
+        await node_a.send_personal_message({"type": "new_message"}, 7)
+        await wait_until(lambda: ws.sent)
+        assert ws.sent == [{"type": "new_message"}]
+
+        await node_b.disconnect(connection)
+        assert not await node_a.is_online(7)
+
+    run(scenario())
+
+
+def test_routes_are_per_channel():
+    """Test that a call connection does not make a user reachable on chat"""
+    async def scenario():
+        bus = InProcessBus()
+        chat_a = ConnectionManager(InProcessPubSub("a", bus))
+        call_b = SignalingManager(InProcessPubSub("b", bus))
+        await call_b.connect(3, FakeWebSocket())
+
+        assert await call_b.is_online(3)
+        assert not await chat_a.is_online(3)
+
+    run(scenario())
+
+
+def test_call_answered_from_other_node():
+    """Test that a response on the callee's node reaches the node owning the call"""
+    async def scenario():
+        bus = InProcessBus()
+        node_a = SignalingManager(InProcessPubSub("a", bus))
+        node_b = SignalingManager(InProcessPubSub("b", bus))
+        caller = FakeWebSocket()
+        callee = FakeWebSocket()
+        await node_a.connect(1, caller)
+        await node_b.connect(2, callee)
+
+        call_id = await node_a.initiate_call(1, 2, "audio")
+        assert call_id.endswith("@a")
+        await wait_until(lambda: callee.sent)
+        assert callee.sent[0]["type"] == "incoming_call"
+
+        await node_b.respond(call_id, 2, "accept")
+        assert node_a.calls.get(call_id).status == "active"
+        await wait_until(lambda: caller.sent)
+        assert caller.sent[0]["type"] == "call_accepted"
+
+        await node_b.end(call_id, 2)
+        assert node_a.calls.get(call_id).status == "ended"
+
+    run(scenario())
+
+
+def test_backend_missing_methods_fails_on_creation():
+    """Test that an incomplete backend cannot be instantiated"""
+    class Incomplete(PubSubBackend):
+        async def claim(self, channel, user_id):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete("x")
+
+
+# Connection Tests
+def test_multi_device_fan_out_and_stalled_device():
+    """Test that every device receives frames and a stalled one delays only itself"""
+    async def scenario():
+        manager = ConnectionManager(InProcessPubSub("solo"))
+        phone = FakeWebSocket(stalled=True)
+        laptop = FakeWebSocket()
+        phone_conn = await manager.connect(5, phone)
+        await manager.connect(5, laptop)
+
+        for i in range(3):
+            await manager.send_personal_message({"n": i}, 5)
+        await wait_until(lambda: len(laptop.sent) == 3)
+        assert laptop.sent == [{"n": 0}, {"n": 1}, {"n": 2}]
+        assert phone.sent == []
+
+        phone.unstall.set()
+        await wait_until(lambda: len(phone.sent) == 3)
+        assert phone.sent == laptop.sent
+
+        await manager.disconnect(phone_conn)
+        assert await manager.is_online(5)
+
+    run(scenario())
+
+
+def test_slow_consumer_policies():
+    """Test drop-oldest, coalesce and disconnect on a full send queue"""
+    async def scenario():
+        ws = FakeWebSocket(stalled=True)
+        dropping = Connection(1, ws, max_queue=2, policy="drop_oldest")
+        for i in range(4):
+            dropping.send({"n": i})
+        assert [m for _, m in dropping._queue] == [{"n": 2}, {"n": 3}]
+        assert dropping.dropped == 2
+
+        coalescing = Connection(1, ws, max_queue=2, policy="coalesce")
+        coalescing.send({"typing": 1}, coalesce_key="typing")
+        coalescing.send({"typing": 2}, coalesce_key="typing")
+        assert coalescing.pending == 1
+
+        closed = []
+
+        async def on_close(connection):
+            closed.append(connection.id)
+
+        strict = Connection(1, ws, max_queue=1, policy="disconnect", on_close=on_close)
+        assert strict.send({"n": 0})
+        assert not strict.send({"n": 1})
+        await wait_until(lambda: closed)
+        assert closed == [strict.id]
+        assert ws.closed == 1013
+
+    run(scenario())
+
+
+def test_devices_split_across_nodes_all_receive():
+    """Test that a sender's node delivers locally and to the user's other nodes"""
+    async def scenario():
+        bus = InProcessBus()
+        node_a = ConnectionManager(InProcessPubSub("a", bus))
+        node_b = ConnectionManager(InProcessPubSub("b", bus))
+        phone = FakeWebSocket()
+        laptop = FakeWebSocket()
+        await node_a.connect(9, phone)
+        await node_b.connect(9, laptop)
+
+        await node_a.send(9, {"type": "typing", "user_id": 1}, coalesce_key=("typing", 1))
+        await wait_until(lambda: phone.sent and laptop.sent)
+        assert phone.sent == laptop.sent == [{"type": "typing", "user_id": 1}]
+
+    run(scenario())
+
+
+def test_closed_connection_writer_exits():
+    """Test that closing a connection stops its writer task"""
+    async def scenario():
+        connection = Connection(1, FakeWebSocket())
+        connection.start()
+        connection.send({"n": 1})
+        await connection.close()
+        await asyncio.wait_for(asyncio.gather(connection._writer, return_exceptions=True), 1)
+        assert connection._writer.done()
+
+    run(scenario())
+
+
+# Typing Tests
+def test_typing_tracker_emits_only_transitions():
+    """Test that keystroke frames collapse into start/stop events"""
+    async def scenario():
+        events = []
+
+        async def emit(sender_id, recipient_id, is_typing):
+            events.append((sender_id, recipient_id, is_typing))
+
+        tracker = TypingTracker(emit, timeout=0.05)
+        for _ in range(100):
+            await tracker.update(1, 2)
+        await tracker.update(3, 2)
+        assert events == [(1, 2, True), (3, 2, True)]
+
+        await tracker.update(1, 2, is_typing=False)
+        assert events[-1] == (1, 2, False)
+
+        # Sender 3 goes quiet and expires
+        await wait_until(lambda: not tracker.is_typing(3, 2))
+        assert events == [(1, 2, True), (3, 2, True), (1, 2, False), (3, 2, False)]
+        assert tracker.updates == 102
+
+    run(scenario())
+
+
+def test_typing_tracker_refresh_delays_expiry_and_clears_on_offline():
+    """Test that refreshes keep typing alive and going offline stops it"""
+    async def scenario():
+        events = []
+
+        async def emit(sender_id, recipient_id, is_typing):
+            events.append((sender_id, recipient_id, is_typing))
+
+        tracker = TypingTracker(emit, timeout=0.05)
+        await tracker.update(1, 2)
+        for _ in range(5):
+            await asyncio.sleep(0.02)
+            await tracker.update(1, 2)
+        assert events == [(1, 2, True)]
+
+        await tracker.update(1, 3)
+        await tracker.clear_sender(1)
+        assert sorted(events[2:]) == [(1, 2, False), (1, 3, False)]
+        await asyncio.sleep(0.08)
+        assert len(events) == 4
+
+    run(scenario())
+
+
+# Cache Tests
+def test_ttl_cache_expiry_and_lru_eviction():
+    """Test TTL expiry and LRU eviction counters"""
+    now = [0.0]
+    cache = TTLCache(max_size=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # evicts "b", the least recently used
+    assert cache.get("b") is None
+    cache.set("d", 4, ttl=1)  # evicts "a"
+    now[0] = 2
+    assert cache.get("d") is None
+    assert cache.get("c") == 3
+    assert cache.stats() == {"size": 1, "max_size": 2, "hits": 2, "misses": 2, "evictions": 3}
+
+
+# Password hashing Tests
+def test_password_hasher_rejects_when_full():
+    """Test that the bounded hasher refuses work beyond its queue with 503"""
+    import threading
+    from fastapi import HTTPException
+    from passlib.context import CryptContext
+    from app.hashing import PasswordHasher
+
+    release = threading.Event()
+
+    class SlowContext:
+        def hash(self, password):
+            release.wait(2)
+            return "hashed:" + password
+
+    hasher = PasswordHasher(SlowContext(), workers=1, max_queue=1, retry_after=3)
+
+    async def scenario():
+        running = [asyncio.create_task(hasher.hash(str(i))) for i in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as busy:
+            await hasher.hash("overflow")
+        assert busy.value.status_code == 503
+        assert busy.value.headers == {"Retry-After": "3"}
+        release.set()
+        assert await asyncio.gather(*running) == ["hashed:0", "hashed:1"]
+        assert hasher.stats()["in_flight"] == 0
+        assert hasher.rejected == 1
+
+        real = PasswordHasher(CryptContext(schemes=["bcrypt"], deprecated="auto"), workers=2)
+        assert await real.verify("secret", await real.hash("secret"))
+
+    run(scenario())
+
+
+# Admission Tests
+def test_admission_token_bucket_and_connection_cap():
+    """Test accept-rate limiting, the connection cap and jittered retry hints"""
+    now = [0.0]
+    controller = AdmissionController(
+        rate=10, burst=5, max_connections=8, retry_min_ms=100, retry_max_ms=5000, clock=lambda: now[0]
+    )
+    assert [controller.try_admit() for _ in range(5)] == [None] * 5
+    hints = [controller.try_admit() for _ in range(20)]
+    assert all(100 <= hint <= 5000 for hint in hints)
+    # Later refusals in the same burst are spread over a longer window
+    assert max(hints[10:]) > 200
+
+    now[0] = 0.3  # three tokens refilled
+    assert [controller.try_admit() is None for _ in range(4)] == [True, True, True, False]
+
+    controller.active = 8
+    now[0] = 10.0
+    assert controller.try_admit() is not None
+    assert controller.stats()["admitted"] == 8
+
+
+def test_hub_refuses_handshake_with_retry_hint():
+    """Test that a refused socket is closed with 4429 and counted otherwise"""
+    async def scenario():
+        controller = AdmissionController(rate=1, burst=1, max_connections=10, retry_min_ms=100, retry_max_ms=200)
+        hub = ConnectionManager(admission=controller)
+        first, second = FakeWebSocket(), FakeWebSocket()
+        assert await hub.admit(first)
+        connection = await hub.connect(1, first)
+        assert controller.active == 1
+
+        assert not await hub.admit(second)
+        assert second.closed == CLOSE_TRY_LATER
+        assert 100 <= json.loads(second.reason)["retry_after_ms"] <= 200
+
+        await hub.disconnect(connection)
+        assert controller.active == 0
+
+    run(scenario())
+
+
+def test_hub_drain_flushes_then_hands_off():
+    """Test that draining writes queued frames, then a staggered reconnect frame, then closes"""
+    async def scenario():
+        controller = AdmissionController(rate=100, burst=10, max_connections=10)
+        hub = ConnectionManager(admission=controller)
+        stalled = FakeWebSocket(stalled=True)
+        connection = await hub.connect(1, stalled)
+        other = await hub.connect(2, FakeWebSocket())
+        connection.send({"type": "new_message", "seq": 7})
+
+        controller.stop_accepting()
+        assert not await hub.admit(FakeWebSocket())
+
+        drain = asyncio.create_task(hub.registry.drain(spread_ms=1000, timeout=1))
+        await asyncio.sleep(0)
+        assert connection.websocket.closed is None
+        stalled.unstall.set()
+        await drain
+
+        assert [frame["type"] for frame in stalled.sent] == ["new_message", "reconnect"]
+        assert 0 <= stalled.sent[-1]["retry_after_ms"] < 1000
+        assert stalled.closed == CLOSE_SERVICE_RESTART
+        assert other.websocket.closed == CLOSE_SERVICE_RESTART
+        assert not hub.connections and controller.active == 0
+
+    run(scenario())
+
+
+def test_reconnect_spread_scales_with_connections():
+    """Test that handed-off clients are spread so the accept rate can absorb them"""
+    controller = AdmissionController(rate=100, retry_max_ms=30000)
+    assert controller.reconnect_spread_ms(10, min_spread_ms=5000) == 5000
+    assert controller.reconnect_spread_ms(1000, min_spread_ms=5000) == 10000
+    assert controller.reconnect_spread_ms(10 ** 6, min_spread_ms=5000) == 30000
+
+
+# Heartbeat Tests
+def test_heartbeat_wheel_pings_and_reaps_idle_sockets():
+    """Test that each socket is pinged once per round and silent ones are reaped"""
+    async def scenario():
+        offset = [0.0]
+        # Long interval: the background task never ticks during the test
+        scheduler = HeartbeatScheduler(
+            interval=100, idle_timeout=30, slots=4, clock=lambda: time.monotonic() + offset[0]
+        )
+        hub = ConnectionManager(registry=ConnectionRegistry(heartbeat=scheduler))
+        quiet, chatty = FakeWebSocket(), FakeWebSocket()
+        quiet_conn = await hub.connect(1, quiet)
+        chatty_conn = await hub.connect(2, chatty)
+        assert len(scheduler) == 2
+
+        for _ in range(4):
+            await scheduler.tick()
+        await quiet_conn.wait_drained()
+        assert quiet.sent == [{"type": "ping"}] and chatty.sent == [{"type": "ping"}]
+
+        offset[0] = 31
+        chatty_conn.touch()
+        chatty_conn.last_seen += offset[0]
+        for _ in range(4):
+            await scheduler.tick()
+
+        assert quiet.closed == CLOSE_IDLE_TIMEOUT
+        assert chatty.closed is None
+        assert list(hub.connections) == [2] and len(scheduler) == 1
+        assert scheduler.stats()["reaped_idle"] == 1 and scheduler.stats()["pings_sent"] == 3
+
+        await hub.disconnect(chatty_conn)
+        assert len(scheduler) == 0
+
+    run(scenario())
+
+
+# Call Registry Tests
+def test_call_registry_indexes_users_and_evicts_finished_calls():
+    """Test per-user lookups and that finished calls are dropped after retention"""
+    async def scenario():
+        calls = CallRegistry(retention=0.05)
+        first = CallRecord("1@a", 1, 2, "audio")
+        second = CallRecord("2@a", 2, 3, "video")
+        calls.add(first)
+        calls.add(second)
+        assert [call.call_id for call in calls.for_user(2)] == ["1@a", "2@a"]
+        assert calls.for_user(4) == []
+
+        first.status = "active"
+        first.answered_at = first.created_at
+        calls.finish(first, "ended")
+        assert first.finished and first.duration_seconds is not None
+        # Still visible for late hang-ups until retention passes
+        assert "1@a" in calls
+        await wait_until(lambda: "1@a" not in calls)
+
+        assert [call.call_id for call in calls.for_user(2)] == ["2@a"]
+        assert calls.for_user(1) == []
+        assert calls.stats() == {"calls": 1, "finished": 0, "users": 2, "evicted": 1}
+
+    run(scenario())
+
+
+# Timer Tests
+def test_timer_wheel_fires_due_timers_and_cancels_cheaply():
+    """Test that timers fire once after their delay, across rounds, unless cancelled"""
+    async def scenario():
+        now = [0.0]
+        wheel = TimerWheel(resolution_ms=100, slots=8, clock=lambda: now[0])
+        fired = []
+
+        async def ring(name):
+            fired.append(name)
+
+        wheel.schedule(0.25, ring, "soon")
+        # 2s is more than one round of the 0.8s wheel
+        wheel.schedule(2.0, ring, "later")
+        cancelled = [wheel.schedule(0.25, fired.append, i) for i in range(1000)]
+        for timer in cancelled:
+            wheel.cancel(timer)
+        assert len(wheel) == 2
+
+        now[0] = 0.2
+        await wheel.advance()
+        assert fired == []
+        now[0] = 0.3
+        await wheel.advance()
+        assert fired == ["soon"]
+        now[0] = 1.5
+        await wheel.advance()
+        assert fired == ["soon"]
+        now[0] = 2.05
+        await wheel.advance()
+        assert fired == ["soon", "later"] and len(wheel) == 0
+        assert wheel.stats()["fired"] == 2 and wheel.stats()["cancelled"] == 1000
+
+    run(scenario())
+
+
+def test_unanswered_call_is_missed_and_answered_call_is_not():
+    """Test that the ring timeout reports missed calls to both parties only while ringing"""
+    async def scenario():
+        now = [0.0]
+        wheel = TimerWheel(resolution_ms=100, slots=16, clock=lambda: now[0])
+        hub = SignalingManager(timers=wheel, ring_timeout=30)
+        caller, callee = FakeWebSocket(), FakeWebSocket()
+        await hub.connect(1, caller)
+        await hub.connect(2, callee)
+
+        unanswered = await hub.initiate_call(1, 2, "audio")
+        answered = await hub.initiate_call(2, 1, "video")
+        await hub.respond(answered, 1, "accept")
+        assert len(wheel) == 1
+        answered_at = hub.calls.get(answered).answered_at
+        # Answering twice does not restart the call
+        await hub.respond(answered, 1, "accept")
+        assert hub.calls.get(answered).answered_at == answered_at
+
+        # Bogus responses, the caller's own and a third party's leave it ringing
+        await hub.respond(unanswered, 2, "maybe")
+        await hub.respond(unanswered, 1, "accept")
+        await hub.respond(unanswered, 3, "accept")
+        await hub.respond(unanswered, 3, "reject")
+        assert hub.calls.get(unanswered).status == "ringing" and len(wheel) == 1
+
+        now[0] = 30.1
+        await wheel.advance()
+        assert hub.calls.get(unanswered).status == "missed"
+        assert hub.calls.get(answered).status == "active"
+        await wait_until(lambda: any(m["type"] == "call_missed" for m in caller.sent))
+        await wait_until(lambda: any(m["type"] == "call_missed" for m in callee.sent))
+        assert len(wheel) == 0
+
+    run(scenario())
+
+
+def test_ice_candidates_are_batched_and_sdp_is_not():
+    """Test that candidates are coalesced per call while SDP is relayed in order at once"""
+    async def scenario():
+        hub = SignalingManager(ice_batch_ms=20)
+        callee = FakeWebSocket()
+        connection = await hub.connect(2, callee)
+
+        offer = {"type": "offer", "sdp": "v=0"}
+        await hub.signals.relay(1, 2, "c1", {"candidate": "a", "sdpMid": "0"})
+        await hub.signals.relay(1, 2, "c1", {"type": "candidate", "candidate": "b"})
+        await hub.signals.relay(1, 2, "c1", offer)
+        for candidate in ("c", "d", "e"):
+            await hub.signals.relay(1, 2, "c1", {"candidate": candidate})
+        # Another call's candidates are batched separately
+        await hub.signals.relay(1, 2, "c2", {"candidate": "x"})
+        await connection.wait_drained()
+        assert [frame["type"] for frame in callee.sent] == ["webrtc_signal_batch", "webrtc_signal"]
+        assert [s["candidate"] for s in callee.sent[0]["signals"]] == ["a", "b"]
+        assert callee.sent[1] == {"type": "webrtc_signal", "data": offer, "sender_id": 1, "call_id": "c1"}
+
+        await wait_until(lambda: len(callee.sent) == 4)
+        batches = {frame["call_id"]: [s["candidate"] for s in frame["signals"]] for frame in callee.sent[2:]}
+        assert batches == {"c1": ["c", "d", "e"], "c2": ["x"]}
+        assert hub.signals.stats()["signals"] == 7 and hub.signals.stats()["frames"] == 4
+
+        await hub.disconnect(connection)
+
+    run(scenario())
+
+
+# Call Room Tests
+def test_call_room_fans_out_to_members_across_nodes():
+    """Test room joins, signals and leaves reach only members, wherever the room lives"""
+    async def scenario():
+        bus = InProcessBus()
+        node_a = SignalingManager(InProcessPubSub("a", bus), max_room_participants=3)
+        node_b = SignalingManager(InProcessPubSub("b", bus), max_room_participants=3)
+        sockets = {user_id: FakeWebSocket() for user_id in (1, 2, 3, 4, 5)}
+        for user_id in (1, 2, 4):
+            await node_a.connect(user_id, sockets[user_id])
+        for user_id in (3, 5):
+            await node_b.connect(user_id, sockets[user_id])
+
+        room = await node_a.create_room(1, "video", invite=[2, 3, 4])
+        assert room.room_id.endswith("@a")
+        await node_a.join(room.room_id, 2)
+        # Joined from the other node: forwarded to the owner
+        await node_b.join(room.room_id, 3)
+        await wait_until(lambda: len(room) == 3)
+        await wait_until(lambda: any(m["type"] == "room_joined" for m in sockets[3].sent))
+
+        with pytest.raises(RoomFull):
+            await node_a.join(room.room_id, 4)
+        # A member on the other node invites user 5, who finds the room full
+        await node_b.invite(room.room_id, 3, [5])
+        await wait_until(lambda: sockets[5].sent)
+        assert sockets[5].sent[0]["type"] == "room_invitation"
+        await node_b.join(room.room_id, 5)
+        await wait_until(lambda: len(sockets[5].sent) == 2)
+        assert sockets[5].sent[1] == {"type": "room_error", "room_id": room.room_id, "reason": "full"}
+        node_b.remote_rooms.pop(5)
+        # Uninvited users and unknown ids look the same
+        with pytest.raises(RoomNotFound):
+            await node_a.join(room.room_id, 6)
+        with pytest.raises(RoomNotFound):
+            await node_a.join("room_9_1@a", 4)
+
+        for socket in sockets.values():
+            socket.sent.clear()
+        await node_b.signal_room(room.room_id, 3, {"type": "offer", "sdp": "v=0"})
+        await wait_until(lambda: sockets[1].sent and sockets[2].sent)
+        assert sockets[1].sent[0] == {
+            "type": "room_signal", "room_id": room.room_id, "sender_id": 3, "data": {"type": "offer", "sdp": "v=0"}
+        }
+        await node_a.signal_room(room.room_id, 1, {"type": "answer"}, recipient_id=3)
+        await wait_until(lambda: sockets[3].sent)
+        await asyncio.sleep(0.01)
+        assert [len(sockets[user_id].sent) for user_id in (1, 2, 3, 4, 5)] == [1, 1, 1, 0, 0]
+
+        # Going offline leaves every room the user is in
+        await node_a.disconnect(next(iter(node_a.user_connections(2))))
+        assert room.participants == [1, 3]
+        await wait_until(lambda: any(m["type"] == "room_left" for m in sockets[3].sent))
+        # ...including rooms owned by another node
+        await node_b.disconnect(next(iter(node_b.user_connections(3))))
+        await wait_until(lambda: room.participants == [1])
+        assert node_b.remote_rooms == {}
+        await node_a.leave(room.room_id, 1)
+        assert len(node_a.rooms) == 0
+
+    run(scenario())
+
+
+def test_full_room_drops_members_connected_nowhere():
+    """Test that a member whose worker vanished does not hold a slot forever"""
+    async def scenario():
+        hub = SignalingManager(max_room_participants=2)
+        await hub.connect(1, FakeWebSocket())
+        await hub.connect(2, FakeWebSocket())
+        room = await hub.create_room(1, "audio", invite=[2, 7])
+        # 7 joined through a worker that has since gone away
+        hub.rooms.join(room.room_id, 7)
+
+        await hub.join(room.room_id, 2)
+        assert room.participants == [1, 2]
+
+    run(scenario())
+
+
+# Presence Tests
+def test_presence_pushes_only_real_transitions():
+    """Test that flaps are coalesced and users online on another worker stay online"""
+    async def scenario():
+        bus = InProcessBus()
+        presence = PresenceRegistry(InProcessPubSub("a", bus), push_interval=100)
+        other_node = InProcessPubSub("b", bus)
+        pushed = []
+
+        async def handler(frames):
+            pushed.append([(frame["user_id"], frame["online"]) for frame in frames])
+
+        presence.subscribe(handler)
+        presence.connected(1)
+        presence.connected(2)
+        await presence.push_changes()
+        assert pushed == [[(1, True), (2, True)]]
+
+        # A reconnect within one push interval is not a transition
+        presence.disconnected(1)
+        presence.connected(1)
+        await presence.push_changes()
+        assert len(pushed) == 1
+
+        # Still connected through another worker
+        await other_node.claim("chat", 2)
+        presence.disconnected(2)
+        await presence.push_changes()
+        assert len(pushed) == 1
+        assert await presence.online([1, 2, 3]) == {1, 2}
+
+        presence.disconnected(1)
+        await presence.push_changes()
+        assert pushed[-1] == [(1, False)]
+        assert not presence.is_local(1)
+
+    run(scenario())